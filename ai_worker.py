@@ -0,0 +1,424 @@
+import functools
+import multiprocessing
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+
+import evaluate
+import metrics
+
+# Tính nước đi của máy ngoài luồng xử lý request. Tìm kiếm tốn CPU nên chạy
+# trong một nhóm tiến trình có giới hạn; request chỉ nhận mã công việc rồi
+# trả về ngay, trình duyệt hỏi lại kết quả qua /ai_job/<mã>.
+#
+# Công việc là một hàm kiểu evaluate.choose_move (trả về (nước đi, điểm)),
+# nên tiến trình con chỉ nạp evaluate/engine chứ không nạp ứng dụng Flask.
+# Mỗi công việc có một ô trong mảng dùng chung với tiến trình con: sau mỗi
+# độ sâu tìm xong, tiến trình con ghi nước tốt nhất hiện có vào ô. Quá hạn
+# thì request dùng nước đó và bật cờ dừng để tiến trình con thôi tìm kiếm.
+#
+# Công việc chỉ nằm trong worker đã nhận nó, còn kết quả được ghi vào kho
+# kết quả dùng chung (AI_JOB_STORE=sqlite, mặc định, như session): request
+# hỏi lại rơi vào worker khác vẫn chờ và nhận được nước đi. Kết quả được lấy
+# đúng một lần ('done'); các request đến sau (tải lại trang cùng lúc với hỏi
+# /ai_job) nhận 'taken' kèm cùng nước đi, nên không ghi lịch sử hai lần và
+# không gửi lại công việc từ bàn cờ cũ.
+AI_WORKERS = int(os.environ.get('AI_WORKERS', min(4, os.cpu_count() or 1)))
+AI_QUEUE_LIMIT = int(os.environ.get('AI_QUEUE_LIMIT', AI_WORKERS * 8))
+JOB_GRACE = 2  # Giây chờ thêm ngoài thời gian suy nghĩ trước khi coi là quá hạn
+JOB_TTL = 120  # Công việc không ai lấy kết quả sẽ bị xóa sau chừng này giây
+POLL_WAIT = 1  # Thời gian tối đa một lần hỏi kết quả được phép chờ
+REMOTE_POLL = 0.05  # Chu kỳ đọc kho khi chờ công việc của worker khác
+AI_JOB_STORE = os.environ.get('AI_JOB_STORE', 'sqlite')
+AI_JOB_DB = os.environ.get('AI_JOB_DB', 'ai_jobs.db')
+CLEANUP_INTERVAL = 60
+BUSY_TIMEOUT_MS = 5000
+# Mỗi ô: độ sâu đã tìm xong (0 là chưa có), nước đi, cờ dừng
+SLOT_DEPTH, SLOT_MOVE, SLOT_STOP, SLOT_FIELDS = 0, 1, 2, 3
+
+_progress = None  # Mảng dùng chung, gán trong tiến trình con
+
+
+class QueueFull(Exception):
+    pass
+
+
+def _init_child(progress):
+    global _progress
+    _progress = progress
+
+
+def _report(slot, move, score, depth):
+    base = slot * SLOT_FIELDS
+    _progress[base + SLOT_MOVE] = move
+    _progress[base + SLOT_DEPTH] = depth
+
+
+def _stopped(slot):
+    return _progress[slot * SLOT_FIELDS + SLOT_STOP] != 0
+
+
+def _run(func, args, time_budget, deadline, slot):
+    # Chạy trong tiến trình con. Nếu đã chờ lâu trong hàng đợi thì chỉ còn
+    # phần thời gian còn lại: tìm kiếm sâu dần trả về nước tốt nhất đã tìm được.
+    started = time.time()
+    budget = max(0, min(time_budget, deadline - JOB_GRACE - started))
+    kwargs = {}
+    if slot is not None and _progress is not None:
+        kwargs = {'on_depth': functools.partial(_report, slot),
+                  'should_stop': functools.partial(_stopped, slot)}
+    move = func(*args, time_budget=budget, **kwargs)[0]
+    return move, started, time.time(), evaluate.search_stats()
+
+
+def _warm():
+    # Chạy trong tiến trình con mới: nạp sẵn bảng nước đi và sách khai cuộc
+    started = time.time()
+    evaluate.warm_up()
+    return time.time() - started
+
+
+def _record(wait_time, compute_time, stats):
+    metrics.ai_wait_seconds.observe(max(0, wait_time))
+    metrics.ai_compute_seconds.observe(compute_time)
+    if 'table' in stats:
+        metrics.ai_table_lookups.inc(result=stats['table'])
+    if stats.get('tt_hits'):
+        metrics.ai_cache_hits.inc(stats['tt_hits'])
+    if 'nodes' in stats:
+        metrics.ai_search_nodes.observe(stats['nodes'])
+        metrics.ai_search_depth.observe(stats['depth'])
+
+
+class MemoryJobStore:
+    # Kết quả công việc trong tiến trình, chỉ dùng khi chạy một worker
+
+    def __init__(self):
+        self._jobs = {}  # job_id -> [hạn chót, nước đi hoặc None, đã lấy, lúc gửi]
+        self._lock = threading.Lock()
+
+    def add(self, job_id, deadline):
+        now = time.time()
+        with self._lock:
+            self._jobs[job_id] = [deadline, None, False, now]
+            for key, entry in list(self._jobs.items()):
+                if entry[3] < now - JOB_TTL:
+                    del self._jobs[key]
+
+    def finish(self, job_id, move):
+        # Chỉ kết quả ghi đầu tiên được giữ
+        with self._lock:
+            entry = self._jobs.get(job_id)
+            if entry is not None and entry[1] is None:
+                entry[1] = move
+
+    def take(self, job_id):
+        # Trả về (trạng thái, nước đi, hạn chót) hoặc None nếu không có công
+        # việc; trạng thái 'pending', 'done' (lần lấy đầu) hoặc 'taken'
+        with self._lock:
+            entry = self._jobs.get(job_id)
+            if entry is None:
+                return None
+            deadline, move, taken = entry[:3]
+            if move is None:
+                return 'pending', None, deadline
+            entry[2] = True
+            return 'taken' if taken else 'done', move, deadline
+
+    def delete(self, job_id):
+        with self._lock:
+            self._jobs.pop(job_id, None)
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS ai_jobs (
+    id TEXT PRIMARY KEY,
+    deadline REAL NOT NULL,
+    move INTEGER,
+    taken INTEGER NOT NULL DEFAULT 0,
+    submitted REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ai_jobs_submitted ON ai_jobs (submitted);
+"""
+
+
+class SQLiteJobStore:
+    # Kết quả công việc trong SQLite (WAL), dùng chung giữa các worker
+
+    def __init__(self, path=AI_JOB_DB):
+        self.path = path
+        self._local = threading.local()
+        self._next_cleanup = 0
+
+    def _conn(self):
+        key = os.getpid()
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != key:
+            conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_MS / 1000,
+                                   isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA busy_timeout=%d' % BUSY_TIMEOUT_MS)
+            conn.executescript(SCHEMA)
+            self._local.conn = conn
+            self._local.pid = key
+        return conn
+
+    def add(self, job_id, deadline):
+        now = time.time()
+        conn = self._conn()
+        conn.execute('INSERT INTO ai_jobs (id, deadline, submitted) VALUES (?, ?, ?)',
+                     (job_id, deadline, now))
+        if now >= self._next_cleanup:
+            self._next_cleanup = now + CLEANUP_INTERVAL
+            conn.execute('DELETE FROM ai_jobs WHERE submitted < ?', (now - JOB_TTL,))
+
+    def finish(self, job_id, move):
+        self._conn().execute('UPDATE ai_jobs SET move = ? WHERE id = ? AND move IS NULL',
+                             (move, job_id))
+
+    def take(self, job_id):
+        conn = self._conn()
+        first = conn.execute(
+            'UPDATE ai_jobs SET taken = 1 WHERE id = ? AND move IS NOT NULL AND taken = 0',
+            (job_id,)).rowcount == 1
+        row = conn.execute('SELECT deadline, move FROM ai_jobs WHERE id = ?',
+                           (job_id,)).fetchone()
+        if row is None:
+            return None
+        deadline, move = row
+        if move is None:
+            return 'pending', None, deadline
+        return 'done' if first else 'taken', move, deadline
+
+    def delete(self, job_id):
+        self._conn().execute('DELETE FROM ai_jobs WHERE id = ?', (job_id,))
+
+
+def create_store(kind=AI_JOB_STORE):
+    if kind == 'sqlite':
+        return SQLiteJobStore(AI_JOB_DB)
+    if kind == 'memory':
+        return MemoryJobStore()
+    raise ValueError('Kiểu lưu kết quả công việc không hỗ trợ: %s' % kind)
+
+
+class _Job:
+
+    def __init__(self, future, func, args, submitted, deadline, slot):
+        self.future = future
+        self.func = func
+        self.args = args
+        self.submitted = submitted
+        self.deadline = deadline
+        self.slot = slot
+
+
+class AIPool:
+
+    def __init__(self, workers=AI_WORKERS, queue_limit=AI_QUEUE_LIMIT, store=None):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.store = store if store is not None else create_store()
+        self._executor = None
+        self._pid = None
+        self._jobs = {}
+        self._lock = threading.Lock()
+        # Ô của công việc trong mảng dùng chung; ô được trả lại khi công
+        # việc kết thúc (tiến trình con không còn ghi vào)
+        self._slots = max(1, queue_limit) * 2
+        self._progress = None
+        self._free_slots = []
+        self._slot_lock = threading.Lock()
+        self.submitted = 0
+        self.completed = 0
+        self.timed_out = 0
+        self.rejected = 0
+        self.wait_seconds = 0.0
+        self.compute_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def _get_executor(self):
+        # Tạo nhóm tiến trình khi cần, và tạo lại sau khi gunicorn fork worker.
+        # Dùng 'spawn' vì fork một tiến trình nhiều luồng không an toàn.
+        if self._executor is None or self._pid != os.getpid():
+            context = multiprocessing.get_context('spawn')
+            self._progress = context.RawArray('i', self._slots * SLOT_FIELDS)
+            self._free_slots = list(range(self._slots))
+            self._executor = ProcessPoolExecutor(
+                self.workers, mp_context=context, initializer=_init_child,
+                initargs=(self._progress,))
+            self._pid = os.getpid()
+            self._jobs = {}
+        return self._executor
+
+    def _take_slot(self):
+        with self._slot_lock:
+            if not self._free_slots:
+                return None
+            slot = self._free_slots.pop()
+        base = slot * SLOT_FIELDS
+        self._progress[base + SLOT_DEPTH] = 0
+        self._progress[base + SLOT_MOVE] = -1
+        self._progress[base + SLOT_STOP] = 0
+        return slot
+
+    def _release_slot(self, progress, slot):
+        # progress: mảng lúc tạo công việc, bỏ qua nếu nhóm đã được tạo lại
+        with self._slot_lock:
+            if progress is self._progress:
+                self._free_slots.append(slot)
+
+    def best_so_far(self, job):
+        # Nước tốt nhất tiến trình con đã tìm xong cho công việc, hoặc None
+        if job.slot is None:
+            return None
+        base = job.slot * SLOT_FIELDS
+        if self._progress[base + SLOT_DEPTH] == 0:
+            return None
+        return self._progress[base + SLOT_MOVE]
+
+    def _stop(self, job):
+        # Ô chỉ được trả lại sau khi công việc kết thúc, nên kiểm tra và ghi
+        # dưới cùng khóa để không bật cờ dừng cho công việc khác dùng lại ô
+        if job.slot is None:
+            return
+        with self._slot_lock:
+            if not job.future.done():
+                self._progress[job.slot * SLOT_FIELDS + SLOT_STOP] = 1
+
+    def warm_up(self):
+        # Khởi động đủ tiến trình con và nạp sẵn dữ liệu trong từng tiến trình,
+        # để nước đi đầu tiên không phải chờ; trả về các future
+        with self._lock:
+            executor = self._get_executor()
+            return [executor.submit(_warm) for _ in range(self.workers)]
+
+    def pending(self):
+        return sum(1 for job in list(self._jobs.values()) if not job.future.done())
+
+    def submit(self, func, args, time_budget):
+        # Trả về mã công việc; QueueFull nếu hàng đợi đã đầy (back-pressure)
+        with self._lock:
+            executor = self._get_executor()
+            self._expire()
+            if self.pending() >= self.queue_limit:
+                self.rejected += 1
+                raise QueueFull()
+            submitted = time.time()
+            deadline = submitted + time_budget + JOB_GRACE
+            slot = self._take_slot()
+            job_id = secrets.token_hex(8)
+            self.store.add(job_id, deadline)
+            future = executor.submit(_run, func, args, time_budget, deadline, slot)
+            if slot is not None:
+                future.add_done_callback(
+                    lambda _, progress=self._progress, slot=slot:
+                    self._release_slot(progress, slot))
+            future.add_done_callback(
+                lambda future, job_id=job_id: self._store_result(job_id, future))
+            self._jobs[job_id] = _Job(future, func, args, submitted, deadline, slot)
+            self.submitted += 1
+            return job_id
+
+    def _store_result(self, job_id, future):
+        # Tiến trình con tính xong: ghi kết quả để worker khác cũng đọc được
+        if not future.cancelled() and future.exception() is None:
+            self.store.finish(job_id, future.result()[0])
+
+    def _take(self, job_id, wait=0):
+        # Đọc kết quả từ kho dùng chung; công việc của worker khác thì chờ tối
+        # đa wait giây. Quá hạn mà vẫn chưa có kết quả (worker giữ công việc đã
+        # dừng) thì coi như mất: ('unknown', None).
+        until = time.time() + wait
+        while True:
+            entry = self.store.take(job_id)
+            if entry is None:
+                return 'unknown', None
+            status, move, deadline = entry
+            if status != 'pending':
+                return status, move
+            now = time.time()
+            if now > deadline + JOB_GRACE:
+                return 'unknown', None
+            if now >= until:
+                return 'pending', None
+            time.sleep(min(REMOTE_POLL, until - now))
+
+    def result(self, job_id, wait=POLL_WAIT):
+        # Trả về ('pending', None), ('done', nước đi), ('taken', nước đi) nếu
+        # request khác đã lấy kết quả, hoặc ('unknown', None) nếu công việc
+        # không còn. Quá hạn thì dùng nước tốt nhất tiến trình con đã tìm xong
+        # và dừng công việc; nếu chưa có (công việc chưa chạy tới độ sâu 1)
+        # thì tính nhanh một nước với thời gian 0 ngay trong request (nước
+        # đứng đầu thứ tự xét của engine).
+        job = self._jobs.get(job_id)
+        if job is None:
+            return self._take(job_id, wait)
+        remaining = job.deadline - time.time()
+        try:
+            move, started, finished, stats = job.future.result(timeout=max(0, min(wait, remaining)))
+        except TimeoutError:
+            if time.time() < job.deadline:
+                return 'pending', None
+            job.future.cancel()
+            move = self.best_so_far(job)
+            self._stop(job)
+            with self._lock:
+                if self._jobs.pop(job_id, None) is None:
+                    return self._take(job_id)
+                self.timed_out += 1
+            metrics.ai_timeouts.inc()
+            if move is None:
+                move = job.func(*job.args, time_budget=0)[0]
+            self.store.finish(job_id, move)
+            return self._take(job_id)
+        with self._lock:
+            if self._jobs.pop(job_id, None) is None:
+                # Một request khác vừa lấy kết quả này
+                return self._take(job_id)
+            wait_time = started - job.submitted
+            self.completed += 1
+            self.wait_seconds += wait_time
+            self.compute_seconds += finished - started
+            self.max_wait_seconds = max(self.max_wait_seconds, wait_time)
+        _record(wait_time, finished - started, stats)
+        self.store.finish(job_id, move)
+        return self._take(job_id)
+
+    def discard(self, job_id):
+        if job_id is None:
+            return
+        with self._lock:
+            job = self._jobs.pop(job_id, None)
+        if job is not None:
+            job.future.cancel()
+            self._stop(job)
+        self.store.delete(job_id)
+
+    def _expire(self):
+        # Gọi khi đang giữ self._lock
+        cutoff = time.time() - JOB_TTL
+        for job_id, job in list(self._jobs.items()):
+            if job.submitted < cutoff:
+                job.future.cancel()
+                self._stop(job)
+                del self._jobs[job_id]
+
+    def stats(self):
+        completed = self.completed or 1
+        return {
+            'workers': self.workers,
+            'queue_limit': self.queue_limit,
+            'pending': self.pending(),
+            'submitted': self.submitted,
+            'completed': self.completed,
+            'timed_out': self.timed_out,
+            'rejected': self.rejected,
+            'avg_wait_ms': round(self.wait_seconds / completed * 1000, 2),
+            'max_wait_ms': round(self.max_wait_seconds * 1000, 2),
+            'avg_compute_ms': round(self.compute_seconds / completed * 1000, 2)
+        }
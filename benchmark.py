@@ -0,0 +1,369 @@
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+# Bộ đo hiệu năng cho các đường xử lý nóng: chạy app Flask qua test client
+# (không cần máy chủ) và đo riêng từng hàm của engine/lưu trữ. Mỗi phép đo
+# chạy `repeat` lượt, mỗi lượt `number` lần; so sánh dùng lượt nhanh nhất
+# (ít nhiễu nhất, như timeit), trung vị chỉ để tham khảo.
+#
+# Thời gian tuyệt đối phụ thuộc máy, nên ngay trước và sau mỗi phép đo còn
+# đo một phép tham chiếu thuần Python (reference) và phép đo được quy về tỉ
+# lệ so với nó; máy nhanh chậm thất thường trong lúc chạy cũng ít ảnh hưởng.
+# benchmark_baseline.json chỉ lưu các tỉ lệ này. Hai lần chạy liền nhau vẫn
+# lệch nhau tới khoảng ±35%, nên ngưỡng đặt trên mức nhiễu đó và phép đo vượt
+# ngưỡng được đo lại (--confirm lần, lấy tỉ lệ tốt nhất): chỉ khi vẫn vượt
+# ngưỡng mới bị coi là thoái lui và thoát với mã 1. Ghi mốc mới bằng
+# --save-baseline.
+#
+#   python benchmark.py                  # đo và so với mốc
+#   python benchmark.py --save-baseline  # ghi mốc mới
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'benchmark_baseline.json')
+DEFAULT_THRESHOLD = 0.5  # Chậm hơn mốc 50% bị coi là thoái lui
+CONFIRM_RUNS = 2  # Số lần đo lại một phép đo vượt ngưỡng
+REFERENCE_NUMBER = 50
+REFERENCE_REPEAT = 5
+HISTORY_GAMES = 100000
+HISTORY_USERS = 100
+SPECTATORS = 16
+SEED = 12345
+
+_cases = []
+
+
+def case(number, repeat=5):
+    # Đăng ký một phép đo; hàm nhận ctx và trả về hàm được gọi number lần
+    def register(func):
+        _cases.append((func.__name__, number, repeat, func))
+        return func
+    return register
+
+
+def make_history(path, games=HISTORY_GAMES, users=HISTORY_USERS):
+    # history.json giả với `games` ván chia đều cho `users` người chơi
+    rng = random.Random(SEED)
+    history = {}
+    results = ('Thắng', 'Thua', 'Hòa')
+    for index in range(games):
+        username = 'user%d' % (index % users)
+        difficulty = rng.choice(('super_hard', 'hard', 'normal', 'easy'))
+        result = rng.choice(results)
+        records = history.setdefault(username, {'mode': {'ai': {}}})['mode']['ai'].setdefault(
+            difficulty, {'wins': 0, 'losses': 0, 'draws': 0, 'games': []})
+        records[('wins', 'losses', 'draws')[results.index(result)]] += 1
+        records['games'].append({'result': result, 'timestamp': '2024-01-01 00:00:00'})
+    with open(path, 'w') as f:
+        json.dump(history, f, ensure_ascii=False)
+
+
+def _login(app, username, mode='ai', difficulty='super_hard', board='3x3'):
+    client = app.test_client()
+    client.post('/login', data={'username': username, 'mode': mode,
+                                'difficulty': difficulty, 'board': board})
+    return client
+
+
+@case(number=200)
+def login(ctx):
+    client = ctx.app.test_client()
+    data = {'username': 'bench', 'mode': 'ai', 'difficulty': 'super_hard', 'board': '3x3'}
+    return lambda: client.post('/login', data=data)
+
+
+@case(number=20)
+def index_ai_reply(ctx):
+    # Trang chủ khi máy đi trước trên bàn trống: gửi công việc rồi chờ kết quả
+    def run():
+        client = _login(ctx.app, 'bench_ai')
+        with client.session_transaction() as session:
+            session['board'] = [' '] * 9
+            session['player_symbol'] = 'O'
+            session['ai_symbol'] = 'X'
+            session['turn'] = 'X'
+            session['game_over'] = False
+        client.get('/')
+        while True:
+            with client.session_transaction() as session:
+                job = session.get('ai_job')
+            if job is None or client.get('/ai_job/' + job).get_json()['status'] != 'pending':
+                break
+    return run
+
+
+@case(number=200)
+def move(ctx):
+    # Nước đi của người chơi: kiểm tra, ghi session và gửi công việc cho máy
+    client = _login(ctx.app, 'bench_move', difficulty='easy')
+
+    def run():
+        with client.session_transaction() as session:
+            session['board'] = [' '] * 9
+            session['player_symbol'] = 'X'
+            session['ai_symbol'] = 'O'
+            session['turn'] = 'X'
+            session['game_over'] = False
+            session.pop('ai_job', None)
+        client.post('/move', json={'position': 4})
+    return run
+
+
+@case(number=50)
+def api_move(ctx):
+    # Một nước đi qua /api/v1/move, gồm cả chờ nước đáp của máy
+    client = _login(ctx.app, 'bench_api', difficulty='easy')
+
+    def run():
+        with client.session_transaction() as session:
+            session['board'] = [' '] * 9
+            session['player_symbol'] = 'X'
+            session['ai_symbol'] = 'O'
+            session['turn'] = 'X'
+            session['game_over'] = False
+            session.pop('ai_job', None)
+        client.post('/api/v1/move', json={'position': 4})
+    return run
+
+
+@case(number=50)
+def history_page(ctx):
+    client = _login(ctx.app, 'user7')
+    return lambda: client.get('/history')
+
+
+@case(number=10, repeat=5)
+def pvp_spectators(ctx):
+    # SPECTATORS người xem cùng tải trang phòng (đường dự phòng khi không có SSE)
+    players = [_login(ctx.app, name, mode='player') for name in ('p1', 'p2')]
+    location = players[0].get('/').headers['Location']
+    players[1].get('/')
+    viewers = [_login(ctx.app, 'viewer%d' % i, mode='player') for i in range(SPECTATORS)]
+    for viewer in viewers:
+        viewer.get(location)
+
+    def view(client):
+        client.get(location)
+
+    def run():
+        threads = [threading.Thread(target=view, args=(viewer,)) for viewer in viewers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    return run
+
+
+@case(number=10, repeat=5)
+def pvp_poll(ctx):
+    # Người xem tải lại trang phòng với If-None-Match khi trạng thái chưa đổi (304)
+    players = [_login(ctx.app, name, mode='player') for name in ('q1', 'q2')]
+    location = players[0].get('/').headers['Location']
+    players[1].get('/')
+    viewers = [_login(ctx.app, 'poller%d' % i, mode='player') for i in range(SPECTATORS)]
+    etags = [viewer.get(location).headers['ETag'] for viewer in viewers]
+
+    def view(client, etag):
+        client.get(location, headers={'If-None-Match': etag})
+
+    def run():
+        threads = [threading.Thread(target=view, args=args) for args in zip(viewers, etags)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    return run
+
+
+@case(number=200)
+def leaderboard(ctx):
+    # Top-K (lấy từ bộ nhớ đệm sau lần đầu) và hạng của người đang đăng nhập
+    client = _login(ctx.app, 'user7', difficulty='hard')
+    return lambda: client.get('/api/leaderboard')
+
+
+@case(number=100000)
+def check_winner(ctx):
+    board = ['X', 'O', 'X', ' ', 'X', 'O', 'O', ' ', ' ']
+    return lambda: ctx.tictactoe.check_winner(board, 'X')
+
+
+@case(number=20, repeat=3)
+def minimax(ctx):
+    # Tìm kiếm đầy đủ từ bàn trống, xóa bảng chuyển vị trước mỗi lần
+    engine = ctx.engine
+    board = [' '] * 9
+
+    def run():
+        engine.transposition_table.clear()
+        ctx.tictactoe.minimax(board, 0, True, 'X', 'O', 'super_hard')
+    return run
+
+
+@case(number=100000)
+def best_move_minimax(ctx):
+    board = ['X', ' ', ' ', ' ', 'O', ' ', ' ', ' ', ' ']
+    return lambda: ctx.tictactoe.best_move_minimax(board, 'X', 'O')
+
+
+@case(number=100000)
+def worst_move(ctx):
+    board = ['X', ' ', ' ', ' ', 'O', ' ', ' ', ' ', ' ']
+    return lambda: ctx.tictactoe.worst_move(board, 'X', 'O')
+
+
+@case(number=2000)
+def save_history(ctx):
+    return lambda: ctx.tictactoe.save_history('bench_save', 'Thắng', difficulty='hard')
+
+
+@case(number=100000)
+def get_score(ctx):
+    ctx.tictactoe.get_score('user3', 'hard')
+    return lambda: ctx.tictactoe.get_score('user3', 'hard')
+
+
+def reference(ctx):
+    # Phép tham chiếu: vòng lặp số học và dict, không chạm tới mã của ứng dụng
+    def run():
+        table = {}
+        total = 0
+        for i in range(2000):
+            table[i % 97] = table.get(i % 97, 0) + i
+            total += i * i % 7
+        return total
+    return run
+
+
+class _Context:
+    pass
+
+
+def setup(workdir):
+    # Chạy trong thư mục tạm: history.json giả, history.db mới
+    os.chdir(workdir)
+    make_history(os.path.join(workdir, 'history.json'))
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import engine
+    import tictactoe
+    random.seed(SEED)
+    tictactoe.initialize_history_file()
+    engine.get_table()
+    ctx = _Context()
+    ctx.engine = engine
+    ctx.tictactoe = tictactoe
+    ctx.app = tictactoe.app
+    return ctx
+
+
+def measure(ctx, number, repeat, factory):
+    run = factory(ctx)
+    run()  # Làm nóng
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            run()
+        samples.append((time.perf_counter() - start) / number * 1e6)
+    return {'median_us': round(statistics.median(samples), 3),
+            'min_us': round(min(samples), 3), 'number': number, 'repeat': repeat}
+
+
+def run_case(ctx, number, repeat, factory):
+    # Đo một phép đo kẹp giữa hai lần đo phép tham chiếu
+    before = measure(ctx, REFERENCE_NUMBER, REFERENCE_REPEAT, reference)['min_us']
+    result = measure(ctx, number, repeat, factory)
+    after = measure(ctx, REFERENCE_NUMBER, REFERENCE_REPEAT, reference)['min_us']
+    result['reference_us'] = min(before, after)
+    result['relative'] = round(result['min_us'] / result['reference_us'], 6)
+    return result
+
+
+def compare(results, baseline, threshold):
+    # Trả về danh sách phép đo chậm hơn mốc quá ngưỡng, so theo tỉ lệ với
+    # phép tham chiếu của cùng lần chạy
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None or 'relative' not in base:
+            continue
+        ratio = result['relative'] / base['relative']
+        result['baseline_relative'] = base['relative']
+        result['ratio'] = round(ratio, 3)
+        if ratio > 1 + threshold:
+            regressions.append(name)
+    return regressions
+
+
+def baseline_entry(result):
+    return {'relative': result['relative'], 'number': result['number'],
+            'repeat': result['repeat']}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Đo hiệu năng các đường xử lý nóng.')
+    parser.add_argument('--only', action='append', help='chỉ chạy phép đo này (lặp lại được)')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument('--confirm', type=int, default=CONFIRM_RUNS,
+                        help='số lần đo lại phép đo vượt ngưỡng trước khi báo thoái lui')
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--output', help='ghi kết quả JSON ra tệp')
+    args = parser.parse_args(argv)
+
+    baseline_path = os.path.abspath(args.baseline)
+    output_path = os.path.abspath(args.output) if args.output else None
+    baseline = {}
+    if os.path.exists(baseline_path):
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+    cases = [entry for entry in _cases if not args.only or entry[0] in args.only]
+    regressions = []
+    with tempfile.TemporaryDirectory() as workdir:
+        ctx = setup(workdir)
+        results = {}
+        for name, number, repeat, factory in cases:
+            results[name] = run_case(ctx, number, repeat, factory)
+            sys.stderr.write('%-18s %12.2f µs  x%.3f\n' % (
+                name, results[name]['min_us'], results[name]['relative']))
+        if not args.save_baseline:
+            regressions = compare(results, baseline, args.threshold)
+            for _ in range(args.confirm):
+                if not regressions:
+                    break
+                # Đo lại các phép đo vượt ngưỡng, giữ lần đo có tỉ lệ tốt nhất
+                for name, number, repeat, factory in cases:
+                    if name not in regressions:
+                        continue
+                    result = run_case(ctx, number, repeat, factory)
+                    sys.stderr.write('%-18s %12.2f µs  x%.3f (đo lại)\n' % (
+                        name, result['min_us'], result['relative']))
+                    if result['relative'] < results[name]['relative']:
+                        results[name] = result
+                regressions = compare({name: results[name] for name in regressions},
+                                      baseline, args.threshold)
+
+    if args.save_baseline:
+        if not args.only:
+            baseline = {}
+        # Với --only chỉ ghi đè các phép đo vừa chạy
+        baseline.update((name, baseline_entry(result)) for name, result in results.items())
+        with open(baseline_path, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write('\n')
+    report = {'results': results, 'threshold': args.threshold, 'regressions': regressions}
+    if output_path:
+        with open(output_path, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    for name in regressions:
+        sys.stderr.write('Chậm hơn mốc: %s (x%.2f)\n' % (name, results[name]['ratio']))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
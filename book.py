@@ -0,0 +1,305 @@
+import argparse
+import hashlib
+import mmap
+import multiprocessing
+import os
+import random
+import struct
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import engine
+import game_records
+import gomoku
+
+# Sách khai cuộc và bảng tàn cuộc, dựng một lần bằng `python book.py build`
+# từ các ván đã lưu (xem game_records.py) cùng với việc duyệt hết thế cờ:
+# - Bàn 3x3: mọi thế cờ có thể gặp, theo dạng chuẩn D4, kèm phân bố nước đi
+#   cho độ khó hard/normal: nước tốt nhất với xác suất 1 - RANDOM_RATE, phần
+#   còn lại chia cho các nước khác theo tần suất người chơi thật đã đi ở thế
+#   đó. Máy bốc thăm theo phân bố này thay cho việc đánh ngẫu nhiên đều.
+# - Bàn lớn: bàn trống, mọi thế một quân, và các thế trong `plies` nước đầu
+#   xuất hiện ít nhất MIN_OCCURRENCES lần trong các ván đã lưu, kèm nước đi
+#   tìm được với thời gian suy nghĩ dài hơn lúc chơi.
+# Tệp được mmap nên mọi worker dùng chung một bản trong page cache; bản ghi
+# sắp theo khóa và tra bằng tìm kiếm nhị phân.
+BOOK_FILE = os.environ.get('BOOK_FILE', os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'book.bin'))
+BOOK_MAGIC = b'TTB1'
+# magic, số nước khai cuộc, số thế 3x3, số thế bàn lớn, vị trí hai vùng
+HEADER = struct.Struct('<4sIIIQQ')
+# khóa, phân bố tích lũy cho hard rồi normal, nước tốt nhất và điểm của nó
+SMALL = struct.Struct('<I9H9Hbb')
+LARGE = struct.Struct('<QHq')  # khóa băm, nước đi, điểm
+SMALL_KEY = struct.Struct('<I')
+LARGE_KEY = struct.Struct('<Q')
+THRESHOLDS = struct.Struct('<9H')
+BEST = struct.Struct('<bb')
+SMALL_DIFFICULTIES = ('hard', 'normal')
+SCALE = 0xFFFF
+BOOK_PLIES = 6
+MIN_OCCURRENCES = 2
+BUILD_TIME_BUDGET = 2.0
+
+_book = None
+_book_pid = None
+_large_symmetries = {}
+
+
+def small_key(board, player):
+    # (khóa dạng chuẩn kèm bên đang đi, chỉ số phép biến đổi)
+    key, index = engine.canonical_index(*engine.to_bitboard(board))
+    return key << 1 | (player == 'O'), index
+
+
+def large_symmetries(size):
+    # 8 hoán vị ô của bàn size x size: ô i của bàn đã biến đổi là ô perm[i]
+    perms = _large_symmetries.get(size)
+    if perms is None:
+        n = size - 1
+        transforms = (
+            lambda r, c: (r, c), lambda r, c: (c, n - r),
+            lambda r, c: (n - r, n - c), lambda r, c: (n - c, r),
+            lambda r, c: (r, n - c), lambda r, c: (n - r, c),
+            lambda r, c: (c, r), lambda r, c: (n - c, n - r))
+        perms = []
+        for transform in transforms:
+            perm = []
+            for i in range(size * size):
+                r, c = transform(*divmod(i, size))
+                perm.append(r * size + c)
+            perms.append(tuple(perm))
+        perms = _large_symmetries[size] = tuple(perms)
+    return perms
+
+
+def large_key(board, player, win_length):
+    # (khóa băm 64 bit của dạng chuẩn, chỉ số phép biến đổi, bàn dạng chuẩn)
+    best, best_index = None, 0
+    for index, perm in enumerate(large_symmetries(gomoku.board_size(board))):
+        candidate = ''.join([board[i] for i in perm])
+        if best is None or candidate < best:
+            best, best_index = candidate, index
+    digest = hashlib.blake2b(('%d:%s:%s' % (win_length, player, best)).encode('ascii'),
+                             digest_size=8).digest()
+    return int.from_bytes(digest, 'little'), best_index, list(best)
+
+
+class Book:
+
+    def __init__(self, path=BOOK_FILE):
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.plies, self.small_count, self.large_count, self._small_offset, \
+            self._large_offset = HEADER.unpack_from(self._map)
+        if magic != BOOK_MAGIC:
+            self._map.close()
+            raise ValueError('Tệp sách khai cuộc không hợp lệ: %s' % path)
+
+    def _find(self, record, key_struct, offset, count, key):
+        # Tìm kiếm nhị phân trên vùng bản ghi đã sắp theo khóa (trường đầu
+        # tiên); trả về vị trí bản ghi hoặc None
+        data = self._map
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            position = offset + mid * record.size
+            found = key_struct.unpack_from(data, position)[0]
+            if found < key:
+                lo = mid + 1
+            elif found > key:
+                hi = mid
+            else:
+                return position
+        return None
+
+    def sample(self, board, player, difficulty):
+        # Bốc một nước theo phân bố của độ khó. Trả về (nước đi, điểm), điểm là
+        # None nếu không phải nước tốt nhất; None nếu không có trong sách.
+        if difficulty not in SMALL_DIFFICULTIES:
+            return None
+        key, index = small_key(board, player)
+        position = self._find(SMALL, SMALL_KEY, self._small_offset, self.small_count, key)
+        if position is None:
+            return None
+        thresholds = THRESHOLDS.unpack_from(
+            self._map, position + SMALL_KEY.size
+            + THRESHOLDS.size * SMALL_DIFFICULTIES.index(difficulty))
+        draw = random.randrange(SCALE)
+        for cell in range(9):
+            if draw < thresholds[cell]:
+                break
+        best, score = BEST.unpack_from(self._map, position + SMALL.size - BEST.size)
+        return engine.SYMMETRIES[index][cell], score if cell == best else None
+
+    def opening(self, board, player, win_length):
+        # (nước đi, điểm) cho thế khai cuộc bàn lớn; None nếu không có trong sách
+        if len(board) - board.count(' ') > self.plies or not self.large_count:
+            return None
+        key, index, _ = large_key(board, player, win_length)
+        position = self._find(LARGE, LARGE_KEY, self._large_offset, self.large_count, key)
+        if position is None:
+            return None
+        entry = LARGE.unpack_from(self._map, position)
+        return large_symmetries(gomoku.board_size(board))[index][entry[1]], entry[2]
+
+
+def get_book():
+    # Mở sách một lần cho mỗi tiến trình; None nếu chưa dựng
+    global _book, _book_pid
+    if _book_pid != os.getpid():
+        _book_pid = os.getpid()
+        try:
+            _book = Book(BOOK_FILE)
+        except (OSError, ValueError, struct.error):
+            _book = None
+    return _book
+
+
+def _cumulative(weights):
+    # Trọng số theo ô -> ngưỡng tích lũy trên thang SCALE, ô cuối luôn là SCALE
+    total = sum(weights)
+    thresholds = []
+    running = 0
+    for weight in weights:
+        running += weight
+        thresholds.append(round(SCALE * running / total))
+    return thresholds
+
+
+def small_entries(human, rates):
+    # Duyệt mọi thế 3x3 chưa kết thúc; human[khóa] là số lần người chơi đã đi
+    # từng ô (theo dạng chuẩn) ở thế đó
+    entries = {}
+    for x, o, player in engine.reachable_positions():
+        key, index = engine.canonical_index(x, o)
+        key = key << 1 | (player == 'O')
+        if key in entries:
+            continue
+        m = engine.SYMMETRY_MAPS[index]
+        cx, co = m[x], m[o]
+        best, score = engine.lookup_bits(cx, co, player)
+        counts = human.get(key, [0] * 9)
+        free = [cell for cell in range(9) if not (cx | co) & engine.CELL_BITS[cell]]
+        others = sum(1 + counts[cell] for cell in free if cell != best)
+        fields = []
+        for difficulty in SMALL_DIFFICULTIES:
+            rate = rates.get(difficulty, 0) if others else 0
+            weights = [0] * 9
+            for cell in free:
+                if cell == best:
+                    weights[cell] = 1 - rate
+                else:
+                    weights[cell] = rate * (1 + counts[cell]) / others
+            fields += _cumulative(weights)
+        entries[key] = fields + [best, score]
+    return entries
+
+
+def _search_opening(args):
+    board, player, win_length, time_budget = args
+    geometry = gomoku.get_geometry(gomoku.board_size(board), win_length)
+    move, score, _, _ = gomoku.Searcher(board, player, geometry, time_budget).search()
+    return move, max(-2 ** 63, min(score, 2 ** 63 - 1))
+
+
+def _add_opening(openings, board, player, win_length):
+    key, _, canonical_board = large_key(board, player, win_length)
+    entry = openings.get(key)
+    if entry is None:
+        entry = openings[key] = [0, canonical_board, player, win_length]
+    entry[0] += 1
+
+
+def mine_games(conn, plies, win_lengths):
+    # Đọc thứ tự nước đi của các ván đã lưu. Trả về (human, openings):
+    # tần suất nước đi của người ở các thế 3x3 và số lần gặp các thế khai
+    # cuộc bàn lớn. Ván với người được lưu hai lần (mỗi người một bản ghi) nên
+    # chỉ tính các nước của chính người chơi trong bản ghi đó.
+    human = {}
+    openings = {}
+    for mode, packed, flags in conn.execute(
+            'SELECT mode, moves, flags FROM games WHERE moves IS NOT NULL'):
+        size, symbol, first = game_records.unpack_flags(flags)
+        if size * size == 0:
+            continue
+        other = 'O' if symbol == 'X' else 'X'
+        board = [' '] * (size * size)
+        for ply, move in enumerate(game_records.unpack_moves(packed, size * size)):
+            mover = symbol if (ply % 2 == 0) == first else other
+            own = mover == symbol
+            if size == 3 and own:
+                key, index = small_key(board, mover)
+                cell = engine.SYMMETRIES[index].index(move)
+                human.setdefault(key, [0] * 9)[cell] += 1
+            elif size > 3 and ply < plies and (own or mode == 'ai') and size in win_lengths:
+                _add_opening(openings, board, mover, win_lengths[size])
+            board[move] = mover
+    return human, openings
+
+
+def build(conn, path=BOOK_FILE, rates=None, win_lengths=None, plies=BOOK_PLIES,
+          min_occurrences=MIN_OCCURRENCES, time_budget=BUILD_TIME_BUDGET, processes=None):
+    import evaluate
+    rates = evaluate.RANDOM_RATE if rates is None else rates
+    if win_lengths is None:
+        win_lengths = {size: length for size, length in evaluate.DEFAULT_WIN_LENGTH.items()
+                       if size > 3}
+    human, mined = mine_games(conn, plies, win_lengths)
+    small = small_entries(human, rates)
+
+    openings = {key: entry for key, entry in mined.items() if entry[0] >= min_occurrences}
+    for size, win_length in win_lengths.items():
+        # Bàn trống với cả hai bên đi trước, và mọi thế một quân
+        for player in engine.SYMBOLS:
+            _add_opening(openings, [' '] * (size * size), player, win_length)
+        if plies >= 1:
+            for cell in range(size * size):
+                for player in engine.SYMBOLS:
+                    board = [' '] * (size * size)
+                    board[cell] = 'O' if player == 'X' else 'X'
+                    _add_opening(openings, board, player, win_length)
+    keys = sorted(openings)
+    jobs = [(openings[key][1], openings[key][2], openings[key][3], time_budget) for key in keys]
+    if len(jobs) > 1 and (processes or os.cpu_count() or 1) > 1:
+        with ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context('spawn')) as pool:
+            results = list(pool.map(_search_opening, jobs))
+    else:
+        results = list(map(_search_opening, jobs))
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        small_offset = HEADER.size
+        large_offset = small_offset + SMALL.size * len(small)
+        f.write(HEADER.pack(BOOK_MAGIC, plies, len(small), len(keys), small_offset, large_offset))
+        for key in sorted(small):
+            f.write(SMALL.pack(key, *small[key]))
+        for key, (move, score) in zip(keys, results):
+            f.write(LARGE.pack(key, move, score))
+    os.replace(tmp_path, path)
+    return len(small), len(keys), len(mined)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Dựng sách khai cuộc và bảng tàn cuộc.')
+    parser.add_argument('command', choices=['build'])
+    parser.add_argument('--output', default=BOOK_FILE)
+    parser.add_argument('--plies', type=int, default=BOOK_PLIES,
+                        help='số nước đầu của ván bàn lớn được đưa vào sách')
+    parser.add_argument('--min-occurrences', type=int, default=MIN_OCCURRENCES)
+    parser.add_argument('--time-budget', type=float, default=BUILD_TIME_BUDGET,
+                        help='giây suy nghĩ cho mỗi thế khai cuộc bàn lớn')
+    parser.add_argument('--processes', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    import storage
+    small, large, mined = build(storage.get_connection(), args.output, plies=args.plies,
+                                min_occurrences=args.min_occurrences,
+                                time_budget=args.time_budget, processes=args.processes)
+    print('Đã ghi %d thế 3x3 và %d thế khai cuộc bàn lớn (%d thế gặp trong các ván đã lưu) '
+          'vào %s' % (small, large, mined, args.output))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,430 @@
+import mmap
+import os
+import sys
+import threading
+from array import array
+from collections import OrderedDict
+
+# Bàn cờ 3x3 dạng bitboard: mỗi thế cờ là hai số nguyên 9 bit (quân X và
+# quân O), bit i ứng với ô i của dạng danh sách dùng trong session/template.
+FULL_MASK = 0x1FF
+CELL_BITS = tuple(1 << i for i in range(9))
+WIN_MASKS = (
+    0b000000111, 0b000111000, 0b111000000,  # Hàng ngang
+    0b001001001, 0b010010010, 0b100100100,  # Hàng dọc
+    0b100010001, 0b001010100                # Đường chéo
+)
+# WIN_TABLE[bits] = 1 nếu tập ô bits chứa trọn một đường thắng
+WIN_TABLE = bytes(
+    1 if any(bits & m == m for m in WIN_MASKS) else 0 for bits in range(512))
+
+# 8 phép quay/đối xứng của bàn cờ (nhóm D4), mỗi phép là một hoán vị ô
+SYMMETRIES = (
+    (0, 1, 2, 3, 4, 5, 6, 7, 8),
+    (6, 3, 0, 7, 4, 1, 8, 5, 2),  # Quay 90 độ
+    (8, 7, 6, 5, 4, 3, 2, 1, 0),  # Quay 180 độ
+    (2, 5, 8, 1, 4, 7, 0, 3, 6),  # Quay 270 độ
+    (2, 1, 0, 5, 4, 3, 8, 7, 6),  # Lật ngang
+    (6, 7, 8, 3, 4, 5, 0, 1, 2),  # Lật dọc
+    (0, 3, 6, 1, 4, 7, 2, 5, 8),  # Đối xứng qua đường chéo chính
+    (8, 5, 2, 7, 4, 1, 6, 3, 0),  # Đối xứng qua đường chéo phụ
+)
+
+
+def _permute_bits(bits, perm):
+    result = 0
+    for i in range(9):
+        if bits & CELL_BITS[perm[i]]:
+            result |= CELL_BITS[i]
+    return result
+
+
+# SYMMETRY_MAPS[k][bits]: ảnh của tập ô bits qua phép biến đổi thứ k
+SYMMETRY_MAPS = tuple(
+    tuple(_permute_bits(bits, perm) for bits in range(512)) for perm in SYMMETRIES)
+
+# Bảng nước đi hoàn hảo: duyệt toàn bộ các thế cờ có thể gặp một lần, lưu
+# nước đi tốt nhất / tệ nhất và điểm tương ứng cho từng phía.
+TABLE_FILE = os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), 'perfect_play.bin')
+TABLE_MAGIC = b'TTT1'
+TABLE_SIZE = 3 ** 9  # Mỗi ô nhận 3 giá trị: ' ', 'X', 'O'
+NO_ENTRY = -128
+SYMBOLS = ('X', 'O')
+# TERNARY[bits]: tổng 3^i của các ô trong bits, mã bảng = T[x] + 2 * T[o]
+TERNARY = tuple(sum(3 ** i for i in range(9) if bits & CELL_BITS[i])
+                for bits in range(512))
+
+INF = float('inf')
+EXACT, LOWER, UPPER = 0, 1, 2
+TT_MAX_ENTRIES = 100000
+
+_table = None
+
+
+def to_bitboard(board):
+    # Chuyển bàn cờ dạng danh sách ' '/'X'/'O' sang cặp (x, o)
+    x = o = 0
+    for i in range(9):
+        cell = board[i]
+        if cell == 'X':
+            x |= CELL_BITS[i]
+        elif cell == 'O':
+            o |= CELL_BITS[i]
+    return x, o
+
+
+def from_bitboard(x, o):
+    board = [' '] * 9
+    for i in range(9):
+        if x & CELL_BITS[i]:
+            board[i] = 'X'
+        elif o & CELL_BITS[i]:
+            board[i] = 'O'
+    return board
+
+
+def player_bits(board, player):
+    bits = 0
+    for i in range(9):
+        if board[i] == player:
+            bits |= CELL_BITS[i]
+    return bits
+
+
+def has_won(bits):
+    return WIN_TABLE[bits] == 1
+
+
+def is_full(x, o):
+    return x | o == FULL_MASK
+
+
+def encode_board(board):
+    # Mã hóa bàn cờ thành số nguyên hệ cơ số 3 để làm chỉ số trong bảng
+    x, o = to_bitboard(board)
+    return TERNARY[x] + 2 * TERNARY[o]
+
+
+def canonical(x, o):
+    # Dạng chuẩn D4: khóa 18 bit nhỏ nhất trong 8 phép biến đổi của (x, o)
+    best = FULL_MASK << 9 | FULL_MASK
+    for m in SYMMETRY_MAPS:
+        key = m[x] << 9 | m[o]
+        if key < best:
+            best = key
+    return best
+
+
+def canonical_index(x, o):
+    # Như canonical() nhưng trả thêm chỉ số phép biến đổi: ô i của dạng chuẩn
+    # là ô SYMMETRIES[chỉ số][i] của bàn cờ ban đầu
+    best, best_index = None, 0
+    for index, m in enumerate(SYMMETRY_MAPS):
+        key = m[x] << 9 | m[o]
+        if best is None or key < best:
+            best, best_index = key, index
+    return best, best_index
+
+
+def _shift(score, depth):
+    # Điểm thắng/thua giảm dần theo độ sâu, hòa luôn bằng 0
+    if score > 0:
+        return score - depth
+    if score < 0:
+        return score + depth
+    return 0
+
+
+def _unshift(score, depth):
+    # Ngược với _shift: đưa điểm ở độ sâu depth về điểm tương đối của nút
+    if score > 0:
+        return score + depth
+    if score < 0:
+        return score - depth
+    return 0
+
+
+class TranspositionTable:
+    # Bộ nhớ đệm LRU có giới hạn cho các thế cờ đã tìm kiếm
+
+    def __init__(self, max_entries=TT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, value, flag):
+        with self._lock:
+            self._entries[key] = (value, flag)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        return {'entries': len(self._entries), 'max_entries': self.max_entries,
+                'hits': self.hits, 'misses': self.misses}
+
+
+transposition_table = TranspositionTable()
+
+
+def _search(ai, human, depth, is_maximizing, easy, ai_is_x, alpha, beta):
+    # Minimax cắt tỉa alpha-beta trên bitboard; ai/human là tập ô của hai bên
+    if WIN_TABLE[ai]:
+        return -10 + depth if easy else 10 - depth
+    if WIN_TABLE[human]:
+        return 10 - depth if easy else depth - 10
+    occupied = ai | human
+    if occupied == FULL_MASK:
+        return 0
+
+    # Điểm trong bảng lưu theo góc nhìn bên đang đi và tương đối với nút,
+    # nên dùng chung được cho cả hai phía và mọi độ sâu.
+    sign = 1 if is_maximizing else -1
+    mover_is_x = ai_is_x == is_maximizing
+    if ai_is_x:
+        key = canonical(ai, human)
+    else:
+        key = canonical(human, ai)
+    key |= mover_is_x << 18 | easy << 19
+    entry = transposition_table.get(key)
+    if entry is not None:
+        value = _shift(sign * entry[0], depth)
+        flag = entry[1]
+        if sign < 0 and flag != EXACT:
+            flag = LOWER if flag == UPPER else UPPER
+        if flag == EXACT:
+            return value
+        if flag == LOWER:
+            alpha = max(alpha, value)
+        else:
+            beta = min(beta, value)
+        if alpha >= beta:
+            return value
+
+    alpha_orig, beta_orig = alpha, beta
+    if is_maximizing:
+        best_score = -INF
+        for bit in CELL_BITS:
+            if not occupied & bit:
+                score = _search(ai | bit, human, depth + 1, False, easy,
+                                ai_is_x, alpha, beta)
+                if score > best_score:
+                    best_score = score
+                if score > alpha:
+                    alpha = score
+                if alpha >= beta:
+                    break
+    else:
+        best_score = INF
+        for bit in CELL_BITS:
+            if not occupied & bit:
+                score = _search(ai, human | bit, depth + 1, True, easy,
+                                ai_is_x, alpha, beta)
+                if score < best_score:
+                    best_score = score
+                if score < beta:
+                    beta = score
+                if alpha >= beta:
+                    break
+
+    if best_score <= alpha_orig:
+        flag = UPPER
+    elif best_score >= beta_orig:
+        flag = LOWER
+    else:
+        flag = EXACT
+    if sign < 0 and flag != EXACT:
+        flag = LOWER if flag == UPPER else UPPER
+    transposition_table.put(key, sign * _unshift(best_score, depth), flag)
+    return best_score
+
+
+def _split(board, ai_player):
+    x, o = to_bitboard(board)
+    if ai_player == 'X':
+        return x, o, True
+    return o, x, False
+
+
+def minimax(board, depth, is_maximizing, ai_player, human_player, difficulty,
+            alpha=-INF, beta=INF):
+    # Cùng điểm số với minimax() gốc khi dùng cửa sổ mặc định; ngoài cửa sổ
+    # chỉ đảm bảo đúng chiều cận.
+    ai, human, ai_is_x = _split(board, ai_player)
+    return _search(ai, human, depth, is_maximizing, difficulty == 'easy',
+                   ai_is_x, alpha, beta)
+
+
+def search_bits(ai, human, ai_is_x, worst=False):
+    # Tìm nước đi ở gốc, giữ nguyên quy tắc chọn ô đầu tiên đạt điểm tốt nhất
+    # như best_move_minimax() / worst_move(); các nước sau chỉ cần so với cận.
+    occupied = ai | human
+    best_score = None
+    move = -1
+    for i in range(9):
+        bit = CELL_BITS[i]
+        if occupied & bit:
+            continue
+        if best_score is None:
+            score = _search(ai | bit, human, 0, False, worst, ai_is_x,
+                            -INF, INF)
+        elif worst:
+            score = _search(ai | bit, human, 0, False, worst, ai_is_x,
+                            -INF, best_score)
+        else:
+            score = _search(ai | bit, human, 0, False, worst, ai_is_x,
+                            best_score, INF)
+        if best_score is None or (score < best_score if worst else score > best_score):
+            best_score = score
+            move = i
+    return move, best_score
+
+
+def search_move(board, ai_player, human_player, worst=False):
+    ai, human, ai_is_x = _split(board, ai_player)
+    return search_bits(ai, human, ai_is_x, worst)
+
+
+def reachable_positions():
+    # Liệt kê mọi thế cờ chưa kết thúc có thể gặp, với cả hai khả năng đi
+    # trước; mỗi phần tử là (x, o, ký hiệu bên đang đi).
+    seen = set()
+    result = []
+    stack = [(0, 0, 'X'), (0, 0, 'O')]
+    while stack:
+        x, o, player = stack.pop()
+        key = (x, o, player)
+        if key in seen:
+            continue
+        seen.add(key)
+        if WIN_TABLE[x] or WIN_TABLE[o] or x | o == FULL_MASK:
+            continue
+        result.append(key)
+        occupied = x | o
+        for bit in CELL_BITS:
+            if not occupied & bit:
+                if player == 'X':
+                    stack.append((x | bit, o, 'O'))
+                else:
+                    stack.append((x, o | bit, 'X'))
+    return result
+
+
+def build_table():
+    table = {}
+    for ai_player in SYMBOLS:
+        table[ai_player] = {
+            'best_move': array('b', [NO_ENTRY]) * TABLE_SIZE,
+            'best_score': array('b', [NO_ENTRY]) * TABLE_SIZE,
+            'worst_move': array('b', [NO_ENTRY]) * TABLE_SIZE,
+            'worst_score': array('b', [NO_ENTRY]) * TABLE_SIZE,
+        }
+    for x, o, player in reachable_positions():
+        code = TERNARY[x] + 2 * TERNARY[o]
+        entry = table[player]
+        if player == 'X':
+            ai, human, ai_is_x = x, o, True
+        else:
+            ai, human, ai_is_x = o, x, False
+        move, score = search_bits(ai, human, ai_is_x)
+        entry['best_move'][code] = move
+        entry['best_score'][code] = score
+        move, score = search_bits(ai, human, ai_is_x, worst=True)
+        entry['worst_move'][code] = move
+        entry['worst_score'][code] = score
+    return table
+
+
+def _table_fields():
+    for ai_player in SYMBOLS:
+        for field in ('best_move', 'best_score', 'worst_move', 'worst_score'):
+            yield ai_player, field
+
+
+def save_table(table, path=TABLE_FILE):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(TABLE_MAGIC)
+        for ai_player, field in _table_fields():
+            table[ai_player][field].tofile(f)
+    os.replace(tmp_path, path)
+
+
+def load_table(path=TABLE_FILE):
+    # Ánh xạ tệp vào bộ nhớ thay vì đọc ra: các worker dùng chung một bản
+    # trong page cache của hệ điều hành
+    with open(path, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if (mapped[:len(TABLE_MAGIC)] != TABLE_MAGIC
+            or len(mapped) != len(TABLE_MAGIC) + 8 * TABLE_SIZE):
+        mapped.close()
+        raise ValueError('Tệp bảng nước đi không hợp lệ: %s' % path)
+    view = memoryview(mapped)
+    table = {p: {} for p in SYMBOLS}
+    offset = len(TABLE_MAGIC)
+    for ai_player, field in _table_fields():
+        table[ai_player][field] = view[offset:offset + TABLE_SIZE].cast('b')
+        offset += TABLE_SIZE
+    return table
+
+
+def get_table():
+    # Nạp bảng từ tệp dựng sẵn nếu có, nếu không thì dựng lần đầu khi cần
+    global _table
+    if _table is None:
+        table = None
+        if os.path.exists(TABLE_FILE):
+            try:
+                table = load_table(TABLE_FILE)
+            except (OSError, EOFError, ValueError):
+                table = None
+        if table is None:
+            table = build_table()
+        _table = table
+    return _table
+
+
+def lookup_bits(x, o, ai_player, worst=False):
+    # Trả về (nước đi, điểm) hoặc None nếu thế cờ không có trong bảng
+    if ai_player not in SYMBOLS:
+        return None
+    entry = get_table()[ai_player]
+    code = TERNARY[x] + 2 * TERNARY[o]
+    prefix = 'worst' if worst else 'best'
+    move = entry[prefix + '_move'][code]
+    if move == NO_ENTRY:
+        return None
+    return move, entry[prefix + '_score'][code]
+
+
+def lookup(board, ai_player, worst=False):
+    x, o = to_bitboard(board)
+    return lookup_bits(x, o, ai_player, worst)
+
+
+if __name__ == '__main__':
+    # python engine.py build: dựng sẵn bảng nước đi trước khi triển khai
+    if len(sys.argv) > 1 and sys.argv[1] == 'build':
+        save_table(build_table())
+        print('Đã ghi bảng nước đi vào %s' % TABLE_FILE)
+    else:
+        print('Cách dùng: python engine.py build')
@@ -0,0 +1,245 @@
+import multiprocessing
+import os
+import random
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import book
+import engine
+import gomoku
+
+# API chọn nước đi / chấm điểm thế cờ, dùng chung cho giao diện web,
+# POST /api/evaluate và các công cụ phân tích. Một lô thế cờ được gộp các thế
+# tương đương (phép quay/đối xứng với bàn 3x3, trùng hệt với bàn lớn) rồi chỉ
+# đánh giá các thế khác nhau: bàn 3x3 tra bảng ngay tại chỗ, bàn lớn chia
+# cho nhiều tiến trình.
+DIFFICULTIES = ('super_hard', 'hard', 'normal', 'easy')
+RANDOM_RATE = {'hard': 0.1, 'normal': 0.3}  # Tỉ lệ đánh ngẫu nhiên theo độ khó
+DEFAULT_TIME_BUDGET = gomoku.DEFAULT_TIME_BUDGET
+BATCH_TIME_BUDGET = 0.05  # Thời gian mặc định cho mỗi thế cờ bàn lớn trong một lô
+MAX_BATCH = 1000
+# Tổng thời gian tìm kiếm (giây CPU) cho mọi thế cờ bàn lớn của một lô; thời
+# gian mỗi thế được chia nhỏ lại khi lô có nhiều thế khác nhau
+MAX_BATCH_BUDGET = float(os.environ.get('EVAL_MAX_BATCH_BUDGET', 2.0))
+# Khóa cho phép gọi POST /api/evaluate khi chưa đăng nhập, cách nhau bởi dấu phẩy
+API_KEYS = frozenset(key for key in os.environ.get('EVAL_API_KEYS', '').split(',') if key)
+EVAL_WORKERS = int(os.environ.get('EVAL_WORKERS', os.cpu_count() or 1))
+# Độ dài thắng mặc định theo kích thước bàn khi không được chỉ định
+DEFAULT_WIN_LENGTH = {3: 3, 5: 4, 15: 5}
+
+_executor = None
+_executor_pid = None
+_local = threading.local()
+
+
+def other_player(player):
+    return 'O' if player == 'X' else 'X'
+
+
+def side_to_move(board):
+    # X luôn đi trước
+    return 'X' if board.count('X') <= board.count('O') else 'O'
+
+
+def is_terminal(board, win_length):
+    if ' ' not in board:
+        return True
+    if len(board) == 9 and win_length == 3:
+        x, o = engine.to_bitboard(board)
+        return engine.has_won(x) or engine.has_won(o)
+    return (gomoku.check_winner(board, 'X', win_length)
+            or gomoku.check_winner(board, 'O', win_length))
+
+
+def search_stats():
+    # Thống kê của lần chọn nước gần nhất trong luồng này, dùng cho metrics:
+    # table ('hit'/'miss'), tt_hits, nodes, depth
+    return getattr(_local, 'stats', {})
+
+
+def warm_up():
+    # Nạp bảng nước đi, sách khai cuộc và hình học các bàn mặc định
+    engine.get_table()
+    book.get_book()
+    for size, win_length in DEFAULT_WIN_LENGTH.items():
+        if size > 3:
+            gomoku.get_geometry(size, win_length)
+
+
+def _random_move(board):
+    return random.choice([i for i in range(len(board)) if board[i] == ' '])
+
+
+def _table_move(board, ai_player, human_player, worst):
+    # Bàn 3x3: tra bảng nước đi hoàn hảo, chỉ tìm kiếm khi thế cờ không có trong bảng
+    entry = engine.lookup(board, ai_player, worst=worst)
+    if entry is not None:
+        _local.stats = {'table': 'hit'}
+        return entry
+    hits = engine.transposition_table.hits
+    entry = engine.search_move(board, ai_player, human_player, worst=worst)
+    _local.stats = {'table': 'miss', 'tt_hits': engine.transposition_table.hits - hits}
+    return entry
+
+
+def best_move_minimax(board, ai_player, human_player, win_length=3,
+                      time_budget=DEFAULT_TIME_BUDGET, on_depth=None, should_stop=None):
+    # Nước đi tốt nhất, trả về (nước đi, điểm). Bàn lớn tìm kiếm sâu dần trong
+    # giới hạn thời gian, xem gomoku.Searcher (on_depth/should_stop để người
+    # gọi theo dõi và dừng tìm kiếm)
+    if len(board) == 9 and win_length == 3:
+        return _table_move(board, ai_player, human_player, worst=False)
+    geometry = gomoku.get_geometry(gomoku.board_size(board), win_length)
+    move, score, depth, nodes = gomoku.Searcher(
+        board, ai_player, geometry, time_budget, on_depth=on_depth,
+        should_stop=should_stop).search()
+    _local.stats = {'nodes': nodes, 'depth': depth}
+    return move, score
+
+
+def worst_move(board, ai_player, human_player, win_length=3):
+    # AI cố gắng thua, trả về (nước đi, điểm); bàn lớn không có điểm
+    if len(board) == 9 and win_length == 3:
+        return _table_move(board, ai_player, human_player, worst=True)
+    return gomoku.worst_move(board, ai_player, win_length), None
+
+
+def small_board_move(board, ai_player, difficulty):
+    # Bàn 3x3. Với hard/normal, nước đi được bốc theo phân bố trong sách
+    # (xem book.py); chưa dựng sách thì đánh ngẫu nhiên theo RANDOM_RATE.
+    # Trả về (nước đi, điểm); điểm là None với nước không phải tốt nhất.
+    human_player = other_player(ai_player)
+    if difficulty == 'easy':
+        return worst_move(board, ai_player, human_player)
+    rate = RANDOM_RATE.get(difficulty)
+    if rate:
+        opening_book = book.get_book()
+        entry = opening_book.sample(board, ai_player, difficulty) if opening_book else None
+        if entry is not None:
+            _local.stats = {'table': 'book'}
+            return entry
+        if random.random() < rate:
+            return _random_move(board), None
+    return best_move_minimax(board, ai_player, human_player)
+
+
+def large_board_move(board, ai_player, difficulty, win_length,
+                     time_budget=DEFAULT_TIME_BUDGET, on_depth=None, should_stop=None):
+    # Bàn lớn: sách khai cuộc rồi tìm kiếm, xem best_move_minimax()
+    human_player = other_player(ai_player)
+    if difficulty == 'easy':
+        return worst_move(board, ai_player, human_player, win_length)
+    rate = RANDOM_RATE.get(difficulty)
+    if rate and random.random() < rate:
+        return _random_move(board), None
+    # Thế khai cuộc đã tính sẵn thì không cần tìm kiếm
+    opening_book = book.get_book()
+    entry = opening_book.opening(board, ai_player, win_length) if opening_book else None
+    if entry is not None:
+        _local.stats = {'table': 'book'}
+        return entry
+    return best_move_minimax(board, ai_player, human_player, win_length, time_budget,
+                             on_depth, should_stop)
+
+
+def choose_move(board, ai_player, difficulty='super_hard', win_length=3,
+                time_budget=DEFAULT_TIME_BUDGET, on_depth=None, should_stop=None):
+    # Trả về (nước đi, điểm theo góc nhìn của ai_player); (-1, None) khi ván đã xong
+    _local.stats = {}
+    if is_terminal(board, win_length):
+        return -1, None
+    if len(board) == 9 and win_length == 3:
+        return small_board_move(board, ai_player, difficulty)
+    return large_board_move(board, ai_player, difficulty, win_length, time_budget,
+                            on_depth, should_stop)
+
+
+def parse_position(item, boards=None):
+    # Chuẩn hóa một phần tử của lô: bàn cờ là danh sách ô hoặc chuỗi ('X',
+    # 'O', còn lại là ô trống). boards (nếu có) là tập (kích thước, độ dài
+    # thắng) được phép. Sai định dạng thì báo ValueError.
+    if not isinstance(item, dict):
+        raise ValueError('Mỗi thế cờ phải là một object JSON.')
+    cells = item.get('board')
+    if not isinstance(cells, (list, str)):
+        raise ValueError('Thiếu bàn cờ (board).')
+    board = [cell if cell in ('X', 'O') else ' ' for cell in cells]
+    try:
+        size = gomoku.board_size(board)
+    except ValueError as e:
+        raise ValueError(str(e))
+    win_length = item.get('win_length', DEFAULT_WIN_LENGTH.get(size))
+    if not isinstance(win_length, int) or not 3 <= win_length <= size:
+        raise ValueError('win_length không hợp lệ cho bàn %dx%d.' % (size, size))
+    if boards is not None and (size, win_length) not in boards:
+        raise ValueError('Không hỗ trợ bàn %dx%d với %d quân liên tiếp.'
+                         % (size, size, win_length))
+    player = item.get('player') or side_to_move(board)
+    if player not in engine.SYMBOLS:
+        raise ValueError('player phải là X hoặc O.')
+    difficulty = item.get('difficulty', 'super_hard')
+    if difficulty not in DIFFICULTIES:
+        raise ValueError('Độ khó không hợp lệ: %s' % difficulty)
+    return board, player, difficulty, win_length
+
+
+def _small_key(board, player, difficulty):
+    # Dạng chuẩn D4 và chỉ số phép biến đổi đưa bàn cờ về dạng chuẩn
+    key, index = engine.canonical_index(*engine.to_bitboard(board))
+    return (key, player, difficulty), index
+
+
+def _evaluate_large(args):
+    board, player, difficulty, win_length, time_budget = args
+    return choose_move(board, player, difficulty, win_length, time_budget)
+
+
+def _get_executor():
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        _executor = ProcessPoolExecutor(
+            EVAL_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+        _executor_pid = os.getpid()
+    return _executor
+
+
+def evaluate_batch(positions, time_budget=BATCH_TIME_BUDGET, total_budget=MAX_BATCH_BUDGET):
+    # positions: danh sách (board, player, difficulty, win_length). Trả về
+    # (danh sách (nước đi, điểm) theo đúng thứ tự, số thế cờ khác nhau).
+    # Tổng thời gian tìm kiếm các thế bàn lớn không vượt total_budget.
+    slots = []  # Mỗi thế cờ: (khóa, chỉ số phép biến đổi hoặc None)
+    small = {}
+    large = {}
+    for board, player, difficulty, win_length in positions:
+        if len(board) == 9 and win_length == 3:
+            key, index = _small_key(board, player, difficulty)
+            if key not in small:
+                x, o = key[0] >> 9, key[0] & engine.FULL_MASK
+                small[key] = engine.from_bitboard(x, o)
+            slots.append((key, index))
+        else:
+            key = (tuple(board), player, difficulty, win_length)
+            large.setdefault(key, (board, player, difficulty, win_length))
+            slots.append((key, None))
+    if large:
+        time_budget = min(time_budget, total_budget / len(large))
+        large = {key: args + (time_budget,) for key, args in large.items()}
+
+    results = {}
+    for key, board in small.items():
+        results[key] = choose_move(board, key[1], key[2])
+    if len(large) > 1 and EVAL_WORKERS > 1:
+        chunksize = max(1, len(large) // (EVAL_WORKERS * 4))
+        values = _get_executor().map(_evaluate_large, large.values(), chunksize=chunksize)
+    else:
+        values = map(_evaluate_large, large.values())
+    results.update(zip(large.keys(), values))
+
+    output = []
+    for key, index in slots:
+        move, score = results[key]
+        if index is not None and move != -1:
+            # Đưa nước đi trên dạng chuẩn về bàn cờ ban đầu
+            move = engine.SYMMETRIES[index][move]
+        output.append((move, score))
+    return output, len(results)
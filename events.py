@@ -0,0 +1,149 @@
+import copy
+import json
+import os
+import threading
+import time
+from collections import deque
+
+# Đẩy thay đổi trạng thái trò chơi tới trình duyệt qua Server-Sent Events.
+# Mỗi lần trạng thái đổi chỉ gửi các trường đã thay đổi; người xem không có
+# hàng đợi riêng mà cùng chờ trên một Condition. Tuy vậy với worker gthread
+# mỗi kết nối SSE vẫn giữ một luồng suốt thời gian mở, nên số luồng SSE của
+# một worker bị giới hạn ở MAX_STREAMS (mặc định nửa số luồng gunicorn) để
+# luôn còn luồng phục vụ /move và /. Vượt giới hạn thì trả 503, trình duyệt
+# chuyển sang hỏi lại trang phòng bằng ETag (304 khi không có gì đổi).
+HEARTBEAT_SECONDS = 15
+POLL_SECONDS = 1  # Chu kỳ hỏi kho trạng thái khi nhiều worker dùng chung
+HISTORY_EVENTS = 64
+RETRY_MS = 3000
+MAX_STREAMS = int(os.environ.get(
+    'SSE_MAX_STREAMS', int(os.environ.get('GUNICORN_THREADS', 32)) // 2))
+
+
+class EventHub:
+
+    def __init__(self, history=HISTORY_EVENTS):
+        self.version = 0
+        self.subscribers = 0
+        self.closed = False
+        self._state = {}
+        # Mỗi phần tử: (phiên bản trước, phiên bản sau, các trường thay đổi)
+        self._events = deque(maxlen=history)
+        self._cond = threading.Condition()
+
+    def publish(self, state, version=None):
+        # Ghi nhận trạng thái mới, chỉ phát sự kiện nếu có trường thay đổi.
+        # version là phiên bản trong kho trạng thái, giống nhau ở mọi worker.
+        with self._cond:
+            if version is None:
+                version = self.version + 1
+            elif version <= self.version:
+                return
+            changes = {key: copy.deepcopy(value) for key, value in state.items()
+                       if self._state.get(key) != value}
+            if changes:
+                self._state.update(changes)
+                self._events.append((self.version, version, changes))
+            self.version = version
+            self._cond.notify_all()
+
+    def close(self):
+        # Phòng đã bị xóa: kết thúc mọi luồng đang mở
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    def snapshot(self):
+        with self._cond:
+            return self.version, copy.deepcopy(self._state)
+
+    def _changes_since(self, since):
+        # Gộp các thay đổi sau phiên bản since; None nếu đã quá cũ
+        if self._events and self._events[0][0] > since:
+            return None
+        changes = {}
+        for _, version, event in self._events:
+            if version > since:
+                changes.update(event)
+        return changes
+
+    def stream(self, since=None, poll=None, touch=None):
+        # Sinh các khối văn bản SSE. Nếu biết phiên bản trình duyệt đang có
+        # (since) thì chỉ gửi phần thay đổi, nếu không thì gửi toàn bộ trạng thái.
+        # poll (nếu có) được gọi định kỳ để lấy thay đổi do worker khác ghi;
+        # touch (nếu có) được gọi mỗi vòng để báo phòng vẫn có người xem.
+        # Luồng kết thúc khi hub bị đóng.
+        with self._cond:
+            self.subscribers += 1
+            version = self.version
+            if since is None or since > version:
+                changes = copy.deepcopy(self._state)
+            elif since == version:
+                changes = None
+            else:
+                changes = self._changes_since(since)
+                if changes is None:
+                    changes = copy.deepcopy(self._state)
+        wait = POLL_SECONDS if poll is not None else HEARTBEAT_SECONDS
+        last_sent = time.monotonic()
+        try:
+            # Gửi ngay một dòng để header được đẩy đi và đặt thời gian kết nối lại
+            yield 'retry: %d\n\n' % RETRY_MS
+            if changes:
+                yield _format(version, changes)
+            while not self.closed:
+                with self._cond:
+                    self._cond.wait_for(lambda: self.version > version or self.closed,
+                                        timeout=wait)
+                if poll is not None:
+                    poll()
+                if touch is not None:
+                    touch()
+                with self._cond:
+                    if self.closed:
+                        break
+                    if self.version == version:
+                        changes = None
+                    else:
+                        changes = self._changes_since(version)
+                        if changes is None:
+                            changes = copy.deepcopy(self._state)
+                        version = self.version
+                if changes:
+                    last_sent = time.monotonic()
+                    yield _format(version, changes)
+                elif time.monotonic() - last_sent >= HEARTBEAT_SECONDS:
+                    last_sent = time.monotonic()
+                    yield ': keepalive\n\n'
+        finally:
+            with self._cond:
+                self.subscribers -= 1
+
+
+class StreamSlots:
+    # Đếm số luồng SSE đang mở trong tiến trình
+
+    def __init__(self, limit=MAX_STREAMS):
+        self.limit = limit
+        self.active = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            if self.active >= self.limit:
+                self.rejected += 1
+                return False
+            self.active += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.active -= 1
+
+
+slots = StreamSlots()
+
+
+def _format(version, changes):
+    return 'id: %d\ndata: %s\n\n' % (version, json.dumps(changes, ensure_ascii=False))
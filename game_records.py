@@ -0,0 +1,313 @@
+import argparse
+import datetime
+import json
+import mmap
+import os
+import struct
+import sys
+
+# Bản ghi ván cờ dạng nén. Thứ tự nước đi là dãy chỉ số ô: bàn 3x3 mỗi nước
+# một nửa byte (cả ván tối đa 5 byte), bàn lớn mỗi nước một byte. Cờ của ván
+# gồm ký hiệu của người chơi, ai đi trước và cạnh bàn cờ. Bàn cờ có thể nén
+# thành một số nguyên cơ số 3 (ô i có trọng số 3^i) hoặc một chuỗi mỗi ô một
+# ký tự.
+#
+# Tệp lưu trữ (python game_records.py export) gồm các bản ghi cùng độ dài để
+# có thể mmap và quét thẳng: tên người chơi được intern thành số, chế độ/độ
+# khó/kết quả là enum, thời gian là epoch. Nước đi của bàn 3x3 nằm ngay trong
+# bản ghi, của bàn lớn nằm ở vùng cuối tệp và bản ghi chỉ giữ vị trí.
+MAGIC = b'TTTR'
+VERSION = 1
+HEADER = struct.Struct('<4sHHIQQ')  # magic, phiên bản, cỡ bản ghi, số ván, vị trí tên, vị trí nước đi
+# người chơi, đối thủ, thời gian, loại ván, cờ, số nước, (dự phòng), nước đi hoặc vị trí
+RECORD = struct.Struct('<IIIBBBBQ')
+ARCHIVE_FILE = 'games.bin'
+
+MODES = ('ai', 'pvp')
+DIFFICULTIES = ('', 'super_hard', 'hard', 'normal', 'easy')
+RESULTS = ('Thắng', 'Thua', 'Hòa')
+RESULT_COLUMNS = ('wins', 'losses', 'draws')
+NO_OPPONENT = 0
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+PLAYER_X, PLAYER_FIRST = 1, 2
+SIZE_SHIFT = 2
+NIBBLE_CELLS = 15  # Bàn tối đa chừng này ô thì mỗi nước chỉ cần nửa byte
+PAD = 0xF
+CELL_CODES = {' ': 0, 'X': 1, 'O': 2}
+CELLS = (' ', 'X', 'O')
+EMPTY_CHAR = '.'  # Ô trống trong dạng chuỗi
+
+
+def pack_flags(size, symbol, first):
+    return size << SIZE_SHIFT | (symbol == 'X') * PLAYER_X | bool(first) * PLAYER_FIRST
+
+
+def unpack_flags(flags):
+    # Trả về (cạnh bàn cờ, ký hiệu của người chơi, người chơi có đi trước không)
+    return flags >> SIZE_SHIFT, 'X' if flags & PLAYER_X else 'O', bool(flags & PLAYER_FIRST)
+
+
+def pack_moves(moves, cells):
+    if cells > NIBBLE_CELLS:
+        return bytes(moves)
+    packed = bytearray()
+    for i in range(0, len(moves), 2):
+        low = moves[i]
+        high = moves[i + 1] if i + 1 < len(moves) else PAD
+        packed.append(high << 4 | low)
+    return bytes(packed)
+
+
+def unpack_moves(packed, cells):
+    if cells > NIBBLE_CELLS:
+        return list(packed)
+    moves = []
+    for byte in packed:
+        moves.append(byte & 0xF)
+        if byte >> 4 != PAD:
+            moves.append(byte >> 4)
+    return moves
+
+
+def pack_board(board):
+    code = 0
+    for cell in reversed(board):
+        code = code * 3 + CELL_CODES[cell]
+    return code
+
+
+def unpack_board(code, cells):
+    board = []
+    for _ in range(cells):
+        code, cell = divmod(code, 3)
+        board.append(CELLS[cell])
+    return board
+
+
+def board_string(board):
+    return ''.join(EMPTY_CHAR if cell == ' ' else cell for cell in board)
+
+
+def replay(moves, size, symbol, first):
+    # Dựng lại bàn cờ sau từng nước đi
+    board = [' '] * (size * size)
+    other = 'O' if symbol == 'X' else 'X'
+    turn = symbol if first else other
+    for move in moves:
+        board[move] = turn
+        turn = other if turn == symbol else symbol
+        yield list(board)
+
+
+def _epoch(timestamp):
+    if not timestamp:
+        return 0
+    try:
+        return int(datetime.datetime.strptime(timestamp, TIME_FORMAT).timestamp())
+    except ValueError:
+        return 0
+
+
+def _timestamp(epoch):
+    if not epoch:
+        return None
+    return datetime.datetime.fromtimestamp(epoch).strftime(TIME_FORMAT)
+
+
+def _enum(values, value, field):
+    # Giá trị lạ không được ghi thành mã 0 (ví dụ kết quả lạ thành 'Thắng')
+    try:
+        return values.index(value)
+    except ValueError:
+        raise ValueError('Không mã hóa được %s = %r trong tệp lưu trữ.' % (field, value))
+
+
+def export(conn, path=ARCHIVE_FILE):
+    # Ghi toàn bộ bảng games ra tệp lưu trữ. Ghi vào tệp tạm rồi đổi tên để
+    # người đang đọc tệp cũ không thấy tệp dở dang. Trả về số ván đã ghi.
+    names = {}
+    tail = bytearray()
+    count = 0
+    tmp = path + '.tmp'
+
+    def intern(name):
+        if name is None:
+            return NO_OPPONENT
+        return names.setdefault(name, len(names) + 1)
+
+    try:
+        with open(tmp, 'wb') as f:
+            f.write(bytes(HEADER.size))
+            cursor = conn.execute(
+                'SELECT username, mode, difficulty, opponent, result, timestamp, moves, flags '
+                'FROM games ORDER BY id')
+            for username, mode, difficulty, opponent, result, timestamp, moves, flags in cursor:
+                size = flags >> SIZE_SHIFT
+                moves = moves or b''
+                if size * size > NIBBLE_CELLS:
+                    # Độ dài dãy nước đi giữ trong ô "số nước" (tối đa 255)
+                    field = len(tail)
+                    tail += moves
+                    length = len(moves)
+                else:
+                    field = int.from_bytes(moves, 'little')
+                    length = len(unpack_moves(moves, size * size))
+                kind = (_enum(MODES, mode, 'mode')
+                        | _enum(DIFFICULTIES, difficulty, 'difficulty') << 1
+                        | _enum(RESULTS, result, 'result') << 4)
+                f.write(RECORD.pack(intern(username), intern(opponent), _epoch(timestamp),
+                                    kind, flags, length, 0, field))
+                count += 1
+            names_offset = f.tell()
+            f.write(json.dumps(list(names), ensure_ascii=False).encode('utf-8'))
+            moves_offset = f.tell()
+            f.write(tail)
+            f.seek(0)
+            f.write(HEADER.pack(MAGIC, VERSION, RECORD.size, count, names_offset, moves_offset))
+    except ValueError:
+        # Không để lại tệp tạm dở dang; tệp lưu trữ cũ giữ nguyên
+        os.remove(tmp)
+        raise
+    os.replace(tmp, path)
+    return count
+
+
+class GameArchive:
+    # Đọc tệp lưu trữ qua mmap; các hàm dựng lại đúng cấu trúc mà storage.py
+    # trả về cho history.html và /api/history
+
+    def __init__(self, path=ARCHIVE_FILE):
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, record_size, self.count, names_offset, self._moves_offset = \
+            HEADER.unpack_from(self._map)
+        if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+            self.close()
+            raise ValueError('Tệp lưu trữ không hợp lệ: %s' % path)
+        self.names = [None] + json.loads(self._map[names_offset:self._moves_offset])
+        self.ids = {name: i for i, name in enumerate(self.names) if i}
+        self._records = memoryview(self._map)[HEADER.size:names_offset]
+
+    def close(self):
+        self._records = None
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def __len__(self):
+        return self.count
+
+    def _scan(self, username):
+        # Các bản ghi thô của một người chơi (hoặc tất cả nếu username là None)
+        if username is None:
+            return RECORD.iter_unpack(self._records)
+        user = self.ids.get(username)
+        if user is None:
+            return iter(())
+        return (record for record in RECORD.iter_unpack(self._records) if record[0] == user)
+
+    def _moves(self, flags, length, field):
+        cells = (flags >> SIZE_SHIFT) ** 2
+        if cells > NIBBLE_CELLS:
+            start = self._moves_offset + field
+            return list(self._map[start:start + length])
+        return unpack_moves(field.to_bytes((length + 1) // 2, 'little'), cells)
+
+    def games(self, username=None):
+        # Từng ván theo thứ tự đã chơi, cùng dạng với storage.iter_games
+        for i, (user, opponent, epoch, kind, flags, length, _, field) in enumerate(
+                self._scan(username)):
+            size, symbol, first = unpack_flags(flags)
+            moves = self._moves(flags, length, field)
+            if not flags:
+                # Ván ghi trước khi có thứ tự nước đi
+                symbol = first = moves = None
+            yield {
+                'username': self.names[user],
+                'mode': MODES[kind & 1],
+                'difficulty': DIFFICULTIES[kind >> 1 & 7],
+                'opponent': self.names[opponent],
+                'result': RESULTS[kind >> 4 & 3],
+                'timestamp': _timestamp(epoch),
+                'size': size,
+                'symbol': symbol,
+                'first': first,
+                'moves': moves
+            }
+
+    def all_counters(self):
+        # Dựng lại bảng counters: {(người chơi, chế độ, độ khó): [thắng, thua, hòa]}
+        counters = {}
+        for user, _, _, kind, _, _, _, _ in RECORD.iter_unpack(self._records):
+            mode = kind & 1
+            key = (self.names[user], MODES[mode], DIFFICULTIES[kind >> 1 & 7] if mode == 0 else '')
+            counts = counters.setdefault(key, [0, 0, 0])
+            counts[kind >> 4 & 3] += 1
+        return counters
+
+    def counters(self, username):
+        # Cùng dạng với storage.get_user_counters
+        counts = {}
+        for _, _, _, kind, _, _, _, _ in self._scan(username):
+            key = (MODES[kind & 1], DIFFICULTIES[kind >> 1 & 7] if kind & 1 == 0 else '')
+            counts.setdefault(key, [0, 0, 0])[kind >> 4 & 3] += 1
+        result = {}
+        for (mode, difficulty), values in sorted(counts.items()):
+            records = dict(zip(RESULT_COLUMNS, values))
+            if mode == 'ai':
+                result.setdefault('ai', {})[difficulty] = records
+            else:
+                result[mode] = records
+        return result
+
+    def history(self, username):
+        # Cùng dạng với storage.get_user_history
+        history = self.counters(username)
+        for records in list(history.get('ai', {}).values()) + [history.get('pvp', {})]:
+            records['games'] = []
+        for game in self.games(username):
+            if game['mode'] == 'ai':
+                history['ai'][game['difficulty']]['games'].append(game['result'])
+            else:
+                history['pvp']['games'].append({'opponent': game['opponent'],
+                                                'result': game['result'],
+                                                'timestamp': game['timestamp']})
+        return history
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Xuất và đọc tệp lưu trữ các ván cờ.')
+    sub = parser.add_subparsers(dest='command', required=True)
+    export_parser = sub.add_parser('export', help='Xuất bảng games ra tệp lưu trữ')
+    export_parser.add_argument('path', nargs='?', default=ARCHIVE_FILE)
+    show_parser = sub.add_parser('show', help='In bộ đếm và các ván của một người chơi')
+    show_parser.add_argument('username')
+    show_parser.add_argument('path', nargs='?', default=ARCHIVE_FILE)
+    args = parser.parse_args(argv)
+
+    if args.command == 'export':
+        import storage
+        try:
+            count = export(storage.get_connection(), args.path)
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            return 1
+        print('Đã ghi %d ván (%d byte) vào %s' % (count, os.path.getsize(args.path), args.path))
+        return 0
+    with GameArchive(args.path) as archive:
+        json.dump({'counters': archive.counters(args.username),
+                   'games': list(archive.games(args.username))},
+                  sys.stdout, ensure_ascii=False, indent=2)
+        print()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,291 @@
+import threading
+import time
+from collections import OrderedDict
+
+# Engine cho bàn cờ NxN, thắng khi có K quân liên tiếp (5x5 - 4, caro 15x15 - 5).
+# Bàn 3x3 vẫn dùng engine.py (bảng nước đi hoàn hảo), ở đây không thể tìm
+# kiếm vét cạn nên dùng alpha-beta sâu dần có giới hạn thời gian và hàm đánh
+# giá theo các đoạn K ô, được cập nhật tăng dần sau mỗi nước đi.
+DEFAULT_TIME_BUDGET = 0.5  # Giây cho mỗi nước đi của máy
+MAX_DEPTH = 8
+# Xem đồng hồ sau khoảng CHECK_CELLS / số ô nút: mỗi nút quét và sắp xếp mọi ô
+# ứng viên nên bàn càng lớn càng phải xem thường xuyên hơn
+CHECK_CELLS = 2048
+WIN_SCORE = 10 ** 9
+EMPTY, AI, HUMAN = 0, 1, 2
+DIRECTIONS = ((0, 1), (1, 0), (1, 1), (1, -1))
+MAX_GEOMETRIES = 16  # Số bảng hình học giữ lại (LRU)
+
+_geometries = OrderedDict()
+_geometries_lock = threading.Lock()
+
+
+class _Timeout(Exception):
+    pass
+
+
+class Geometry:
+    # Chỉ mục đường dựng sẵn cho một kích thước bàn cờ và độ dài thắng
+
+    def __init__(self, size, win_length):
+        self.size = size
+        self.win_length = win_length
+        self.cells = size * size
+        # Mọi đoạn K ô liên tiếp theo 4 hướng
+        lines = []
+        for row in range(size):
+            for col in range(size):
+                for dr, dc in DIRECTIONS:
+                    end_row = row + dr * (win_length - 1)
+                    end_col = col + dc * (win_length - 1)
+                    if 0 <= end_row < size and 0 <= end_col < size:
+                        lines.append(tuple((row + dr * k) * size + col + dc * k
+                                           for k in range(win_length)))
+        self.lines = tuple(lines)
+        cell_lines = [[] for _ in range(self.cells)]
+        for index, line in enumerate(self.lines):
+            for cell in line:
+                cell_lines[cell].append(index)
+        self.cell_lines = tuple(tuple(ids) for ids in cell_lines)
+        # Chỉ xét nước đi quanh các quân đã có trên bàn
+        self.radius = 1 if size <= 5 else 2
+        neighbours = []
+        for cell in range(self.cells):
+            row, col = divmod(cell, size)
+            near = []
+            for r in range(max(0, row - self.radius), min(size, row + self.radius + 1)):
+                for c in range(max(0, col - self.radius), min(size, col + self.radius + 1)):
+                    if (r, c) != (row, col):
+                        near.append(r * size + c)
+            neighbours.append(tuple(near))
+        self.neighbours = tuple(neighbours)
+        # Số nước được xét ở mỗi nút, bàn lớn chỉ giữ các nước tốt nhất
+        self.breadth = None if self.cells <= 25 else 12
+        # Điểm của một đoạn chỉ có quân một bên, tăng theo số quân
+        self.weights = tuple(10 ** count if count else 0
+                             for count in range(win_length + 1))
+
+
+def get_geometry(size, win_length):
+    key = (size, win_length)
+    with _geometries_lock:
+        geometry = _geometries.get(key)
+        if geometry is not None:
+            _geometries.move_to_end(key)
+            return geometry
+    geometry = Geometry(size, win_length)
+    with _geometries_lock:
+        geometry = _geometries.setdefault(key, geometry)
+        while len(_geometries) > MAX_GEOMETRIES:
+            _geometries.popitem(last=False)
+    return geometry
+
+
+def board_size(board):
+    size = int(round(len(board) ** 0.5))
+    if size * size != len(board):
+        raise ValueError('Bàn cờ không vuông: %d ô' % len(board))
+    return size
+
+
+def check_winner(board, player, win_length):
+    geometry = get_geometry(board_size(board), win_length)
+    for line in geometry.lines:
+        for cell in line:
+            if board[cell] != player:
+                break
+        else:
+            return True
+    return False
+
+
+class _Position:
+    # Trạng thái tìm kiếm: số quân mỗi bên trên từng đoạn và điểm tổng được
+    # cập nhật tăng dần khi đánh/gỡ một quân.
+
+    def __init__(self, board, ai_player, geometry):
+        self.geometry = geometry
+        self.cells = [EMPTY] * geometry.cells
+        self.counts = [[0, 0, 0] for _ in geometry.lines]
+        self.near = [0] * geometry.cells
+        self.score = 0
+        self.completed = 0
+        self.stones = 0
+        self.nodes = 0
+        for cell, value in enumerate(board):
+            if value != ' ':
+                self.play(cell, AI if value == ai_player else HUMAN)
+
+    def _line_value(self, counts):
+        ai, human = counts[AI], counts[HUMAN]
+        if ai and human:
+            return 0
+        if ai:
+            return self.geometry.weights[ai]
+        return -self.geometry.weights[human]
+
+    def play(self, cell, side):
+        geometry = self.geometry
+        self.cells[cell] = side
+        self.stones += 1
+        for index in geometry.cell_lines[cell]:
+            counts = self.counts[index]
+            self.score -= self._line_value(counts)
+            counts[side] += 1
+            self.score += self._line_value(counts)
+            if counts[side] == geometry.win_length:
+                self.completed += 1
+        for other in geometry.neighbours[cell]:
+            self.near[other] += 1
+
+    def undo(self, cell, side):
+        geometry = self.geometry
+        self.cells[cell] = EMPTY
+        self.stones -= 1
+        for index in geometry.cell_lines[cell]:
+            counts = self.counts[index]
+            if counts[side] == geometry.win_length:
+                self.completed -= 1
+            self.score -= self._line_value(counts)
+            counts[side] -= 1
+            self.score += self._line_value(counts)
+        for other in geometry.neighbours[cell]:
+            self.near[other] -= 1
+
+    def _gain(self, cell):
+        # Ước lượng độ quan trọng của ô cho cả tấn công lẫn phòng thủ
+        weights = self.geometry.weights
+        gain = 0
+        for index in self.geometry.cell_lines[cell]:
+            counts = self.counts[index]
+            ai, human = counts[AI], counts[HUMAN]
+            if not human:
+                gain += weights[ai + 1]
+            if not ai:
+                gain += weights[human + 1]
+        return gain
+
+    def moves(self, first=None):
+        cells = self.cells
+        if self.stones == 0:
+            center = self.geometry.size // 2
+            return [center * self.geometry.size + center]
+        candidates = [cell for cell in range(self.geometry.cells)
+                      if self.near[cell] and cells[cell] == EMPTY]
+        candidates.sort(key=self._gain, reverse=True)
+        breadth = self.geometry.breadth
+        if breadth is not None:
+            candidates = candidates[:breadth]
+        if first is not None and first in candidates:
+            candidates.remove(first)
+            candidates.insert(0, first)
+        return candidates
+
+
+class Searcher:
+    # Alpha-beta sâu dần, dừng khi hết thời gian và dùng kết quả của độ sâu
+    # cuối cùng đã tìm xong. on_depth(nước đi, điểm, độ sâu) được gọi sau mỗi
+    # độ sâu tìm xong; should_stop() trả về True thì dừng như khi hết giờ.
+
+    def __init__(self, board, ai_player, geometry, time_budget=DEFAULT_TIME_BUDGET,
+                 max_depth=MAX_DEPTH, on_depth=None, should_stop=None):
+        self.position = _Position(board, ai_player, geometry)
+        self.time_budget = time_budget
+        self.max_depth = max_depth
+        self.on_depth = on_depth
+        self.should_stop = should_stop
+        self.deadline = None
+        self.check_every = max(1, CHECK_CELLS // geometry.cells)
+
+    def _check_time(self):
+        if time.perf_counter() > self.deadline or (
+                self.should_stop is not None and self.should_stop()):
+            raise _Timeout()
+
+    def _negamax(self, depth, alpha, beta, side, ply):
+        position = self.position
+        position.nodes += 1
+        if position.nodes % self.check_every == 0:
+            self._check_time()
+        if position.completed:
+            # Bên vừa đi đã thắng, thắng càng sớm càng tốt
+            return -(WIN_SCORE - ply)
+        if position.stones == position.geometry.cells:
+            return 0
+        if depth == 0:
+            return position.score if side == AI else -position.score
+
+        best = -WIN_SCORE - 1
+        for cell in position.moves():
+            position.play(cell, side)
+            try:
+                score = -self._negamax(depth - 1, -beta, -alpha, 3 - side, ply + 1)
+            finally:
+                position.undo(cell, side)
+            if score > best:
+                best = score
+            if score > alpha:
+                alpha = score
+            if alpha >= beta:
+                break
+        return best
+
+    def _root(self, depth, first):
+        position = self.position
+        best_move, best_score = -1, -WIN_SCORE - 1
+        alpha = -WIN_SCORE - 1
+        for cell in position.moves(first):
+            self._check_time()
+            position.play(cell, AI)
+            try:
+                score = -self._negamax(depth - 1, -WIN_SCORE - 1, -alpha, HUMAN, 1)
+            finally:
+                position.undo(cell, AI)
+            if score > best_score:
+                best_move, best_score = cell, score
+            if score > alpha:
+                alpha = score
+        return best_move, best_score
+
+    def search(self):
+        # Trả về (nước đi, điểm, độ sâu đã tìm xong, số nút đã duyệt)
+        self.deadline = time.perf_counter() + self.time_budget
+        position = self.position
+        moves = position.moves()
+        if not moves:
+            return -1, 0, 0, 0
+        if len(moves) == 1:
+            return moves[0], 0, 0, position.nodes
+        best_move, best_score, reached = moves[0], 0, 0
+        for depth in range(1, self.max_depth + 1):
+            try:
+                move, score = self._root(depth, best_move)
+            except _Timeout:
+                break
+            best_move, best_score, reached = move, score, depth
+            if self.on_depth is not None:
+                self.on_depth(move, score, depth)
+            if abs(score) >= WIN_SCORE - self.max_depth:
+                break
+        return best_move, best_score, reached, position.nodes
+
+
+def best_move(board, ai_player, win_length, time_budget=DEFAULT_TIME_BUDGET):
+    geometry = get_geometry(board_size(board), win_length)
+    return Searcher(board, ai_player, geometry, time_budget).search()[0]
+
+
+def worst_move(board, ai_player, win_length):
+    # AI cố gắng thua: tránh nước thắng, chọn ô làm điểm của máy thấp nhất
+    geometry = get_geometry(board_size(board), win_length)
+    position = _Position(board, ai_player, geometry)
+    move, worst_score = -1, None
+    for cell in range(geometry.cells):
+        if position.cells[cell] != EMPTY:
+            continue
+        position.play(cell, AI)
+        score = WIN_SCORE if position.completed else position.score
+        position.undo(cell, AI)
+        if worst_score is None or score < worst_score:
+            move, worst_score = cell, score
+    return move
@@ -0,0 +1,14 @@
+# Cấu hình gunicorn: nạp ứng dụng một lần trong tiến trình chính (preload) để
+# các worker dùng chung bảng nước đi, sách khai cuộc và template đã biên dịch
+# theo copy-on-write, rồi làm nóng phần riêng của từng worker sau khi fork.
+import os
+
+wsgi_app = 'tictactoe:create_app()'
+preload_app = True
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 32))
+
+
+def post_fork(server, worker):
+    import tictactoe
+    tictactoe.warm_worker()
@@ -0,0 +1,232 @@
+import threading
+import time
+
+# Bảng xếp hạng giữa các người chơi, tính trên các bảng tổng hợp trong
+# history.db (xem storage.py) chứ không bao giờ quét lịch sử:
+# - Chơi với máy theo từng độ khó và chơi với người: điểm = 2 * thắng + hòa,
+#   top-K đọc thẳng từ chỉ mục counters_rank.
+# - Elo cho chơi với người: bảng ratings, top-K qua chỉ mục ratings_rank.
+# Thứ hạng của một người (1 + số người có điểm cao hơn) đọc từ cây Fenwick
+# lưu trong bảng rank_tree: mỗi bảng xếp hạng một cây trên miền điểm
+# [0, TREE_SIZE), cập nhật và truy vấn đều chỉ chạm O(log TREE_SIZE) dòng.
+# Các hàm ở đây chạy trong giao dịch của storage.py.
+TREE_BITS = 20
+TREE_SIZE = 1 << TREE_BITS
+INITIAL_RATING = 1500
+ELO_K = 32
+PAGE_TTL = 10  # Giây giữ trang xếp hạng đã dựng
+TOP_K = 50
+MAX_TOP_K = 200
+
+ELO_BOARD = 'elo'
+PVP_BOARD = 'pvp'
+RESULT_SCORES = {'Thắng': 1.0, 'Thua': 0.0, 'Hòa': 0.5}
+
+SCHEMA = """
+CREATE INDEX IF NOT EXISTS counters_rank
+    ON counters (mode, difficulty, (2 * wins + draws) DESC, username);
+CREATE TABLE IF NOT EXISTS ratings (
+    username TEXT PRIMARY KEY,
+    rating REAL NOT NULL,
+    games INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS ratings_rank ON ratings (rating DESC, username);
+CREATE TABLE IF NOT EXISTS rank_tree (
+    board TEXT NOT NULL,
+    node INTEGER NOT NULL,
+    users INTEGER NOT NULL,
+    PRIMARY KEY (board, node)
+) WITHOUT ROWID;
+"""
+
+
+def board_of(mode, difficulty):
+    # Tên bảng xếp hạng của một dòng counters: 'ai:<độ khó>' hoặc 'pvp'
+    return 'ai:' + difficulty if mode == 'ai' else mode
+
+
+def points(wins, losses, draws):
+    return 2 * wins + draws
+
+
+def _clamp(score):
+    return max(0, min(int(round(score)), TREE_SIZE - 1))
+
+
+def _update_nodes(score):
+    # Các nút của cây Fenwick chứa vị trí score (đánh số từ 1)
+    i = _clamp(score) + 1
+    while i <= TREE_SIZE:
+        yield i
+        i += i & -i
+
+
+def _prefix_nodes(score):
+    # Các nút cộng lại thành số người có điểm <= score
+    i = _clamp(score) + 1
+    while i > 0:
+        yield i
+        i -= i & -i
+
+
+def _tree_add(conn, board, deltas):
+    conn.executemany(
+        'INSERT INTO rank_tree (board, node, users) VALUES (?, ?, ?) '
+        'ON CONFLICT (board, node) DO UPDATE SET users = users + excluded.users',
+        [(board, node, delta) for node, delta in deltas.items() if delta])
+
+
+def _tree_sum(conn, board, nodes):
+    nodes = list(nodes)
+    row = conn.execute(
+        'SELECT SUM(users) FROM rank_tree WHERE board = ? AND node IN (%s)'
+        % ', '.join('?' * len(nodes)), [board] + nodes).fetchone()
+    return row[0] or 0
+
+
+def move_score(conn, board, old, new):
+    # old là None khi người chơi mới xuất hiện trên bảng này. Các nút nằm trên
+    # cả hai đường cập nhật triệt tiêu nhau nên thường chỉ vài dòng bị ghi.
+    deltas = {}
+    if old is not None:
+        for node in _update_nodes(old):
+            deltas[node] = -1
+    for node in _update_nodes(new):
+        deltas[node] = deltas.get(node, 0) + 1
+    _tree_add(conn, board, deltas)
+
+
+def rank(conn, board, score):
+    # 1 + số người có điểm cao hơn; người bằng điểm cùng hạng
+    total = _tree_sum(conn, board, [TREE_SIZE])
+    return 1 + total - _tree_sum(conn, board, _prefix_nodes(score))
+
+
+def board_size(conn, board):
+    return _tree_sum(conn, board, [TREE_SIZE])
+
+
+def expected(rating, opponent_rating):
+    return 1 / (1 + 10 ** ((opponent_rating - rating) / 400))
+
+
+def get_rating(conn, username):
+    row = conn.execute('SELECT rating, games FROM ratings WHERE username = ?',
+                       (username,)).fetchone()
+    return row if row is not None else (None, 0)
+
+
+def record_elo(conn, username, opponent, result):
+    # Cập nhật Elo của cả hai người sau một ván; result theo góc nhìn username
+    old, games = get_rating(conn, username)
+    opponent_old, opponent_games = get_rating(conn, opponent)
+    rating = INITIAL_RATING if old is None else old
+    opponent_rating = INITIAL_RATING if opponent_old is None else opponent_old
+    change = ELO_K * (RESULT_SCORES[result] - expected(rating, opponent_rating))
+    for name, before, after, played in (
+            (username, old, rating + change, games),
+            (opponent, opponent_old, opponent_rating - change, opponent_games)):
+        conn.execute(
+            'INSERT INTO ratings (username, rating, games) VALUES (?, ?, ?) '
+            'ON CONFLICT (username) DO UPDATE SET rating = excluded.rating, '
+            'games = excluded.games', (name, after, played + 1))
+        move_score(conn, ELO_BOARD, before, after)
+
+
+def rebuild(conn):
+    # Dựng lại toàn bộ cây từ các bảng tổng hợp (một lần khi nâng cấp hoặc
+    # sau khi chuyển dữ liệu từ history.json)
+    trees = {}
+
+    def add(board, score):
+        tree = trees.setdefault(board, {})
+        for node in _update_nodes(score):
+            tree[node] = tree.get(node, 0) + 1
+
+    for mode, difficulty, wins, losses, draws in conn.execute(
+            'SELECT mode, difficulty, wins, losses, draws FROM counters'):
+        add(board_of(mode, difficulty), points(wins, losses, draws))
+    for (rating,) in conn.execute('SELECT rating FROM ratings'):
+        add(ELO_BOARD, rating)
+    conn.execute('DELETE FROM rank_tree')
+    conn.executemany('INSERT INTO rank_tree (board, node, users) VALUES (?, ?, ?)',
+                     [(board, node, users) for board, tree in trees.items()
+                      for node, users in tree.items()])
+
+
+def top(conn, board, limit=TOP_K):
+    # Top-K của một bảng xếp hạng, đọc theo chỉ mục nên không phụ thuộc số
+    # người chơi. Hạng tính theo điểm: người bằng điểm cùng hạng.
+    if board == ELO_BOARD:
+        rows = conn.execute(
+            'SELECT username, rating, games FROM ratings '
+            'ORDER BY rating DESC, username LIMIT ?', (limit,))
+        entries = [{'username': username, 'score': round(rating), 'games': games}
+                   for username, rating, games in rows]
+    else:
+        mode, _, difficulty = board.partition(':')
+        rows = conn.execute(
+            'SELECT username, wins, losses, draws FROM counters '
+            'WHERE mode = ? AND difficulty = ? '
+            'ORDER BY 2 * wins + draws DESC, username LIMIT ?', (mode, difficulty, limit))
+        entries = [{'username': username, 'score': points(wins, losses, draws),
+                    'wins': wins, 'losses': losses, 'draws': draws}
+                   for username, wins, losses, draws in rows]
+    for index, entry in enumerate(entries):
+        if index and entry['score'] == entries[index - 1]['score']:
+            entry['rank'] = entries[index - 1]['rank']
+        else:
+            entry['rank'] = index + 1
+    return entries
+
+
+def user_score(conn, board, username):
+    # Điểm của người chơi trên bảng, None nếu chưa có mặt
+    if board == ELO_BOARD:
+        rating = get_rating(conn, username)[0]
+        return None if rating is None else round(rating)
+    mode, _, difficulty = board.partition(':')
+    row = conn.execute(
+        'SELECT wins, losses, draws FROM counters '
+        'WHERE username = ? AND mode = ? AND difficulty = ?',
+        (username, mode, difficulty)).fetchone()
+    return None if row is None else points(*row)
+
+
+def user_rank(conn, board, username):
+    # (hạng, điểm) của người chơi; (None, None) nếu chưa có mặt trên bảng
+    score = user_score(conn, board, username)
+    if score is None:
+        return None, None
+    return rank(conn, board, score), score
+
+
+class PageCache:
+    # Giữ phần dùng chung của trang xếp hạng trong PAGE_TTL giây; hết hạn thì
+    # chỉ một luồng dựng lại, các luồng khác vẫn dùng bản cũ
+
+    def __init__(self, ttl=PAGE_TTL):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._building = set()
+
+    def get(self, key, build):
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry is not None and entry[1] > now:
+            return entry[0]
+        with self._lock:
+            if entry is not None and key in self._building:
+                return entry[0]
+            self._building.add(key)
+        try:
+            value = build()
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+        finally:
+            with self._lock:
+                self._building.discard(key)
+        return value
+
+    def clear(self):
+        self._entries.clear()
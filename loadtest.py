@@ -0,0 +1,719 @@
+import argparse
+import http.client
+import json
+import logging
+import multiprocessing
+import os
+import random
+import re
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from http.cookies import SimpleCookie
+
+# Bộ tạo tải: giả lập N người chơi với máy (nhiều độ khó) và M cặp chơi với
+# người kèm người xem, đi qua đúng các route mà trình duyệt dùng (/login, /,
+# /move, /ai_job, /room, /ready, /continue, /history). Báo cáo thông lượng,
+# p50/p95/p99 theo route, thời gian chờ khóa phòng, số lần CAS phải thử lại và
+# mức tăng của history.db.
+#
+# Mặc định chạy app ngay trong các tiến trình con qua test client của Flask:
+# `workers` tiến trình (như worker gunicorn), mỗi tiến trình xử lý tối đa
+# `threads` request cùng lúc; mỗi người dùng giả lập gắn cố định với một tiến
+# trình (như sticky session), một cặp chơi và người xem của nó luôn cùng tiến
+# trình. Với --routing random thì mỗi worker mở một cổng HTTP, người dùng chạy ở
+# tiến trình cha và mỗi request đi tới một worker ngẫu nhiên (bộ cân bằng tải
+# không sticky): session và phòng phải dùng chung được giữa các worker. Với
+# --url thì bắn vào máy chủ đang chạy (keep-alive, giữ cookie); nhiều URL cách
+# nhau bởi dấu phẩy thì định tuyến giữa chúng theo --routing.
+#
+#   python loadtest.py                                  # kịch bản mặc định
+#   python loadtest.py --config loadtest_scenarios.json # so sánh nhiều kịch bản
+#   python loadtest.py --ai-players 20 --workers 2 --threads 4 --state-store sqlite
+#   python loadtest.py --workers 4 --routing random --state-store sqlite
+#   python loadtest.py --url http://127.0.0.1:8000
+#
+# Người chơi với người hỏi lại trang phòng theo chu kỳ kèm If-None-Match (như
+# trình duyệt không có SSE), không mở luồng /events.
+DEFAULTS = {
+    'name': 'default',
+    'ai_players': 8,
+    'difficulties': ['super_hard', 'hard', 'normal', 'easy'],
+    'board': '3x3',
+    'pvp_pairs': 4,
+    'spectators': 2,  # Số người xem mỗi cặp
+    'games': 3,  # Số ván mỗi người chơi
+    'duration': 120,  # Giây tối đa cho cả kịch bản
+    'workers': 1,
+    'threads': 8,
+    'state_store': 'memory',
+    'session_store': 'sqlite',
+    'ai_workers': 2,  # Số tiến trình tính nước đi của mỗi worker
+    'think_time': 0.0,  # Giây người chơi nghĩ trước mỗi nước
+    'poll_interval': 0.05,  # Giây giữa hai lần tải lại trang khi chờ
+    'routing': 'sticky',  # sticky: mỗi người dùng một worker; random: mỗi request một worker
+    'seed': 0,
+    'url': None
+}
+PERCENTILES = (50, 95, 99)
+READY_TIMEOUT = 120
+AI_JOB_POLLS = 100
+AI_RETRY_DELAY = 1  # Giây chờ khi hàng đợi của máy đầy, gấp đôi mỗi lần như game.html
+AI_RETRY_MAX_DELAY = 8
+STUCK_PAIRS = 'pvp: cặp không bắt đầu ván'
+CONTENTION_KEYS = ('room_lock_wait_seconds', 'room_lock_waits', 'cas_conflicts')
+
+MOVE_RE = re.compile(r'makeMove\((\d+)\)')
+AI_JOB_RE = re.compile(r"waitForAI\('([0-9a-f]+)'\)")
+ROOM_BOARD_RE = re.compile(r'board: (\[.*?\]),')
+ROOM_TURN_RE = re.compile(r'turn: (".*?"),')
+ROOM_OVER_RE = re.compile(r'game_over: (true|false),')
+AI_GAME_OVER = 'href="/reset"'
+READY_FORM = 'action="/ready"'
+CONTINUE_FORM = 'action="/continue"'
+
+
+class TestClientTransport:
+    # Request đi thẳng vào app trong tiến trình; slots giới hạn số request xử
+    # lý cùng lúc như số luồng của một worker gunicorn
+
+    def __init__(self, app, slots):
+        self.client = app.test_client()
+        self.slots = slots
+
+    def request(self, method, path, form=None, json_body=None, headers=None):
+        with self.slots:
+            response = self.client.open(path, method=method, data=form, json=json_body,
+                                        headers=headers)
+            return response.status_code, response.headers, response.get_data(as_text=True)
+
+
+class HTTPTransport:
+    # Kết nối keep-alive của một người dùng giả lập, tự giữ cookie session. Có
+    # nhiều máy chủ: sticky thì chọn một máy chủ từ đầu, không thì mỗi request
+    # đi tới một máy chủ ngẫu nhiên và cookie đi theo người dùng
+
+    def __init__(self, urls, rng=None, sticky=True):
+        if isinstance(urls, str):
+            urls = [urls]
+        self.rng = rng or random.Random()
+        self.servers = []
+        for url in urls:
+            parts = urllib.parse.urlsplit(url)
+            self.servers.append((parts.scheme == 'https', parts.hostname,
+                                 parts.port or (443 if parts.scheme == 'https' else 80)))
+        if sticky:
+            self.servers = [self.rng.choice(self.servers)]
+        self.cookies = {}
+        self._conns = {}
+
+    def _connect(self, server):
+        https, host, port = server
+        if https:
+            return http.client.HTTPSConnection(host, port, timeout=30)
+        return http.client.HTTPConnection(host, port, timeout=30)
+
+    def request(self, method, path, form=None, json_body=None, headers=None):
+        headers = dict(headers or {})
+        body = None
+        if form is not None:
+            body = urllib.parse.urlencode(form)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        elif json_body is not None:
+            body = json.dumps(json_body)
+            headers['Content-Type'] = 'application/json'
+        if self.cookies:
+            headers['Cookie'] = '; '.join('%s=%s' % item for item in self.cookies.items())
+        server = self.servers[0] if len(self.servers) == 1 else self.rng.choice(self.servers)
+        for attempt in range(2):
+            conn = self._conns.get(server)
+            if conn is None:
+                conn = self._conns[server] = self._connect(server)
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                response = conn.getresponse()
+                data = response.read().decode('utf-8', 'replace')
+                break
+            except (http.client.HTTPException, OSError):
+                # Máy chủ đóng kết nối keep-alive: mở lại và thử một lần nữa
+                conn.close()
+                del self._conns[server]
+                if attempt:
+                    raise
+        for header in response.headers.get_all('Set-Cookie') or ():
+            for name, morsel in SimpleCookie(header).items():
+                if morsel.value:
+                    self.cookies[name] = morsel.value
+                else:
+                    self.cookies.pop(name, None)
+        return response.status, response.headers, data
+
+    def close(self):
+        for conn in self._conns.values():
+            conn.close()
+        self._conns.clear()
+
+
+class User:
+    # Một người dùng giả lập; độ trễ ghi riêng theo từng người để không cần khóa
+
+    def __init__(self, name, transport, scenario, deadline, rng):
+        self.name = name
+        self.transport = transport
+        self.scenario = scenario
+        self.deadline = deadline
+        self.rng = rng
+        self.latencies = {}  # route -> [mili giây]
+        self.errors = {}  # route -> số lỗi
+        self.games = 0
+        self.room = None  # Đường dẫn phòng của người chơi với người
+
+    def expired(self):
+        return time.monotonic() >= self.deadline
+
+    def request(self, route, method, path, **kwargs):
+        started = time.perf_counter()
+        try:
+            status, headers, body = self.transport.request(method, path, **kwargs)
+        except Exception:
+            status, headers, body = 599, {}, ''
+        self.latencies.setdefault(route, []).append((time.perf_counter() - started) * 1000)
+        if status >= 500:
+            self.errors[route] = self.errors.get(route, 0) + 1
+        return status, headers, body
+
+    def login(self, mode, difficulty=None):
+        form = {'username': self.name, 'mode': mode, 'board': self.scenario['board']}
+        if difficulty is not None:
+            form['difficulty'] = difficulty
+        self.request('/login', 'POST', '/login', form=form)
+
+    def pause(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds)
+
+
+def play_ai(user, difficulty):
+    user.login('ai', difficulty)
+    _, _, page = user.request('/', 'GET', '/')
+    while user.games < user.scenario['games'] and not user.expired():
+        if AI_GAME_OVER in page:
+            user.games += 1
+            user.request('/history', 'GET', '/history')
+            user.request('/reset', 'GET', '/reset')
+        else:
+            cells = [int(cell) for cell in MOVE_RE.findall(page)]
+            job = AI_JOB_RE.search(page)
+            if cells:
+                user.pause(user.scenario['think_time'])
+                status, _, body = user.request('/move', 'POST', '/move',
+                                               json_body={'position': user.rng.choice(cells)})
+                if status == 200:
+                    wait_ai_job(user, json.loads(body).get('job'))
+                else:
+                    # Hàng đợi của máy đầy (503): chờ rồi tải lại trang
+                    user.pause(1)
+            elif job is not None:
+                wait_ai_job(user, job.group(1))
+            else:
+                # Hàng đợi đầy lúc trước nên chưa có công việc: /ai_job gửi lại
+                wait_ai_job(user, None)
+        _, _, page = user.request('/', 'GET', '/')
+    user.request('/logout', 'GET', '/logout')
+
+
+def wait_ai_job(user, job_id):
+    # Như trình duyệt: hỏi /ai_job cho tới khi máy đánh xong; không có mã công
+    # việc thì hỏi /ai_job, hàng đợi đầy thì chờ lâu dần rồi hỏi lại
+    delay = AI_RETRY_DELAY
+    for _ in range(AI_JOB_POLLS):
+        if job_id:
+            status, _, body = user.request('/ai_job/<job_id>', 'GET', '/ai_job/' + job_id)
+        else:
+            status, _, body = user.request('/ai_job', 'GET', '/ai_job')
+        if status != 200 or user.expired():
+            return
+        data = json.loads(body)
+        if data.get('status') == 'busy':
+            user.pause(delay)
+            delay = min(delay * 2, AI_RETRY_MAX_DELAY)
+        elif data.get('status') == 'pending':
+            job_id = data.get('job') or job_id
+        else:
+            return
+
+
+class Group:
+    # Một cặp chơi với người và người xem của nó. Ghép cặp do máy chủ quyết định
+    # nên hai người trong nhóm có thể vào hai phòng khác nhau; started ghi những
+    # người đã thực sự chơi (đi một nước hoặc thấy một ván kết thúc)
+
+    def __init__(self):
+        self.room = None
+        self.players_left = 2
+        self.started = set()
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+
+    def player_started(self, name):
+        with self.lock:
+            self.started.add(name)
+
+    def player_done(self):
+        with self.lock:
+            self.players_left -= 1
+            if not self.players_left:
+                self.done.set()
+
+
+def room_page(user, path, cache):
+    # Tải lại trang phòng kèm If-None-Match; 304 thì dùng lại bản đã có
+    headers = {'If-None-Match': cache['etag']} if cache.get('etag') else None
+    status, response_headers, body = user.request('/room/<room_id>', 'GET', path,
+                                                  headers=headers)
+    if status == 304:
+        return cache['page']
+    cache['etag'] = response_headers.get('ETag')
+    cache['page'] = body
+    return body
+
+
+def play_pvp(user, group):
+    try:
+        user.login('player')
+        status, headers, _ = user.request('/', 'GET', '/')
+        if status != 302:
+            return
+        path = urllib.parse.urlsplit(headers['Location']).path
+        if not path.startswith('/room/'):
+            return
+        user.room = path
+        cache = {}
+        while not user.expired():
+            page = room_page(user, path, cache)
+            if CONTINUE_FORM in page:
+                # Ván vừa kết thúc: cả hai người đều đếm, run_users gộp theo phòng
+                user.games += 1
+                group.player_started(user.name)
+                if user.games >= user.scenario['games']:
+                    break
+                user.request('/continue', 'POST', '/continue')
+                continue
+            if READY_FORM in page:
+                user.request('/ready', 'POST', '/ready')
+                continue
+            board = ROOM_BOARD_RE.search(page)
+            turn = ROOM_TURN_RE.search(page)
+            over = ROOM_OVER_RE.search(page)
+            if (board is not None and turn is not None and over is not None
+                    and over.group(1) == 'false' and json.loads(turn.group(1)) == user.name):
+                cells = [i for i, cell in enumerate(json.loads(board.group(1))) if cell == ' ']
+                if cells:
+                    user.pause(user.scenario['think_time'])
+                    user.request('/move', 'POST', '/move',
+                                 json_body={'position': user.rng.choice(cells)})
+                    # Phòng chắc chắn đã đủ hai người: người xem có thể vào
+                    group.room = group.room or path
+                    group.player_started(user.name)
+                    continue
+            user.pause(user.scenario['poll_interval'])
+        user.request('/logout', 'GET', '/logout')
+    finally:
+        group.player_done()
+
+
+def spectate(user, group):
+    user.login('player')
+    while group.room is None and not group.done.is_set() and not user.expired():
+        time.sleep(user.scenario['poll_interval'])
+    cache = {}
+    while group.room is not None and not group.done.is_set() and not user.expired():
+        room_page(user, group.room, cache)
+        user.pause(user.scenario['poll_interval'])
+    user.request('/logout', 'GET', '/logout')
+
+
+def make_users(scenario, prefix, ai_players, groups, transport_factory, deadline):
+    # Trả về danh sách (User, hàm chạy, tham số)
+    rng = random.Random('%s-%s-%s' % (scenario['seed'], scenario['name'], prefix))
+    users = []
+
+    def user(name):
+        return User('%s%s' % (prefix, name), transport_factory(), scenario, deadline,
+                    random.Random(rng.random()))
+
+    for index in ai_players:
+        difficulty = scenario['difficulties'][index % len(scenario['difficulties'])]
+        users.append((user('ai%d' % index), play_ai, difficulty))
+    for index in groups:
+        group = Group()
+        for side in ('a', 'b'):
+            users.append((user('p%d%s' % (index, side)), play_pvp, group))
+        for viewer in range(scenario['spectators']):
+            users.append((user('v%d_%d' % (index, viewer)), spectate, group))
+    return users
+
+
+def run_users(users):
+    threads = [threading.Thread(target=func, args=(user, arg), daemon=True)
+               for user, func, arg in users]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    latencies, errors = {}, {}
+    ai_games = 0
+    pvp_rooms = {}  # phòng -> số ván; hai người cùng phòng thấy cùng các ván
+    groups = {}
+    for user, func, arg in users:
+        for route, values in user.latencies.items():
+            latencies.setdefault(route, []).extend(values)
+        for route, count in user.errors.items():
+            errors[route] = errors.get(route, 0) + count
+        if func is play_ai:
+            ai_games += user.games
+        elif func is play_pvp:
+            groups[id(arg)] = arg
+            if user.room is not None:
+                pvp_rooms[user.room] = max(pvp_rooms.get(user.room, 0), user.games)
+    # Cặp có người không vào được ván nào (kẹt ở hàng chờ, mất session hay mất
+    # phòng khi chuyển worker) là lỗi, dù không request nào trả về 5xx
+    stuck = sum(1 for group in groups.values() if len(group.started) < 2)
+    if stuck:
+        errors[STUCK_PAIRS] = stuck
+    return {'elapsed': elapsed, 'latencies': latencies, 'errors': errors,
+            'ai_games': ai_games, 'pvp_rooms': pvp_rooms, 'stuck_pairs': stuck}
+
+
+def metric_value(text, name):
+    # Tổng các dòng của một số liệu trong định dạng văn bản Prometheus
+    total = None
+    for line in text.splitlines():
+        if line.startswith(name) and line[len(name):len(name) + 1] in (' ', '{'):
+            total = (total or 0) + float(line.rsplit(' ', 1)[1])
+    return total
+
+
+def contention(text):
+    return {
+        'room_lock_wait_seconds': metric_value(text, 'tictactoe_room_lock_wait_seconds_sum'),
+        'room_lock_waits': metric_value(text, 'tictactoe_room_lock_wait_seconds_count'),
+        'cas_conflicts': metric_value(text, 'tictactoe_room_cas_conflicts_total')
+    }
+
+
+def sum_contention(parts):
+    # Cộng số liệu của nhiều worker; None khi không worker nào có số liệu đó
+    result = {}
+    for key in CONTENTION_KEYS:
+        values = [part[key] for part in parts if part.get(key) is not None]
+        result[key] = sum(values) if values else None
+    return result
+
+
+def bounded_app(app, slots):
+    # Giới hạn số request xử lý cùng lúc như số luồng của một worker gunicorn.
+    # Đọc hết thân response trong lúc giữ chỗ; tải giả lập không dùng SSE
+    def wrapped(environ, start_response):
+        with slots:
+            body = app(environ, start_response)
+            try:
+                return [b''.join(body)]
+            finally:
+                if hasattr(body, 'close'):
+                    body.close()
+    return wrapped
+
+
+def _split(items, parts, index):
+    return [item for item in items if item % parts == index]
+
+
+def worker_main(index, scenario, workdir, results, start, stop):
+    # Tiến trình con: một "worker gunicorn" chạy app và các người dùng gắn với
+    # nó; khi không sticky thì chỉ phục vụ HTTP cho người dùng ở tiến trình cha
+    os.chdir(workdir)
+    os.environ.update({
+        'GAME_STATE_STORE': scenario['state_store'],
+        'SESSION_STORE': scenario['session_store'],
+        # Kết quả nước đi của máy dùng chung giữa các worker như session
+        'AI_JOB_STORE': scenario['session_store'],
+        'AI_WORKERS': str(scenario['ai_workers']),
+        'METRICS': '1',
+        'LOG_LEVEL': 'WARNING'
+    })
+    import metrics
+    import tictactoe
+
+    tictactoe.create_app()
+    tictactoe.warm_worker()
+    waited = time.monotonic() + READY_TIMEOUT
+    while not tictactoe.startup_state.status()['worker_ready'] and time.monotonic() < waited:
+        time.sleep(0.05)
+    slots = threading.BoundedSemaphore(scenario['threads'])
+    server = None
+    if scenario['routing'] != 'sticky':
+        from werkzeug.serving import make_server
+
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+        server = make_server('127.0.0.1', 0, bounded_app(tictactoe.app, slots), threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    results.put(('ready', index, tictactoe.startup_state.status()['steps'],
+                 server.server_port if server is not None else None))
+    start.wait()
+    if server is not None:
+        stop.wait()
+        server.shutdown()
+        results.put(('done', index, contention(metrics.render())))
+        if tictactoe.ai_pool._executor is not None:
+            tictactoe.ai_pool._executor.shutdown(cancel_futures=True)
+        return
+    deadline = time.monotonic() + scenario['duration']
+    users = make_users(
+        scenario, 'w%d_' % index,
+        _split(range(scenario['ai_players']), scenario['workers'], index),
+        _split(range(scenario['pvp_pairs']), scenario['workers'], index),
+        lambda: TestClientTransport(tictactoe.app, slots), deadline)
+    part = run_users(users)
+    part.update(contention(metrics.render()))
+    results.put(('done', index, part))
+    if tictactoe.ai_pool._executor is not None:
+        tictactoe.ai_pool._executor.shutdown(cancel_futures=True)
+
+
+def history_stats(path):
+    # Kích thước history.db (kể cả WAL) và số ván đã lưu
+    size = sum(os.path.getsize(name) for name in (path, path + '-wal') if os.path.exists(name))
+    games = None
+    if os.path.exists(path):
+        conn = sqlite3.connect('file:%s?mode=ro' % urllib.parse.quote(os.path.abspath(path)),
+                               uri=True)
+        try:
+            games = conn.execute('SELECT COUNT(*) FROM games').fetchone()[0]
+        except sqlite3.Error:
+            pass
+        finally:
+            conn.close()
+    return {'bytes': size, 'games': games}
+
+
+def run_local(scenario):
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    start = context.Event()
+    stop = context.Event()
+    with tempfile.TemporaryDirectory() as workdir:
+        processes = [context.Process(target=worker_main,
+                                     args=(index, scenario, workdir, results, start, stop))
+                     for index in range(scenario['workers'])]
+        boot = time.perf_counter()
+        for process in processes:
+            process.start()
+        startup = [results.get(timeout=READY_TIMEOUT * 2) for _ in processes]
+        boot = time.perf_counter() - boot
+        history_path = os.path.join(workdir, 'history.db')
+        before = history_stats(history_path)
+        start.set()
+        if scenario['routing'] == 'sticky':
+            parts = [results.get(timeout=scenario['duration'] + READY_TIMEOUT)[2]
+                     for _ in processes]
+        else:
+            urls = ['http://127.0.0.1:%d' % port for _, _, _, port in startup]
+            part = run_http(scenario, urls, 'l_')
+            stop.set()
+            part.update(sum_contention([results.get(timeout=READY_TIMEOUT)[2]
+                                        for _ in processes]))
+            parts = [part]
+        for process in processes:
+            process.join()
+        after = history_stats(history_path)
+    merged = merge(parts)
+    merged['startup'] = {'boot_seconds': round(boot, 3),
+                         'steps': {index: steps for _, index, steps, _ in startup}}
+    merged['history'] = {'before': before, 'after': after}
+    return merged
+
+
+def run_http(scenario, urls, prefix):
+    # Người dùng giả lập trong tiến trình này, gọi các máy chủ qua HTTP
+    deadline = time.monotonic() + scenario['duration']
+    rng = random.Random('%s-%s-routing' % (scenario['seed'], scenario['name']))
+    sticky = scenario['routing'] == 'sticky'
+    transports = []
+
+    def factory():
+        transport = HTTPTransport(urls, random.Random(rng.random()), sticky)
+        transports.append(transport)
+        return transport
+
+    users = make_users(scenario, prefix, range(scenario['ai_players']),
+                       range(scenario['pvp_pairs']), factory, deadline)
+    part = run_users(users)
+    for transport in transports:
+        transport.close()
+    return part
+
+
+def run_remote(scenario, history_db=None):
+    urls = [url.strip() for url in scenario['url'].split(',') if url.strip()]
+    before = history_stats(history_db) if history_db else None
+    part = run_http(scenario, urls, 'r_')
+    texts = []
+    for url in urls:
+        probe = HTTPTransport(url)
+        try:
+            status, _, text = probe.request('GET', '/metrics')
+        except OSError:
+            status, text = None, ''
+        probe.close()
+        texts.append(text if status == 200 else '')
+    # Chỉ có số liệu khi máy chủ bật METRICS=1, và chỉ của worker trả lời
+    part.update(sum_contention([contention(text) for text in texts]))
+    merged = merge([part])
+    if history_db:
+        merged['history'] = {'before': before, 'after': history_stats(history_db)}
+    return merged
+
+
+def _percentile(values, p):
+    # values đã sắp xếp; hạng gần nhất
+    rank = max(1, -(-len(values) * p // 100))
+    return values[min(len(values), int(rank)) - 1]
+
+
+def merge(parts):
+    latencies, errors, pvp_rooms = {}, {}, {}
+    for part in parts:
+        for route, values in part['latencies'].items():
+            latencies.setdefault(route, []).extend(values)
+        for route, count in part['errors'].items():
+            errors[route] = errors.get(route, 0) + count
+        # Với kho trạng thái dùng chung, hai worker có thể xếp người vào cùng phòng
+        for room, games in part['pvp_rooms'].items():
+            pvp_rooms[room] = max(pvp_rooms.get(room, 0), games)
+    elapsed = max(part['elapsed'] for part in parts)
+    routes = {}
+    for route, values in sorted(latencies.items()):
+        values.sort()
+        stats = {'count': len(values), 'errors': errors.get(route, 0),
+                 'mean_ms': round(sum(values) / len(values), 3)}
+        for p in PERCENTILES:
+            stats['p%d_ms' % p] = round(_percentile(values, p), 3)
+        stats['max_ms'] = round(values[-1], 3)
+        routes[route] = stats
+    requests = sum(len(values) for values in latencies.values())
+
+    def total(key):
+        values = [part[key] for part in parts if part.get(key) is not None]
+        return round(sum(values), 6) if values else None
+
+    lock_wait = total('room_lock_wait_seconds')
+    lock_waits = total('room_lock_waits')
+    return {
+        'elapsed_seconds': round(elapsed, 3),
+        'requests': requests,
+        'errors': sum(errors.values()),
+        'error_counts': dict(sorted(errors.items())),
+        'throughput_rps': round(requests / elapsed, 1) if elapsed else None,
+        'ai_games': sum(part['ai_games'] for part in parts),
+        'pvp_games': sum(pvp_rooms.values()),
+        'stuck_pairs': sum(part['stuck_pairs'] for part in parts),
+        'routes': routes,
+        'contention': {
+            'room_lock_wait_ms': None if lock_wait is None else round(lock_wait * 1000, 3),
+            'room_lock_waits': lock_waits,
+            'mean_lock_wait_us': (round(lock_wait / lock_waits * 1e6, 2)
+                                  if lock_wait is not None and lock_waits else None),
+            'cas_conflicts': total('cas_conflicts')
+        }
+    }
+
+
+def load_scenarios(path):
+    # Tệp kịch bản: một object, hoặc {"defaults": {...}, "scenarios": [{...}, ...]}
+    with open(path, encoding='utf-8') as f:
+        config = json.load(f)
+    if 'scenarios' not in config:
+        return [dict(DEFAULTS, **config)]
+    base = dict(DEFAULTS, **config.get('defaults', {}))
+    return [dict(base, **scenario) for scenario in config['scenarios']]
+
+
+def print_summary(reports):
+    sys.stderr.write('%-18s %-28s %8s %8s %10s %10s %12s %10s\n' % (
+        'kịch bản', 'cấu hình', 'req/s', 'lỗi', 'p95 /move', 'p99 /move', 'chờ khóa ms',
+        '+history'))
+    for report in reports:
+        scenario = report['scenario']
+        setup = 'remote' if scenario['url'] else '%dx%d %s/%s' % (
+            scenario['workers'], scenario['threads'], scenario['state_store'],
+            scenario['session_store'])
+        if scenario['routing'] != 'sticky':
+            setup += ' ' + scenario['routing']
+        move = report['routes'].get('/move', {})
+        history = report.get('history')
+        growth = (history['after']['bytes'] - history['before']['bytes']) if history else None
+        sys.stderr.write('%-18s %-28s %8s %8d %10s %10s %12s %10s\n' % (
+            scenario['name'][:18], setup[:28], report['throughput_rps'], report['errors'],
+            move.get('p95_ms', '-'), move.get('p99_ms', '-'),
+            report['contention']['room_lock_wait_ms'],
+            '-' if growth is None else '%dB' % growth))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Tạo tải giả lập người chơi lên app.')
+    parser.add_argument('--config', help='tệp JSON chứa một hoặc nhiều kịch bản')
+    parser.add_argument('--url', help='bắn vào máy chủ đang chạy thay vì chạy app tại chỗ '
+                                      '(nhiều URL cách nhau bởi dấu phẩy)')
+    parser.add_argument('--history-db', help='đường dẫn history.db của máy chủ (khi dùng --url)')
+    parser.add_argument('--ai-players', type=int, help='số người chơi với máy')
+    parser.add_argument('--difficulties', help='các độ khó, cách nhau bởi dấu phẩy')
+    parser.add_argument('--board', help='kiểu bàn cờ (3x3, 5x5, 15x15)')
+    parser.add_argument('--pvp-pairs', type=int, help='số cặp chơi với người')
+    parser.add_argument('--spectators', type=int, help='số người xem mỗi cặp')
+    parser.add_argument('--games', type=int, help='số ván mỗi người chơi')
+    parser.add_argument('--duration', type=float, help='giây tối đa cho mỗi kịch bản')
+    parser.add_argument('--workers', type=int, help='số tiến trình worker')
+    parser.add_argument('--threads', type=int, help='số request đồng thời mỗi worker')
+    parser.add_argument('--state-store', choices=('memory', 'sqlite'))
+    parser.add_argument('--session-store', choices=('memory', 'sqlite'))
+    parser.add_argument('--routing', choices=('sticky', 'random'),
+                        help='gắn mỗi người dùng với một worker hay chia từng request ngẫu nhiên')
+    parser.add_argument('--ai-workers', type=int, help='số tiến trình tính nước đi mỗi worker')
+    parser.add_argument('--think-time', type=float, help='giây nghĩ trước mỗi nước')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--output', help='ghi kết quả JSON ra tệp thay vì stdout')
+    args = parser.parse_args(argv)
+
+    scenarios = load_scenarios(args.config) if args.config else [dict(DEFAULTS)]
+    overrides = {key: value for key, value in vars(args).items()
+                 if key in DEFAULTS and value is not None}
+    if args.difficulties:
+        overrides['difficulties'] = [d.strip() for d in args.difficulties.split(',') if d.strip()]
+    reports = []
+    for scenario in scenarios:
+        scenario.update(overrides)
+        sys.stderr.write('Đang chạy kịch bản %s...\n' % scenario['name'])
+        if scenario['url']:
+            report = run_remote(scenario, args.history_db)
+        else:
+            report = run_local(scenario)
+        report['scenario'] = scenario
+        reports.append(report)
+    print_summary(reports)
+    text = json.dumps(reports if len(reports) > 1 else reports[0], ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    return 1 if any(report['errors'] for report in reports) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
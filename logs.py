@@ -0,0 +1,40 @@
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+
+# Logger không chặn: request chỉ đẩy bản ghi vào hàng đợi, một luồng nền ghi
+# ra stdout. Mức log chọn bằng LOG_LEVEL (DEBUG in cả từng nước đi).
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = '%(asctime)s %(levelname)s %(message)s'
+
+
+def get_logger(name='tictactoe'):
+    logger = logging.getLogger(name)
+    if not logger.handlers:
+        records = queue.SimpleQueue()
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        listener = logging.handlers.QueueListener(records, handler)
+        listener.start()
+        atexit.register(listener.stop)
+        # Luồng ghi không sống sót qua fork (gunicorn --preload): tiến trình
+        # con tạo luồng ghi mới trên cùng hàng đợi
+        os.register_at_fork(after_in_child=lambda: _restart(listener))
+        logger.addHandler(logging.handlers.QueueHandler(records))
+        logger.setLevel(LOG_LEVEL)
+        logger.propagate = False
+    return logger
+
+
+def _restart(listener):
+    # Bản ghi còn trong hàng đợi lúc fork do tiến trình cha ghi, bỏ ở tiến trình con
+    while True:
+        try:
+            listener.queue.get_nowait()
+        except queue.Empty:
+            break
+    listener._thread = None
+    listener.start()
@@ -0,0 +1,227 @@
+import bisect
+import os
+import sys
+import threading
+import time
+from collections import Counter as _Counter
+
+# Đo đạc tùy chọn, bật bằng METRICS=1: histogram thời gian theo route, thời
+# gian tìm kiếm của máy, đọc/ghi lịch sử, chờ khóa phòng... xuất ra /metrics
+# theo định dạng văn bản của Prometheus. Khi tắt, observe()/inc() trả về ngay.
+# Số liệu tính riêng cho từng tiến trình (mỗi worker gunicorn một bộ).
+#
+# PROFILE_SLOW_MS=200 bật bộ lấy mẫu ngăn xếp: request chậm hơn ngưỡng được
+# ghi ra PROFILE_DIR dạng "folded stacks" (flamegraph.pl, speedscope đọc được).
+ENABLED = os.environ.get('METRICS', '') not in ('', '0')
+PROFILE_SLOW_MS = float(os.environ.get('PROFILE_SLOW_MS', 0))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+PROFILE_INTERVAL = 0.005  # Giây giữa hai lần lấy mẫu ngăn xếp
+TIME_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                0.5, 1, 2.5, 5, 10)
+
+_registry = []
+
+
+def _label_text(key):
+    if not key:
+        return ''
+    parts = ('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+             for name, value in key)
+    return '{' + ','.join(parts) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        if not ENABLED:
+            return
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.help), '# TYPE %s counter' % self.name]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append('%s%s %s' % (self.name, _label_text(key), _number(value)))
+        return lines
+
+
+class _Timer:
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+
+class Histogram:
+
+    def __init__(self, name, help_text, buckets=TIME_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self._values = {}  # khóa nhãn -> [đếm theo ô, tổng, số lần]
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, **labels):
+        if not ENABLED:
+            return
+        key = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.help), '# TYPE %s histogram' % self.name]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                    cumulative += bucket_count
+                    bucket_key = key + (('le', _number(bound)),)
+                    lines.append('%s_bucket%s %d' % (self.name, _label_text(bucket_key), cumulative))
+                lines.append('%s_sum%s %s' % (self.name, _label_text(key), repr(total)))
+                lines.append('%s_count%s %d' % (self.name, _label_text(key), count))
+        return lines
+
+
+class Gauge:
+    # Giá trị đọc lúc xuất số liệu: func trả về một số hoặc dict {nhãn: giá trị}
+    # với nhãn là tuple các cặp (tên, giá trị)
+
+    def __init__(self, name, help_text, func):
+        self.name = name
+        self.help = help_text
+        self.func = func
+        _registry.append(self)
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.help), '# TYPE %s gauge' % self.name]
+        values = self.func()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for key, value in sorted(values.items()):
+            lines.append('%s%s %s' % (self.name, _label_text(key), _number(value)))
+        return lines
+
+
+def render():
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+request_seconds = Histogram(
+    'tictactoe_request_duration_seconds', 'Thời gian xử lý request theo route.')
+ai_wait_seconds = Histogram(
+    'tictactoe_ai_queue_wait_seconds', 'Thời gian công việc của máy chờ trong hàng đợi.')
+ai_compute_seconds = Histogram(
+    'tictactoe_ai_compute_seconds', 'Thời gian máy tìm nước đi.')
+ai_search_nodes = Histogram(
+    'tictactoe_ai_search_nodes', 'Số nút được duyệt mỗi lần tìm kiếm.',
+    (10, 100, 1000, 10000, 100000, 1000000))
+ai_search_depth = Histogram(
+    'tictactoe_ai_search_depth', 'Độ sâu tìm xong mỗi lần tìm kiếm (bàn lớn).',
+    (1, 2, 3, 4, 5, 6, 7, 8))
+ai_table_lookups = Counter(
+    'tictactoe_ai_table_lookups_total',
+    'Tra bảng nước đi 3x3 và sách khai cuộc theo kết quả (hit/miss/book).')
+ai_cache_hits = Counter(
+    'tictactoe_ai_transposition_hits_total', 'Số lần trúng bảng chuyển vị khi tìm kiếm.')
+ai_timeouts = Counter(
+    'tictactoe_ai_timeouts_total', 'Công việc của máy quá hạn, dùng nước thay thế.')
+history_seconds = Histogram(
+    'tictactoe_history_io_seconds', 'Thời gian đọc/ghi lịch sử theo thao tác.')
+lock_wait_seconds = Histogram(
+    'tictactoe_room_lock_wait_seconds', 'Thời gian chờ khóa phòng trước khi cập nhật.',
+    (0.00001, 0.0001, 0.001, 0.01, 0.1, 1))
+cas_conflicts = Counter(
+    'tictactoe_room_cas_conflicts_total', 'Số lần compare-and-set phải thử lại.')
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return '%s:%s' % (os.path.basename(code.co_filename), code.co_name)
+
+
+class SlowRequestProfiler:
+    # Một luồng nền lấy mẫu ngăn xếp của các luồng đang xử lý request; chỉ
+    # request chậm hơn ngưỡng mới được ghi ra tệp.
+
+    def __init__(self, threshold_ms=PROFILE_SLOW_MS, directory=PROFILE_DIR,
+                 interval=PROFILE_INTERVAL):
+        self.threshold = threshold_ms / 1000
+        self.directory = directory
+        self.interval = interval
+        self._active = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        self._active[threading.get_ident()] = _Counter()
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._sample, daemon=True)
+                    self._thread.start()
+
+    def stop(self, name, elapsed):
+        samples = self._active.pop(threading.get_ident(), None)
+        if not samples or elapsed < self.threshold:
+            return None
+        os.makedirs(self.directory, exist_ok=True)
+        safe = ''.join(c if c.isalnum() else '_' for c in name).strip('_') or 'root'
+        path = os.path.join(self.directory, '%d-%s-%dms.folded' % (
+            time.time() * 1000, safe, elapsed * 1000))
+        with open(path, 'w') as f:
+            for stack, count in samples.most_common():
+                f.write('%s %d\n' % (stack, count))
+        return path
+
+    def _sample(self):
+        while True:
+            time.sleep(self.interval)
+            if not self._active:
+                continue
+            frames = sys._current_frames()
+            for ident, samples in list(self._active.items()):
+                frame = frames.get(ident)
+                names = []
+                while frame is not None:
+                    names.append(_frame_name(frame))
+                    frame = frame.f_back
+                if names:
+                    samples[';'.join(reversed(names))] += 1
+
+
+profiler = SlowRequestProfiler() if PROFILE_SLOW_MS > 0 else None
@@ -0,0 +1,407 @@
+import copy
+import secrets
+import threading
+import time
+from types import MappingProxyType
+
+import events
+import metrics
+import state_store
+
+# Quản lý nhiều phòng chơi với người cùng lúc. Trạng thái phòng nằm trong kho
+# trạng thái (xem state_store.py), mọi thay đổi đi qua compare-and-set nên
+# nhiều worker có thể cùng phục vụ một phòng. Trong mỗi tiến trình, mỗi phòng
+# còn có khóa và EventHub riêng: các phòng khác nhau không tranh chấp nhau và
+# không có khóa chung trên đường đi nước.
+#
+# Đọc tách khỏi ghi: mỗi lần ghi công bố một ảnh chụp bất biến kèm phiên bản
+# (Room.snapshot); người đọc lấy ảnh chụp mà không cần khóa phòng. Người xem
+# được ghi vào tập riêng trong kho trạng thái, không nằm trong trạng thái phòng.
+#
+# Ghép phòng, vào và rời phòng chạm nhiều bản ghi (phòng, phòng của người
+# dùng, người xem) nên chạy trọn trong một giao dịch của kho; ảnh chụp và sự
+# kiện được công bố sau khi giao dịch kết thúc.
+ROOM_IDLE_SECONDS = 30 * 60  # Phòng không hoạt động quá lâu sẽ bị xóa
+CLEANUP_INTERVAL = 60
+TOUCH_SECONDS = 60  # Chu kỳ ghi nhận phòng còn người xem/kết nối
+CAS_RETRIES = 20
+
+
+def new_game_state(size=3, win_length=3):
+    return {
+        'players': [],
+        'ready': {},
+        'continue': {},
+        'board': [' '] * (size * size),
+        'moves': [],
+        'size': size,
+        'win_length': win_length,
+        'turn': '',
+        'game_over': False,
+        'message': ''
+    }
+
+
+SPECTATOR_MESSAGE = 'Bạn đang xem trò chơi.'
+# Các trường của trạng thái phòng có trong ảnh chụp
+SNAPSHOT_FIELDS = ('board', 'turn', 'message', 'game_over', 'players', 'ready',
+                   'continue', 'size', 'win_length')
+
+
+def enter_room(game, username, players_only=False):
+    # Vào phòng làm người chơi nếu còn chỗ. Trả về thông báo cho người dùng;
+    # None nếu đã là người chơi, hoặc phòng đã đủ người khi players_only.
+    # Phòng đủ người thì trả về SPECTATOR_MESSAGE, người gọi ghi nhận người xem.
+    if username in game['players']:
+        return None
+    if len(game['players']) < 2:
+        game['players'].append(username)
+        game['ready'][username] = False
+        game['continue'][username] = False
+        return 'Bạn đã tham gia trò chơi. Hãy nhấn "Sẵn sàng" khi bạn đã sẵn sàng.'
+    if players_only:
+        return None
+    return SPECTATOR_MESSAGE
+
+
+def remove_user(game, username):
+    if username in game['players']:
+        game['players'].remove(username)
+        game['ready'].pop(username, None)
+        game['continue'].pop(username, None)
+        # Kết thúc trò chơi nếu có người rời đi
+        game['game_over'] = True
+        game['message'] = f"Người chơi {username} đã rời trò chơi."
+        game['turn'] = ''
+
+
+def freeze(game):
+    # Ảnh chụp chỉ đọc của trạng thái phòng: danh sách thành tuple, dict thành
+    # MappingProxyType, nên có thể chia sẻ giữa các luồng mà không cần sao chép
+    state = {}
+    for key in SNAPSHOT_FIELDS:
+        value = game[key]
+        if isinstance(value, list):
+            value = tuple(value)
+        elif isinstance(value, dict):
+            value = MappingProxyType(dict(value))
+        state[key] = value
+    return MappingProxyType(state)
+
+
+class Room:
+    # Phần cục bộ của một phòng trong tiến trình này
+
+    def __init__(self, room_id, store):
+        self.id = room_id
+        self.store = store
+        self.lock = threading.Lock()
+        self.events = events.EventHub()
+        # (phiên bản, ảnh chụp) mới nhất; thay cả cặp bằng một phép gán nên
+        # người đọc không cần khóa
+        self.snapshot = None
+        self.closed = False
+        self._snapshot_lock = threading.Lock()
+        self._next_poll = 0
+        self._next_touch = 0
+
+    def load(self):
+        # Trả về (phiên bản, trạng thái); trạng thái là bản sao riêng
+        return self.store.load(self.id)
+
+    def publish(self, game, version):
+        with self._snapshot_lock:
+            if self.snapshot is None or version > self.snapshot[0]:
+                self.snapshot = (version, freeze(game))
+        self.events.publish({
+            'board': game['board'],
+            'turn': game['turn'],
+            'message': game['message'],
+            'game_over': game['game_over'],
+            'players': game['players'],
+            'ready': game['ready'],
+            'continue': game['continue']
+        }, version)
+
+    def view(self):
+        # (phiên bản, ảnh chụp) hiện tại mà không lấy khóa phòng; chỉ đọc lại
+        # trạng thái khi kho có phiên bản khác (worker khác vừa ghi).
+        # (None, None) nếu phòng không còn.
+        version = self.store.version(self.id)
+        if version is None:
+            self.close()
+            return None, None
+        snapshot = self.snapshot
+        if snapshot is None or snapshot[0] != version:
+            version, game = self.load()
+            if game is None:
+                return None, None
+            self.publish(game, version)
+            snapshot = self.snapshot
+        return snapshot
+
+    def update(self, mutate):
+        # Đọc trạng thái, gọi mutate(game) rồi ghi lại bằng compare-and-set,
+        # đọc lại và thử lại nếu worker khác đã ghi trước. Trả về
+        # (game, kết quả của mutate); game là None nếu phòng không còn.
+        # Khóa cục bộ chỉ để các luồng trong cùng tiến trình không tự tranh CAS.
+        waited = time.perf_counter()
+        with self.lock:
+            metrics.lock_wait_seconds.observe(time.perf_counter() - waited)
+            for _ in range(CAS_RETRIES):
+                version, game = self.load()
+                if game is None:
+                    return None, None
+                before = copy.deepcopy(game)
+                result = mutate(game)
+                if game != before:
+                    new_version = self.store.compare_and_set(self.id, version, game)
+                    if new_version is None:
+                        metrics.cas_conflicts.inc()
+                        continue
+                    version = new_version
+                self.publish(game, version)
+                return game, result
+        raise state_store.StateConflict('Không ghi được trạng thái phòng %s' % self.id)
+
+    def poll(self):
+        # Lấy thay đổi do worker khác ghi, tối đa một lần mỗi POLL_SECONDS
+        # cho cả phòng dù có bao nhiêu người đang xem
+        now = time.monotonic()
+        if now < self._next_poll:
+            return
+        self._next_poll = now + events.POLL_SECONDS
+        version = self.store.version(self.id)
+        if version is None:
+            self.close()
+        elif version != self.events.version:
+            version, game = self.load()
+            if game is not None:
+                self.publish(game, version)
+
+    def touch(self):
+        # Báo cho cleanup biết phòng còn người dùng, tối đa một lần mỗi
+        # TOUCH_SECONDS trong mỗi tiến trình
+        now = time.monotonic()
+        if now >= self._next_touch and not self.closed:
+            self._next_touch = now + TOUCH_SECONDS
+            self.store.touch(self.id)
+
+    def close(self):
+        # Phòng đã bị xóa khỏi kho (có thể bởi worker khác)
+        self.closed = True
+        self.events.close()
+
+
+class RoomManager:
+
+    def __init__(self, store=None, idle_seconds=ROOM_IDLE_SECONDS):
+        self.store = store if store is not None else state_store.create_store()
+        self.idle_seconds = idle_seconds
+        self._rooms = {}
+        self._lock = threading.Lock()
+        self._next_cleanup = time.monotonic() + CLEANUP_INTERVAL
+
+    def __len__(self):
+        return self.store.count_rooms()
+
+    @property
+    def shared(self):
+        # Trạng thái có được tiến trình khác ghi vào không
+        return not isinstance(self.store, state_store.MemoryStateStore)
+
+    def get(self, room_id):
+        room = self._rooms.get(room_id)
+        if room is not None and not room.closed:
+            return room
+        if self.store.version(room_id) is None:
+            if room is not None:
+                self._discard(room_id)
+            return None
+        with self._lock:
+            room = self._rooms.get(room_id)
+            if room is None or room.closed:
+                room = self._rooms[room_id] = Room(room_id, self.store)
+            return room
+
+    def room_of(self, username):
+        # Tra phòng của người chơi, O(1) và không cần khóa chung
+        room_id = self.store.get_user_room(username)
+        if room_id is None:
+            return None
+        return self.get(room_id)
+
+    def _discard(self, room_id):
+        # Bỏ phần cục bộ của phòng đã bị xóa khỏi kho và đóng các luồng SSE
+        with self._lock:
+            room = self._rooms.pop(room_id, None)
+        if room is not None:
+            room.close()
+
+    def _apply(self, room_id, mutate):
+        # Như Room.update nhưng chạy trong giao dịch của kho nên không có xung
+        # đột CAS. Trả về (phiên bản, game, kết quả); game là None nếu phòng
+        # không còn.
+        version, game = self.store.load(room_id)
+        if game is None:
+            return None, None, None
+        before = copy.deepcopy(game)
+        result = mutate(game)
+        if game != before:
+            version = self.store.compare_and_set(room_id, version, game)
+            if version is None:
+                raise state_store.StateConflict('Không ghi được trạng thái phòng %s' % room_id)
+        return version, game, result
+
+    def _delete(self, room_id, game, changed):
+        # Gọi trong giao dịch: xóa phòng cùng phòng của những người còn trong đó
+        for username in list(game['players']) + self.store.spectators(room_id):
+            self.store.clear_user_room(username, room_id)
+        self.store.delete_room(room_id)
+        changed.append((room_id, None, None))
+
+    def _publish(self, changed):
+        # Gọi sau giao dịch: công bố trạng thái mới hoặc bỏ phòng đã xóa
+        for room_id, version, game in changed:
+            if game is None:
+                self._discard(room_id)
+            else:
+                room = self.get(room_id)
+                if room is not None:
+                    room.publish(game, version)
+
+    def _leave(self, username, room_id, changed):
+        # Gọi trong giao dịch: rời phòng, xóa phòng khi không còn ai
+        self.store.clear_user_room(username, room_id)
+        self.store.remove_spectator(room_id, username)
+        version, game, _ = self._apply(room_id, lambda game: remove_user(game, username))
+        if game is None:
+            changed.append((room_id, None, None))
+        elif not game['players'] and not self.store.count_spectators(room_id):
+            self._delete(room_id, game, changed)
+        else:
+            changed.append((room_id, version, game))
+
+    def join(self, username, room_id):
+        # Vào một phòng cụ thể (theo URL); rời phòng cũ nếu đang ở phòng khác.
+        # Trả về (phòng, thông báo khi mới vào).
+        self._maybe_cleanup()
+        room = self.get(room_id)
+        if room is None:
+            return None, None
+        if self.store.get_user_room(username) == room_id:
+            room.touch()
+            return room, None
+        changed = []
+        message = None
+        with self.store.transaction():
+            _, game = self.store.load(room_id)
+            if game is not None:
+                current = self.store.get_user_room(username)
+                if current is not None and current != room_id:
+                    self._leave(username, current, changed)
+                if len(game['players']) < 2 or username in game['players']:
+                    version, game, message = self._apply(
+                        room_id, lambda game: enter_room(game, username))
+                    changed.append((room_id, version, game))
+                else:
+                    # Phòng đã đủ người: chỉ cần thêm vào tập người xem, không ghi phòng
+                    message = SPECTATOR_MESSAGE
+                    self.store.add_spectator(room_id, username)
+                self.store.set_user_room(username, room_id)
+        self._publish(changed)
+        if game is None:
+            return None, None
+        return self.get(room_id), message
+
+    def matchmake(self, username, size=3, win_length=3):
+        # Ghép vào phòng đang chờ cùng kiểu bàn cờ, nếu không có thì tạo phòng
+        # mới; tìm và nhận phòng trong cùng một giao dịch nên hai người ghép
+        # cùng lúc không thể mỗi người tạo một phòng. Người đang ngồi một mình
+        # trong phòng chờ được chuyển sang phòng chờ lâu hơn nếu có.
+        self._maybe_cleanup()
+        changed = []
+        message = None
+        with self.store.transaction():
+            room_id = self.store.get_user_room(username)
+            current = None
+            if room_id is not None:
+                _, game = self.store.load(room_id)
+                if game is None:
+                    self.store.clear_user_room(username, room_id)
+                    room_id = None
+                elif list(game['players']) == [username]:
+                    current = game
+                    size, win_length = game['size'], game['win_length']
+            if room_id is None or current is not None:
+                waiting = self.store.find_waiting_room(size, win_length, older_than=room_id)
+                if waiting is not None:
+                    version, game, message = self._apply(
+                        waiting, lambda game: enter_room(game, username, players_only=True))
+                    self.store.set_user_room(username, waiting)
+                    changed.append((waiting, version, game))
+                    if current is not None:
+                        self._delete(room_id, current, changed)
+                    room_id = waiting
+                elif current is None:
+                    game = new_game_state(size, win_length)
+                    message = enter_room(game, username)
+                    while True:
+                        room_id = secrets.token_hex(4)
+                        version = self.store.create_room(room_id, game)
+                        if version is not None:
+                            break
+                    self.store.set_user_room(username, room_id)
+                    changed.append((room_id, version, game))
+        self._publish(changed)
+        return self.get(room_id), message
+
+    def rematch(self, username, room):
+        # Người chơi đang chờ một mình: chuyển sang phòng chờ lâu hơn nếu có.
+        # Kiểm tra không cần giao dịch trước; trả về phòng mới hoặc None.
+        _, game = room.view()
+        if game is None or list(game['players']) != [username]:
+            return None
+        if self.store.find_waiting_room(game['size'], game['win_length'],
+                                        older_than=room.id) is None:
+            return None
+        moved, _ = self.matchmake(username)
+        return moved if moved is not None and moved.id != room.id else None
+
+    def leave(self, username):
+        if self.store.get_user_room(username) is None:
+            return
+        changed = []
+        with self.store.transaction():
+            room_id = self.store.get_user_room(username)
+            if room_id is not None:
+                self._leave(username, room_id, changed)
+        self._publish(changed)
+
+    def _maybe_cleanup(self):
+        now = time.monotonic()
+        if now >= self._next_cleanup:
+            self._next_cleanup = now + CLEANUP_INTERVAL
+            self.cleanup()
+
+    def cleanup(self):
+        # Xóa các phòng không có ai đi nước, xem trang hay giữ kết nối SSE
+        # trong idle_seconds, rồi bỏ các phòng mà worker khác đã xóa
+        changed = []
+        for room_id in self.store.idle_rooms(self.idle_seconds):
+            room = self._rooms.get(room_id)
+            if room is not None and room.events.subscribers:
+                room.touch()
+                continue
+            with self.store.transaction():
+                _, game = self.store.load(room_id)
+                if game is not None:
+                    self._delete(room_id, game, changed)
+        self._publish(changed)
+        for room_id in list(self._rooms):
+            if self.store.version(room_id) is None:
+                self._discard(room_id)
+
+    def subscribers(self):
+        # Tổng số kết nối SSE đang mở trong tiến trình này
+        return sum(room.events.subscribers for room in list(self._rooms.values()))
@@ -0,0 +1,210 @@
+import argparse
+import itertools
+import json
+import math
+import multiprocessing
+import random
+import sys
+import time
+
+import engine
+import evaluate
+import gomoku
+
+# Cho các mức độ khó của máy (và một người chơi ngẫu nhiên) đấu với nhau,
+# không cần giao diện web. Mỗi cặp đấu được chia thành nhiều phần chạy song
+# song; mỗi phần có hạt giống ngẫu nhiên riêng suy ra từ --seed nên chạy lại
+# cho cùng kết quả (với bàn lớn, độ sâu tìm kiếm còn phụ thuộc thời gian).
+#
+#   python selfplay.py --games 100000 --output selfplay.json
+PLAYERS = evaluate.DIFFICULTIES + ('random',)
+BOARDS = {'3x3': (3, 3), '5x5': (5, 4), '15x15': (15, 5)}
+CHUNK_GAMES = 1000
+# Độ trễ mỗi nước lưu theo thang log: mỗi ô rộng khoảng 3.5%
+BUCKETS_PER_E = 30
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+def _bucket(seconds):
+    micros = max(seconds * 1e6, 1e-3)
+    return int(math.floor(math.log(micros) * BUCKETS_PER_E))
+
+
+def _bucket_value(bucket):
+    # Giá trị đại diện (micro giây) của một ô
+    return math.exp((bucket + 0.5) / BUCKETS_PER_E)
+
+
+def _won(board, player, size, win_length):
+    if size == 3:
+        return engine.has_won(engine.player_bits(board, player))
+    return gomoku.check_winner(board, player, win_length)
+
+
+def play_game(x_player, o_player, size, win_length, time_budget, latencies):
+    # Trả về 'X', 'O' hoặc None (hòa); ghi độ trễ mỗi nước vào latencies
+    board = [' '] * (size * size)
+    players = {'X': x_player, 'O': o_player}
+    symbol = 'X'
+    for _ in range(size * size):
+        kind = players[symbol]
+        start = time.perf_counter()
+        if kind == 'random':
+            move = random.choice([i for i in range(len(board)) if board[i] == ' '])
+        else:
+            move = evaluate.choose_move(board, symbol, kind, win_length, time_budget)[0]
+        histogram = latencies[kind]
+        bucket = _bucket(time.perf_counter() - start)
+        histogram[bucket] = histogram.get(bucket, 0) + 1
+        board[move] = symbol
+        if _won(board, symbol, size, win_length):
+            return symbol
+        symbol = 'O' if symbol == 'X' else 'X'
+    return None
+
+
+def run_chunk(task):
+    # Chạy một phần của cặp đấu (a, b); a cầm X ở các ván chẵn
+    a, b, first_game, games, seed, size, win_length, time_budget = task
+    random.seed(seed)
+    latencies = {a: {}, b: {}}
+    win = draw = loss = moves = 0
+    for game in range(first_game, first_game + games):
+        a_symbol = 'X' if game % 2 == 0 else 'O'
+        x_player, o_player = (a, b) if a_symbol == 'X' else (b, a)
+        winner = play_game(x_player, o_player, size, win_length, time_budget, latencies)
+        if winner is None:
+            draw += 1
+        elif winner == a_symbol:
+            win += 1
+        else:
+            loss += 1
+    moves = sum(sum(h.values()) for h in latencies.values())
+    return a, b, win, draw, loss, moves, latencies
+
+
+def _tasks(pairings, games, seed, size, win_length, time_budget):
+    for index, (a, b) in enumerate(pairings):
+        for first in range(0, games, CHUNK_GAMES):
+            # Hạt giống cố định theo (seed, cặp đấu, phần), không theo tiến trình
+            chunk_seed = (seed * 1000003 + index) * 1000003 + first
+            yield (a, b, first, min(CHUNK_GAMES, games - first), chunk_seed,
+                   size, win_length, time_budget)
+
+
+def _percentiles(histogram):
+    total = sum(histogram.values())
+    if not total:
+        return {'count': 0}
+    result = {'count': total}
+    buckets = sorted(histogram.items())
+    for p in PERCENTILES:
+        target = total * p / 100
+        seen = 0
+        for bucket, count in buckets:
+            seen += count
+            if seen >= target:
+                result['p%s_us' % ('%g' % p).replace('.', '_')] = round(_bucket_value(bucket), 2)
+                break
+    result['max_us'] = round(_bucket_value(buckets[-1][0]), 2)
+    return result
+
+
+def run(players, games, board='3x3', processes=None, seed=0, time_budget=0.05,
+        progress=None):
+    size, win_length = BOARDS[board]
+    pairings = list(itertools.combinations_with_replacement(players, 2))
+    matrix = {a: {b: {'win': 0, 'draw': 0, 'loss': 0} for b in players} for a in players}
+    latencies = {player: {} for player in players}
+    total_games = total_moves = 0
+    # Dựng/nạp bảng nước đi trước khi fork để các tiến trình con dùng chung
+    engine.get_table()
+    started = time.perf_counter()
+    tasks = list(_tasks(pairings, games, seed, size, win_length, time_budget))
+    with multiprocessing.Pool(processes) as pool:
+        for done, (a, b, win, draw, loss, moves, chunk_latencies) in enumerate(
+                pool.imap_unordered(run_chunk, tasks), 1):
+            cell = matrix[a][b]
+            cell['win'] += win
+            cell['draw'] += draw
+            cell['loss'] += loss
+            if a != b:
+                mirror = matrix[b][a]
+                mirror['win'] += loss
+                mirror['draw'] += draw
+                mirror['loss'] += win
+            total_games += win + draw + loss
+            total_moves += moves
+            for player, histogram in chunk_latencies.items():
+                merged = latencies[player]
+                for bucket, count in histogram.items():
+                    merged[bucket] = merged.get(bucket, 0) + count
+            if progress is not None:
+                progress(done, len(tasks), total_games)
+    elapsed = time.perf_counter() - started
+    super_hard_losses = sum(matrix['super_hard'][b]['loss'] for b in players
+                            if b != 'super_hard') if 'super_hard' in players else 0
+    return {
+        'config': {
+            'players': list(players),
+            'games_per_pairing': games,
+            'board': board,
+            'win_length': win_length,
+            'processes': processes or multiprocessing.cpu_count(),
+            'seed': seed,
+            'time_budget': time_budget
+        },
+        'matrix': matrix,
+        'games': total_games,
+        'moves': total_moves,
+        'elapsed_seconds': round(elapsed, 3),
+        'games_per_second': round(total_games / elapsed, 1) if elapsed else None,
+        'latency': {player: _percentiles(latencies[player]) for player in players},
+        'super_hard_losses': super_hard_losses
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Cho các mức độ khó đấu với nhau.')
+    parser.add_argument('--games', type=int, default=10000,
+                        help='số ván cho mỗi cặp đấu (mặc định 10000)')
+    parser.add_argument('--players', default=','.join(PLAYERS),
+                        help='danh sách người chơi, cách nhau bởi dấu phẩy')
+    parser.add_argument('--board', choices=sorted(BOARDS), default='3x3')
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--time-budget', type=float, default=0.05,
+                        help='giây cho mỗi nước đi trên bàn lớn')
+    parser.add_argument('--output', help='ghi kết quả JSON ra tệp thay vì stdout')
+    args = parser.parse_args(argv)
+
+    players = tuple(p.strip() for p in args.players.split(',') if p.strip())
+    unknown = [p for p in players if p not in PLAYERS]
+    if unknown:
+        parser.error('người chơi không hợp lệ: %s' % ', '.join(unknown))
+
+    def progress(done, total, games):
+        if done != total and done % max(1, total // 100):
+            return
+        sys.stderr.write('\r%d/%d phần, %d ván' % (done, total, games))
+        sys.stderr.flush()
+
+    report = run(players, args.games, args.board, args.processes, args.seed,
+                 args.time_budget, progress)
+    sys.stderr.write('\n')
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    sys.stderr.write('%d ván, %.1f ván/giây, super_hard thua %d ván\n' % (
+        report['games'], report['games_per_second'] or 0, report['super_hard_losses']))
+    # Bàn 3x3 được giải trọn vẹn: super_hard thua là lỗi của engine
+    if args.board == '3x3' and report['super_hard_losses']:
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
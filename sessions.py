@@ -0,0 +1,279 @@
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+import game_records
+
+# Session lưu phía máy chủ: cookie chỉ chứa một mã ngẫu nhiên, dữ liệu nằm
+# trong kho session ở dạng nén gọn: bàn cờ của ván với máy là một số nguyên
+# cơ số 3 kèm các bit lượt đi/ký hiệu/kết thúc, thông báo là một mã số thay vì
+# chuỗi tiếng Việt, thứ tự nước đi nén như trong game_records.py. Session
+# hết hạn theo app.permanent_session_lifetime.
+#
+# SESSION_STORE=sqlite (mặc định): dùng chung tệp giữa các worker gunicorn
+# (số worker theo WEB_CONCURRENCY) và còn nguyên sau khi khởi động lại;
+# SESSION_STORE=memory: LRU trong tiến trình, giới hạn SESSION_MAX session,
+# chỉ dùng khi chạy một worker.
+SESSION_STORE = os.environ.get('SESSION_STORE', 'sqlite')
+SESSION_DB = os.environ.get('SESSION_DB', 'sessions.db')
+SESSION_MAX = int(os.environ.get('SESSION_MAX', 100000))
+CLEANUP_INTERVAL = 60
+BUSY_TIMEOUT_MS = 5000
+
+# Các thông báo hay gặp được lưu bằng chỉ số; thông báo khác lưu nguyên văn
+MESSAGES = ('', 'Bạn đi trước.', 'Máy đi trước.', 'Bạn đã thắng!', 'Bạn đã thua!', 'Hòa!')
+MESSAGE_CODES = {message: code for code, message in enumerate(MESSAGES)}
+TURN_X, PLAYER_X, GAME_OVER = 1, 2, 4
+FLAG_BITS = 3
+
+
+def _packable(data):
+    board = data.get('board')
+    return (isinstance(board, list) and all(cell in game_records.CELL_CODES for cell in board)
+            and data.get('player_symbol') in ('X', 'O') and data.get('turn') in ('X', 'O')
+            and data.get('ai_symbol') == ('O' if data['player_symbol'] == 'X' else 'X')
+            and isinstance(data.get('game_over', False), bool)
+            and _packable_moves(data.get('moves', []), len(board)))
+
+
+def _packable_moves(moves, cells):
+    return isinstance(moves, list) and all(
+        isinstance(move, int) and 0 <= move < cells for move in moves)
+
+
+def encode(data):
+    # dict session -> bytes (JSON gọn); ván với máy được gói vào khóa 'g'
+    data = dict(data)
+    packed = {}
+    if _packable(data):
+        board = data.pop('board')
+        code = game_records.pack_board(board)
+        flags = ((data.pop('turn') == 'X') * TURN_X
+                 | (data.pop('player_symbol') == 'X') * PLAYER_X
+                 | data.pop('game_over', False) * GAME_OVER)
+        data.pop('ai_symbol')
+        packed['g'] = [len(board), code << FLAG_BITS | flags]
+        if 'moves' in data:
+            packed['g'].append(game_records.pack_moves(data.pop('moves'), len(board)).hex())
+    message = data.get('message')
+    if message in MESSAGE_CODES:
+        packed['m'] = MESSAGE_CODES[data.pop('message')]
+    if data:
+        packed['d'] = data
+    return json.dumps(packed, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def decode(raw):
+    packed = json.loads(raw)
+    data = packed.get('d', {})
+    if 'g' in packed:
+        cells, code = packed['g'][:2]
+        flags = code & (1 << FLAG_BITS) - 1
+        board = game_records.unpack_board(code >> FLAG_BITS, cells)
+        player = 'X' if flags & PLAYER_X else 'O'
+        data['board'] = board
+        data['player_symbol'] = player
+        data['ai_symbol'] = 'O' if player == 'X' else 'X'
+        data['turn'] = 'X' if flags & TURN_X else 'O'
+        data['game_over'] = bool(flags & GAME_OVER)
+        if len(packed['g']) > 2:
+            data['moves'] = game_records.unpack_moves(bytes.fromhex(packed['g'][2]), cells)
+    if 'm' in packed:
+        data['message'] = MESSAGES[packed['m']]
+    return data
+
+
+class MemorySessionStore:
+    # LRU theo lần dùng cuối: phần tử đầu là session lâu nhất không dùng, nên
+    # xóa session hết hạn và giới hạn số lượng đều chỉ cần cắt từ đầu.
+
+    def __init__(self, max_sessions=SESSION_MAX):
+        self.max_sessions = max_sessions
+        self._entries = OrderedDict()  # sid -> [dữ liệu, hạn]
+        self._lock = threading.Lock()
+
+    def load(self, sid):
+        with self._lock:
+            entry = self._entries.get(sid)
+            if entry is None:
+                return None, None
+            if entry[1] <= time.time():
+                del self._entries[sid]
+                return None, None
+            return entry[0], entry[1]
+
+    def _evict(self, now):
+        # Gọi khi đang giữ self._lock
+        entries = self._entries
+        while entries:
+            sid, entry = next(iter(entries.items()))
+            if entry[1] > now and len(entries) <= self.max_sessions:
+                break
+            del entries[sid]
+
+    def save(self, sid, data, ttl):
+        now = time.time()
+        with self._lock:
+            self._entries[sid] = [data, now + ttl]
+            self._entries.move_to_end(sid)
+            self._evict(now)
+
+    def touch(self, sid, ttl, expires=None):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(sid)
+            if entry is not None:
+                entry[1] = now + ttl
+                self._entries.move_to_end(sid)
+            self._evict(now)
+
+    def delete(self, sid):
+        with self._lock:
+            self._entries.pop(sid, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    data BLOB NOT NULL,
+    expires REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_expires ON sessions (expires);
+"""
+
+
+class SQLiteSessionStore:
+
+    def __init__(self, path=SESSION_DB):
+        self.path = path
+        self._local = threading.local()
+        self._next_cleanup = 0
+
+    def _conn(self):
+        key = os.getpid()
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != key:
+            conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_MS / 1000,
+                                   isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA busy_timeout=%d' % BUSY_TIMEOUT_MS)
+            conn.executescript(SCHEMA)
+            self._local.conn = conn
+            self._local.pid = key
+        return conn
+
+    def load(self, sid):
+        row = self._conn().execute(
+            'SELECT data, expires FROM sessions WHERE id = ? AND expires > ?',
+            (sid, time.time())).fetchone()
+        if row is None:
+            return None, None
+        return row[0], row[1]
+
+    def _cleanup(self, now):
+        if now >= self._next_cleanup:
+            self._next_cleanup = now + CLEANUP_INTERVAL
+            self._conn().execute('DELETE FROM sessions WHERE expires <= ?', (now,))
+
+    def save(self, sid, data, ttl):
+        now = time.time()
+        self._conn().execute(
+            'INSERT INTO sessions (id, data, expires) VALUES (?, ?, ?) '
+            'ON CONFLICT (id) DO UPDATE SET data = excluded.data, expires = excluded.expires',
+            (sid, data, now + ttl))
+        self._cleanup(now)
+
+    def touch(self, sid, ttl, expires=None):
+        # Chỉ gia hạn khi đã dùng quá nửa thời gian sống, tránh ghi mỗi request
+        if expires is not None and expires - time.time() > ttl / 2:
+            return
+        self._conn().execute('UPDATE sessions SET expires = ? WHERE id = ?',
+                             (time.time() + ttl, sid))
+
+    def delete(self, sid):
+        self._conn().execute('DELETE FROM sessions WHERE id = ?', (sid,))
+
+    def __len__(self):
+        return self._conn().execute('SELECT COUNT(*) FROM sessions').fetchone()[0]
+
+
+def create_store(kind=SESSION_STORE):
+    if kind == 'sqlite':
+        return SQLiteSessionStore(SESSION_DB)
+    if kind == 'memory':
+        return MemorySessionStore()
+    raise ValueError('Kiểu lưu session không hỗ trợ: %s' % kind)
+
+
+class ServerSession(CallbackDict, SessionMixin):
+
+    def __init__(self, initial=None, sid=None, expires=None):
+        def on_update(self):
+            self.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.expires = expires
+        self.modified = False
+        self.retired_sid = None
+
+    def rotate(self):
+        # Đổi mã session (khi đăng nhập), giữ nguyên dữ liệu; mã cũ bị xóa
+        # khỏi kho khi lưu
+        if self.sid is not None:
+            self.retired_sid = self.sid
+            self.sid = None
+        self.modified = True
+
+
+class ServerSessionInterface(SessionInterface):
+
+    def __init__(self, store=None):
+        self.store = store if store is not None else create_store()
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            raw, expires = self.store.load(sid)
+            if raw is not None:
+                try:
+                    return ServerSession(decode(raw), sid, expires)
+                except (ValueError, KeyError, IndexError, TypeError):
+                    pass
+        return ServerSession()
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if session.retired_sid is not None:
+            self.store.delete(session.retired_sid)
+            session.retired_sid = None
+        if not session:
+            if session.sid is not None:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+        ttl = app.permanent_session_lifetime.total_seconds()
+        new = session.sid is None
+        if new:
+            session.sid = secrets.token_urlsafe(16)
+        if new or session.modified:
+            self.store.save(session.sid, encode(session), ttl)
+        else:
+            self.store.touch(session.sid, ttl, session.expires)
+        if new or self.should_set_cookie(app, session):
+            response.set_cookie(
+                name, session.sid, expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app), domain=domain, path=path,
+                secure=self.get_cookie_secure(app), samesite=self.get_cookie_samesite(app))
@@ -0,0 +1,120 @@
+import os
+import threading
+import time
+
+import book
+import engine
+import gomoku
+import logs
+import storage
+
+# Giai đoạn khởi động tách khỏi request đầu tiên. Với gunicorn --preload
+# (xem gunicorn.conf.py) phần chung chạy một lần trong tiến trình chính trước
+# khi fork: bảng nước đi và sách khai cuộc được ánh xạ vào bộ nhớ, bảng hình
+# học các bàn lớn được dựng, history.db được kiểm tra và nâng cấp, template
+# được biên dịch. Các worker thừa hưởng tất cả theo copy-on-write. Phần riêng
+# của worker (khởi động nhóm tiến trình tính nước đi) chạy sau khi fork.
+# /readyz báo trạng thái và thời gian từng bước.
+log = logs.get_logger()
+
+
+class Startup:
+
+    def __init__(self):
+        self.created = time.time()
+        self.steps = {}  # tên bước -> mili giây
+        self.errors = {}  # tên bước -> lỗi
+        self.app_ready = False
+        self.app_pid = None
+        self._worker_pid = None
+        self._worker_started = None
+        self._ai_warmups = []
+        self._lock = threading.Lock()
+
+    def _step(self, name, func, *args):
+        started = time.perf_counter()
+        try:
+            func(*args)
+        except Exception as exc:
+            self.errors[name] = str(exc)
+            log.error('Khởi động: bước %s lỗi: %s', name, exc)
+        self.steps[name] = round((time.perf_counter() - started) * 1000, 2)
+
+    def warm_app(self, app, board_options):
+        # Phần dùng chung, chạy một lần trong tiến trình nạp ứng dụng
+        with self._lock:
+            if self.app_ready:
+                return
+            started = time.perf_counter()
+            self._step('history_db', storage.prepare)
+            self._step('engine_table', warm_table)
+            self._step('opening_book', book.get_book)
+            self._step('geometries', warm_geometries, board_options)
+            self._step('templates', compile_templates, app)
+            self.steps['app_total'] = round((time.perf_counter() - started) * 1000, 2)
+            self.app_pid = os.getpid()
+            self.app_ready = True
+            log.info('Khởi động xong trong %.0f ms', self.steps['app_total'])
+
+    def warm_worker(self, ai_pool):
+        # Phần riêng của từng worker, chạy lại sau mỗi lần fork
+        with self._lock:
+            if self._worker_pid == os.getpid():
+                return
+            self._worker_pid = os.getpid()
+            self._worker_started = time.perf_counter()
+            self.steps.pop('ai_workers', None)
+            self.errors.pop('ai_workers', None)
+            try:
+                self._ai_warmups = ai_pool.warm_up()
+            except Exception as exc:
+                self._ai_warmups = []
+                self.errors['ai_workers'] = str(exc)
+
+    def _worker_ready(self):
+        if self._worker_pid != os.getpid():
+            return False
+        if 'ai_workers' not in self.steps and all(f.done() for f in self._ai_warmups):
+            for future in self._ai_warmups:
+                if future.exception() is not None:
+                    self.errors['ai_workers'] = str(future.exception())
+            self.steps['ai_workers'] = round(
+                (time.perf_counter() - self._worker_started) * 1000, 2)
+        return 'ai_workers' in self.steps or 'ai_workers' in self.errors
+
+    def status(self):
+        worker_ready = self._worker_ready()
+        return {
+            'ready': self.app_ready and worker_ready and not self.errors,
+            'app_ready': self.app_ready,
+            'worker_ready': worker_ready,
+            'preloaded': self.app_pid is not None and self.app_pid != os.getpid(),
+            'pid': os.getpid(),
+            'uptime_ms': round((time.time() - self.created) * 1000, 2),
+            'steps': dict(self.steps),
+            'errors': dict(self.errors)
+        }
+
+
+def warm_table():
+    # Nạp (ánh xạ) bảng nước đi hoàn hảo; chưa có tệp thì dựng rồi ghi lại
+    # để các worker và tiến trình tính nước đi dùng chung qua mmap
+    if os.path.exists(engine.TABLE_FILE):
+        engine.get_table()
+        return
+    table = engine.get_table()
+    try:
+        engine.save_table(table)
+    except OSError as exc:
+        log.warning('Không ghi được %s: %s', engine.TABLE_FILE, exc)
+
+
+def warm_geometries(board_options):
+    for size, win_length, _ in board_options.values():
+        if size > 3:
+            gomoku.get_geometry(size, win_length)
+
+
+def compile_templates(app):
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
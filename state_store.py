@@ -0,0 +1,329 @@
+import copy
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Nơi lưu trạng thái phòng chơi. MemoryStateStore chỉ dùng trong một tiến
+# trình; SQLiteStateStore dùng chung một tệp nên nhiều worker gunicorn thấy
+# cùng một ván mà không cần sticky session. Mọi thay đổi đi qua
+# compare_and_set: chỉ ghi khi phiên bản chưa bị tiến trình khác đổi.
+# Người xem không thuộc trạng thái phòng mà nằm trong một tập riêng: vào/ra
+# xem không đổi phiên bản phòng và không tranh CAS với người chơi.
+# Các thao tác nhiều bước (ghép phòng, vào/rời phòng) chạy trong
+# transaction(): khóa của kho với bộ nhớ, BEGIN IMMEDIATE với SQLite.
+#
+# GAME_STATE_STORE=sqlite (mặc định), như session: gunicorn chạy số worker
+# theo WEB_CONCURRENCY nên mọi worker phải thấy cùng một phòng;
+# GAME_STATE_STORE=memory chỉ dùng khi chạy một worker.
+GAME_STATE_STORE = os.environ.get('GAME_STATE_STORE', 'sqlite')
+GAME_STATE_DB = os.environ.get('GAME_STATE_DB', 'game_state.db')
+BUSY_TIMEOUT_MS = 5000
+
+
+class StateConflict(Exception):
+    pass
+
+
+def _waiting(state):
+    # Phòng đang chờ ghép cặp: có đúng một người chơi
+    return len(state['players']) == 1
+
+
+class MemoryStateStore:
+
+    def __init__(self):
+        self._rooms = {}
+        self._user_room = {}
+        # Hàng đợi ghép cặp theo kiểu bàn cờ, giữ thứ tự phòng chờ lâu nhất
+        self._waiting = {}
+        self._spectators = {}
+        self._lock = threading.RLock()
+
+    def transaction(self):
+        return self._lock
+
+    def _index(self, room_id, state):
+        key = (state['size'], state['win_length'])
+        queue = self._waiting.setdefault(key, OrderedDict())
+        if _waiting(state):
+            queue.setdefault(room_id, None)
+        else:
+            queue.pop(room_id, None)
+
+    def create_room(self, room_id, state):
+        with self._lock:
+            if room_id in self._rooms:
+                return None
+            self._rooms[room_id] = [1, copy.deepcopy(state), time.time()]
+            self._index(room_id, state)
+            return 1
+
+    def load(self, room_id):
+        with self._lock:
+            entry = self._rooms.get(room_id)
+            if entry is None:
+                return None, None
+            return entry[0], copy.deepcopy(entry[1])
+
+    def version(self, room_id):
+        entry = self._rooms.get(room_id)
+        return entry[0] if entry is not None else None
+
+    def compare_and_set(self, room_id, version, state):
+        with self._lock:
+            entry = self._rooms.get(room_id)
+            if entry is None or entry[0] != version:
+                return None
+            entry[0] += 1
+            entry[1] = copy.deepcopy(state)
+            entry[2] = time.time()
+            self._index(room_id, state)
+            return entry[0]
+
+    def delete_room(self, room_id):
+        with self._lock:
+            entry = self._rooms.pop(room_id, None)
+            self._spectators.pop(room_id, None)
+            if entry is not None:
+                state = entry[1]
+                self._waiting.get((state['size'], state['win_length']), {}).pop(room_id, None)
+
+    def find_waiting_room(self, size, win_length, older_than=None):
+        # Phòng chờ lâu nhất; older_than: chỉ lấy phòng chờ lâu hơn phòng này
+        with self._lock:
+            queue = self._waiting.get((size, win_length))
+            if not queue:
+                return None
+            room_id = next(iter(queue))
+            return None if room_id == older_than else room_id
+
+    def touch(self, room_id):
+        # Ghi nhận phòng còn người dùng mà không đổi phiên bản
+        with self._lock:
+            entry = self._rooms.get(room_id)
+            if entry is not None:
+                entry[2] = time.time()
+
+    def get_user_room(self, username):
+        return self._user_room.get(username)
+
+    def set_user_room(self, username, room_id):
+        with self._lock:
+            self._user_room[username] = room_id
+
+    def clear_user_room(self, username, room_id=None):
+        with self._lock:
+            if room_id is None or self._user_room.get(username) == room_id:
+                self._user_room.pop(username, None)
+
+    def add_spectator(self, room_id, username):
+        with self._lock:
+            if room_id in self._rooms:
+                self._spectators.setdefault(room_id, set()).add(username)
+
+    def remove_spectator(self, room_id, username):
+        with self._lock:
+            spectators = self._spectators.get(room_id)
+            if spectators is not None:
+                spectators.discard(username)
+                if not spectators:
+                    del self._spectators[room_id]
+
+    def spectators(self, room_id):
+        with self._lock:
+            return list(self._spectators.get(room_id, ()))
+
+    def count_spectators(self, room_id):
+        return len(self._spectators.get(room_id, ()))
+
+    def count_rooms(self):
+        return len(self._rooms)
+
+    def idle_rooms(self, idle_seconds):
+        cutoff = time.time() - idle_seconds
+        with self._lock:
+            return [room_id for room_id, entry in self._rooms.items() if entry[2] < cutoff]
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rooms (
+    id TEXT PRIMARY KEY,
+    version INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    win_length INTEGER NOT NULL,
+    waiting INTEGER NOT NULL,
+    state TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS rooms_waiting
+    ON rooms (waiting, size, win_length, created_at);
+CREATE INDEX IF NOT EXISTS rooms_updated ON rooms (updated_at);
+CREATE TABLE IF NOT EXISTS user_rooms (
+    username TEXT PRIMARY KEY,
+    room_id TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS spectators (
+    room_id TEXT NOT NULL,
+    username TEXT NOT NULL,
+    PRIMARY KEY (room_id, username)
+) WITHOUT ROWID;
+"""
+
+
+class _Transaction:
+    # BEGIN IMMEDIATE trên kết nối của luồng hiện tại; lồng nhau thì chỉ khối
+    # ngoài cùng mở và kết thúc giao dịch
+
+    def __init__(self, store):
+        self.store = store
+
+    def __enter__(self):
+        conn = self.store._conn()
+        local = self.store._local
+        if local.depth == 0:
+            conn.execute('BEGIN IMMEDIATE')
+        local.depth += 1
+        return conn
+
+    def __exit__(self, exc_type, exc, tb):
+        local = self.store._local
+        local.depth -= 1
+        if local.depth == 0:
+            local.conn.execute('COMMIT' if exc_type is None else 'ROLLBACK')
+        return False
+
+
+class SQLiteStateStore:
+    # Trạng thái phòng dạng JSON trong SQLite (WAL); CAS bằng một câu UPDATE
+    # có điều kiện trên cột version.
+
+    def __init__(self, path=GAME_STATE_DB):
+        self.path = path
+        self._local = threading.local()
+
+    def transaction(self):
+        return _Transaction(self)
+
+    def _conn(self):
+        key = os.getpid()
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != key:
+            conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_MS / 1000,
+                                   isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA busy_timeout=%d' % BUSY_TIMEOUT_MS)
+            conn.executescript(SCHEMA)
+            self._local.conn = conn
+            self._local.pid = key
+            self._local.depth = 0
+        return conn
+
+    def create_room(self, room_id, state):
+        now = time.time()
+        try:
+            self._conn().execute(
+                'INSERT INTO rooms (id, version, size, win_length, waiting, state, '
+                'created_at, updated_at) VALUES (?, 1, ?, ?, ?, ?, ?, ?)',
+                (room_id, state['size'], state['win_length'], int(_waiting(state)),
+                 json.dumps(state), now, now))
+        except sqlite3.IntegrityError:
+            return None
+        return 1
+
+    def load(self, room_id):
+        row = self._conn().execute(
+            'SELECT version, state FROM rooms WHERE id = ?', (room_id,)).fetchone()
+        if row is None:
+            return None, None
+        return row[0], json.loads(row[1])
+
+    def version(self, room_id):
+        row = self._conn().execute(
+            'SELECT version FROM rooms WHERE id = ?', (room_id,)).fetchone()
+        return row[0] if row is not None else None
+
+    def compare_and_set(self, room_id, version, state):
+        cursor = self._conn().execute(
+            'UPDATE rooms SET version = version + 1, waiting = ?, state = ?, '
+            'updated_at = ? WHERE id = ? AND version = ?',
+            (int(_waiting(state)), json.dumps(state), time.time(), room_id, version))
+        if cursor.rowcount != 1:
+            return None
+        return version + 1
+
+    def delete_room(self, room_id):
+        conn = self._conn()
+        conn.execute('DELETE FROM rooms WHERE id = ?', (room_id,))
+        conn.execute('DELETE FROM spectators WHERE room_id = ?', (room_id,))
+
+    def find_waiting_room(self, size, win_length, older_than=None):
+        sql = 'SELECT id FROM rooms WHERE waiting = 1 AND size = ? AND win_length = ?'
+        params = [size, win_length]
+        if older_than is not None:
+            sql += (' AND (created_at, id) < '
+                    '(SELECT created_at, id FROM rooms WHERE id = ?)')
+            params.append(older_than)
+        row = self._conn().execute(
+            sql + ' ORDER BY created_at, id LIMIT 1', params).fetchone()
+        return row[0] if row is not None else None
+
+    def touch(self, room_id):
+        self._conn().execute('UPDATE rooms SET updated_at = ? WHERE id = ?',
+                             (time.time(), room_id))
+
+    def get_user_room(self, username):
+        row = self._conn().execute(
+            'SELECT room_id FROM user_rooms WHERE username = ?', (username,)).fetchone()
+        return row[0] if row is not None else None
+
+    def set_user_room(self, username, room_id):
+        self._conn().execute(
+            'INSERT INTO user_rooms (username, room_id) VALUES (?, ?) '
+            'ON CONFLICT (username) DO UPDATE SET room_id = excluded.room_id',
+            (username, room_id))
+
+    def clear_user_room(self, username, room_id=None):
+        if room_id is None:
+            self._conn().execute('DELETE FROM user_rooms WHERE username = ?', (username,))
+        else:
+            self._conn().execute(
+                'DELETE FROM user_rooms WHERE username = ? AND room_id = ?',
+                (username, room_id))
+
+    def add_spectator(self, room_id, username):
+        self._conn().execute(
+            'INSERT OR IGNORE INTO spectators (room_id, username) '
+            'SELECT id, ? FROM rooms WHERE id = ?', (username, room_id))
+
+    def remove_spectator(self, room_id, username):
+        self._conn().execute('DELETE FROM spectators WHERE room_id = ? AND username = ?',
+                             (room_id, username))
+
+    def spectators(self, room_id):
+        return [row[0] for row in self._conn().execute(
+            'SELECT username FROM spectators WHERE room_id = ?', (room_id,))]
+
+    def count_spectators(self, room_id):
+        return self._conn().execute(
+            'SELECT COUNT(*) FROM spectators WHERE room_id = ?', (room_id,)).fetchone()[0]
+
+    def count_rooms(self):
+        return self._conn().execute('SELECT COUNT(*) FROM rooms').fetchone()[0]
+
+    def idle_rooms(self, idle_seconds):
+        cutoff = time.time() - idle_seconds
+        return [row[0] for row in self._conn().execute(
+            'SELECT id FROM rooms WHERE updated_at < ?', (cutoff,))]
+
+
+def create_store(kind=GAME_STATE_STORE):
+    if kind == 'sqlite':
+        return SQLiteStateStore(GAME_STATE_DB)
+    if kind == 'memory':
+        return MemoryStateStore()
+    raise ValueError('Kiểu lưu trạng thái không hỗ trợ: %s' % kind)
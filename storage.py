@@ -0,0 +1,468 @@
+import datetime
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import game_records
+import leaderboard
+
+# Lưu lịch sử chơi trong SQLite (chế độ WAL) thay cho việc đọc/ghi lại toàn
+# bộ history.json: mỗi ván là một dòng được thêm vào bảng games, bộ đếm
+# thắng/thua/hòa của từng người chơi được cập nhật ngay trong cùng giao dịch.
+# SQLite tự khóa tệp nên nhiều worker gunicorn ghi cùng lúc vẫn an toàn.
+HISTORY_DB = os.environ.get('HISTORY_DB', 'history.db')
+HISTORY_FILE = 'history.json'
+BUSY_TIMEOUT_MS = 5000
+SCORE_CACHE_USERS = 10000  # Số người chơi tối đa giữ trong bộ nhớ đệm tỉ số
+PAGE_SIZE = 20
+MAX_PAGE_SIZE = 200
+EXPORT_BATCH = 500
+GAME_COLUMNS = ('id', 'mode', 'difficulty', 'opponent', 'result', 'timestamp', 'moves', 'flags')
+# Trường của mỗi ván trả về cho /api/history và tệp xuất; moves/symbol/first
+# là None với các ván ghi trước khi có thứ tự nước đi
+GAME_FIELDS = GAME_COLUMNS[:-2] + ('moves', 'symbol', 'first')
+
+RESULT_COLUMNS = {
+    'Thắng': 'wins',
+    'Thua': 'losses',
+    'Hòa': 'draws'
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS games (
+    id INTEGER PRIMARY KEY,
+    username TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    difficulty TEXT NOT NULL DEFAULT '',
+    opponent TEXT,
+    result TEXT NOT NULL,
+    timestamp TEXT,
+    moves BLOB,
+    flags INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS games_by_user
+    ON games (username, mode, difficulty, id);
+CREATE INDEX IF NOT EXISTS games_by_user_id
+    ON games (username, id);
+CREATE TABLE IF NOT EXISTS counters (
+    username TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    difficulty TEXT NOT NULL DEFAULT '',
+    wins INTEGER NOT NULL DEFAULT 0,
+    losses INTEGER NOT NULL DEFAULT 0,
+    draws INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (username, mode, difficulty)
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+_local = threading.local()
+
+
+def _open(path):
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000,
+                           isolation_level=None, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA busy_timeout=%d' % BUSY_TIMEOUT_MS)
+    conn.executescript(SCHEMA)
+    conn.executescript(leaderboard.SCHEMA)
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(games)')}
+    if 'moves' not in columns:
+        # Cơ sở dữ liệu tạo trước khi có thứ tự nước đi
+        conn.execute('ALTER TABLE games ADD COLUMN moves BLOB')
+        conn.execute('ALTER TABLE games ADD COLUMN flags INTEGER NOT NULL DEFAULT 0')
+    return conn
+
+
+def get_connection(path=None):
+    # Mỗi luồng một kết nối; mở lại sau khi fork để không dùng chung kết nối
+    # giữa các tiến trình.
+    path = path or HISTORY_DB
+    key = (os.getpid(), path)
+    connections = getattr(_local, 'connections', None)
+    if connections is None:
+        connections = _local.connections = {}
+    conn = connections.get(key)
+    if conn is None:
+        conn = connections[key] = _open(path)
+        migrate_json(HISTORY_FILE, conn)
+        ensure_rank_index(conn)
+    return conn
+
+
+def prepare(path=None):
+    # Kiểm tra và nâng cấp history.db một lần lúc khởi động, trước khi fork
+    # worker (xem startup.py). Kết nối dùng xong được đóng để không mang qua fork.
+    conn = _open(path or HISTORY_DB)
+    try:
+        check = conn.execute('PRAGMA quick_check').fetchone()[0]
+        if check != 'ok':
+            raise sqlite3.DatabaseError('%s bị hỏng: %s' % (path or HISTORY_DB, check))
+        migrate_json(HISTORY_FILE, conn)
+        ensure_rank_index(conn)
+    finally:
+        conn.close()
+
+
+class _Transaction:
+    # BEGIN IMMEDIATE giữ khóa ghi ngay từ đầu để tránh lỗi nâng cấp khóa
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute('BEGIN IMMEDIATE')
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.conn.execute('COMMIT')
+        else:
+            self.conn.execute('ROLLBACK')
+        return False
+
+
+def _insert_game(conn, username, mode, difficulty, opponent, result, timestamp,
+                 moves=None, flags=0):
+    conn.execute(
+        'INSERT INTO games (username, mode, difficulty, opponent, result, timestamp, '
+        'moves, flags) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+        (username, mode, difficulty, opponent, result, timestamp, moves, flags))
+
+
+def _add_counts(conn, username, mode, difficulty, wins, losses, draws):
+    conn.execute(
+        'INSERT INTO counters (username, mode, difficulty, wins, losses, draws) '
+        'VALUES (?, ?, ?, ?, ?, ?) '
+        'ON CONFLICT (username, mode, difficulty) DO UPDATE SET '
+        'wins = wins + excluded.wins, losses = losses + excluded.losses, '
+        'draws = draws + excluded.draws',
+        (username, mode, difficulty, wins, losses, draws))
+
+
+def _record(conn, username, result, opponent, difficulty, mode, timestamp,
+            moves=None, symbol=None, first=False, size=3):
+    # Gọi khi đang trong giao dịch: thêm ván, cộng bộ đếm và cập nhật thứ hạng
+    column = RESULT_COLUMNS.get(result)
+    flags = 0
+    if moves is not None:
+        flags = game_records.pack_flags(size, symbol, first)
+        moves = game_records.pack_moves(moves, size * size)
+    _insert_game(conn, username, mode, difficulty, opponent, result, timestamp,
+                 moves, flags)
+    row = conn.execute(
+        'SELECT wins, losses, draws FROM counters '
+        'WHERE username = ? AND mode = ? AND difficulty = ?',
+        (username, mode, difficulty)).fetchone()
+    wins, losses, draws = (int(column == 'wins'), int(column == 'losses'),
+                           int(column == 'draws'))
+    _add_counts(conn, username, mode, difficulty, wins, losses, draws)
+    before = None if row is None else leaderboard.points(*row)
+    leaderboard.move_score(conn, leaderboard.board_of(mode, difficulty), before,
+                           (before or 0) + leaderboard.points(wins, losses, draws))
+
+
+def record_game(username, result, opponent=None, difficulty=None, mode='ai',
+                moves=None, symbol=None, first=False, size=3, conn=None):
+    # moves: thứ tự các ô đã đánh; symbol: ký hiệu của người chơi; first:
+    # người chơi có đi trước không. Nước đi được nén theo game_records.py.
+    conn = conn or get_connection()
+    difficulty = (difficulty or '') if mode == 'ai' else ''
+    timestamp = datetime.datetime.now().strftime(game_records.TIME_FORMAT)
+    with _Transaction(conn):
+        _record(conn, username, result, opponent, difficulty, mode, timestamp,
+                moves, symbol, first, size)
+        version = _bump_version(conn)
+    score_cache.invalidate((username,), version)
+
+
+def record_match(username, opponent, result, record=None, opponent_record=None,
+                 conn=None):
+    # Một ván giữa hai người: ghi bản ghi của cả hai và cập nhật Elo trong
+    # cùng một giao dịch. result theo góc nhìn username; record/opponent_record
+    # là các tham số moves/symbol/first/size của record_game.
+    conn = conn or get_connection()
+    opponent_result = {'Thắng': 'Thua', 'Thua': 'Thắng'}.get(result, result)
+    timestamp = datetime.datetime.now().strftime(game_records.TIME_FORMAT)
+    with _Transaction(conn):
+        _record(conn, username, result, opponent, '', 'pvp', timestamp, **(record or {}))
+        _record(conn, opponent, opponent_result, username, '', 'pvp', timestamp,
+                **(opponent_record or {}))
+        leaderboard.record_elo(conn, username, opponent, result)
+        version = _bump_version(conn)
+    score_cache.invalidate((username, opponent), version)
+
+
+def ensure_rank_index(conn):
+    # Dựng cây thứ hạng một lần cho cơ sở dữ liệu có từ trước bảng xếp hạng
+    query = "SELECT value FROM meta WHERE key = 'rank_index'"
+    if conn.execute(query).fetchone() is not None:
+        return
+    with _Transaction(conn):
+        if conn.execute(query).fetchone() is None:
+            leaderboard.rebuild(conn)
+            conn.execute("INSERT INTO meta (key, value) VALUES ('rank_index', '1')")
+
+
+def get_counts(username, mode='ai', difficulty=None, conn=None):
+    conn = conn or get_connection()
+    row = conn.execute(
+        'SELECT wins, losses, draws FROM counters '
+        'WHERE username = ? AND mode = ? AND difficulty = ?',
+        (username, mode, difficulty or '')).fetchone()
+    if row is None:
+        return 0, 0, 0
+    return row
+
+
+def _bump_version(conn):
+    # Gọi trong giao dịch ghi bộ đếm, trả về số phiên bản mới (xem ScoreCache)
+    conn.execute(
+        "INSERT INTO meta (key, value) VALUES ('counters_version', 1) "
+        "ON CONFLICT (key) DO UPDATE SET value = value + 1")
+    return _counters_version(conn)
+
+
+def _counters_version(conn):
+    row = conn.execute("SELECT value FROM meta WHERE key = 'counters_version'").fetchone()
+    return 0 if row is None else int(row[0])
+
+
+def _load_counts(conn, username):
+    counts = {}
+    for mode, difficulty, wins, losses, draws in conn.execute(
+            'SELECT mode, difficulty, wins, losses, draws FROM counters '
+            'WHERE username = ?', (username,)):
+        counts[(mode, difficulty)] = (wins, losses, draws)
+    return counts
+
+
+class ScoreCache:
+    # Bộ nhớ đệm tỉ số theo người chơi (LRU) trong mỗi tiến trình, đọc qua một
+    # kết nối riêng của tiến trình (một điểm kiểm tra duy nhất). Mỗi giao dịch
+    # ghi bộ đếm tăng số phiên bản counters_version trong bảng meta. Khi PRAGMA
+    # data_version báo có kết nối khác đã ghi, đệm đọc lại số phiên bản: nếu
+    # khác bản đã biết (worker khác đã ghi) thì xóa toàn bộ. Ghi trong tiến
+    # trình này chỉ bỏ các mục của người chơi liên quan sau khi commit
+    # (xem invalidate). Khi không có gì thay đổi, đọc tỉ số không cần truy
+    # cập tệp.
+
+    def __init__(self, max_users=SCORE_CACHE_USERS):
+        self.max_users = max_users
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._conn = None
+        self._key = None
+        self._data_version = None
+        self._version = None
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        # Gọi khi đang giữ self._lock; mở lại sau khi fork hoặc đổi tệp
+        key = (os.getpid(), HISTORY_DB)
+        if self._key != key:
+            self._conn = _open(HISTORY_DB)
+            self._key = key
+            self._entries.clear()
+            self._data_version = self._version = None
+        return self._conn
+
+    def _validate(self, conn):
+        data_version = conn.execute('PRAGMA data_version').fetchone()[0]
+        if data_version == self._data_version:
+            return
+        self._data_version = data_version
+        version = _counters_version(conn)
+        if version != self._version:
+            self._entries.clear()
+            self._version = version
+
+    def get(self, username, mode='ai', difficulty=None):
+        with self._lock:
+            conn = self._connection()
+            self._validate(conn)
+            counts = self._entries.get(username)
+            if counts is not None:
+                self._entries.move_to_end(username)
+                self.hits += 1
+            else:
+                self.misses += 1
+                counts = self._entries[username] = _load_counts(conn, username)
+                if len(self._entries) > self.max_users:
+                    self._entries.popitem(last=False)
+        return counts.get((mode, difficulty or ''), (0, 0, 0))
+
+    def invalidate(self, usernames, version):
+        # Gọi sau khi giao dịch có số phiên bản version đã commit: bỏ mục của
+        # những người chơi vừa ghi (lần đọc sau nạp lại từ cơ sở dữ liệu). Nếu
+        # version nối tiếp bản đã biết thì không còn thay đổi nào khác nên
+        # không cần xóa cả đệm; ngược lại _validate sẽ xóa khi đọc.
+        with self._lock:
+            for username in usernames:
+                self._entries.pop(username, None)
+            if self._version is not None and version == self._version + 1:
+                self._version = version
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._data_version = self._version = None
+
+
+score_cache = ScoreCache()
+
+
+def get_user_history(username, conn=None):
+    # Dựng lại cấu trúc {'ai': {độ khó: {...}}, 'pvp': {...}} mà history.html dùng
+    conn = conn or get_connection()
+    history = {}
+    for mode, difficulty, wins, losses, draws in conn.execute(
+            'SELECT mode, difficulty, wins, losses, draws FROM counters '
+            'WHERE username = ? ORDER BY mode, difficulty', (username,)):
+        records = {'games': [], 'wins': wins, 'losses': losses, 'draws': draws}
+        if mode == 'ai':
+            history.setdefault('ai', {})[difficulty] = records
+        else:
+            history[mode] = records
+    for mode, difficulty, opponent, result, timestamp in conn.execute(
+            'SELECT mode, difficulty, opponent, result, timestamp FROM games '
+            'WHERE username = ? ORDER BY id', (username,)):
+        if mode == 'ai':
+            history['ai'][difficulty]['games'].append(result)
+        else:
+            history[mode]['games'].append(
+                {'opponent': opponent, 'result': result, 'timestamp': timestamp})
+    return history
+
+
+def get_user_counters(username, conn=None):
+    # Chỉ đọc bộ đếm, không chạm tới từng ván đã chơi
+    conn = conn or get_connection()
+    counters = {}
+    for (mode, difficulty), (wins, losses, draws) in sorted(
+            _load_counts(conn, username).items()):
+        records = {'wins': wins, 'losses': losses, 'draws': draws}
+        if mode == 'ai':
+            counters.setdefault('ai', {})[difficulty] = records
+        else:
+            counters[mode] = records
+    return counters
+
+
+def _games_query(username, mode=None, difficulty=None, before=None):
+    sql = 'SELECT %s FROM games WHERE username = ?' % ', '.join(GAME_COLUMNS)
+    params = [username]
+    if mode is not None:
+        sql += ' AND mode = ?'
+        params.append(mode)
+    if difficulty is not None:
+        sql += ' AND difficulty = ?'
+        params.append(difficulty)
+    if before is not None:
+        sql += ' AND id < ?'
+        params.append(before)
+    return sql + ' ORDER BY id DESC', params
+
+
+def _game(row):
+    game = dict(zip(GAME_FIELDS, row[:-2] + (None, None, None)))
+    moves, flags = row[-2:]
+    if moves is not None:
+        size, game['symbol'], game['first'] = game_records.unpack_flags(flags)
+        game['moves'] = game_records.unpack_moves(moves, size * size)
+    return game
+
+
+def get_games_page(username, mode=None, difficulty=None, before=None,
+                   limit=PAGE_SIZE, offset=0, conn=None):
+    # Một trang lịch sử, ván mới nhất trước. Phân trang bằng con trỏ (before
+    # là id của ván cuối trang trước) hoặc bằng offset. Trả về (games,
+    # con trỏ trang sau hoặc None nếu đã hết).
+    conn = conn or get_connection()
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    sql, params = _games_query(username, mode, difficulty, before)
+    sql += ' LIMIT ? OFFSET ?'
+    params += [limit + 1, max(0, int(offset))]
+    rows = conn.execute(sql, params).fetchall()
+    games = [_game(row) for row in rows[:limit]]
+    next_cursor = games[-1]['id'] if len(rows) > limit else None
+    return games, next_cursor
+
+
+def iter_games(username, mode=None, difficulty=None, conn=None):
+    # Duyệt toàn bộ lịch sử theo từng lô để xuất tệp với bộ nhớ giới hạn
+    conn = conn or get_connection()
+    sql, params = _games_query(username, mode, difficulty)
+    cursor = conn.execute(sql, params)
+    try:
+        while True:
+            rows = cursor.fetchmany(EXPORT_BATCH)
+            if not rows:
+                break
+            for row in rows:
+                yield _game(row)
+    finally:
+        cursor.close()
+
+
+def get_leaderboard(board, limit=leaderboard.TOP_K, conn=None):
+    # Top-K của một bảng xếp hạng ('ai:<độ khó>', 'pvp' hoặc 'elo')
+    conn = conn or get_connection()
+    return leaderboard.top(conn, board, max(1, min(int(limit), leaderboard.MAX_TOP_K)))
+
+
+def get_user_rank(username, board, conn=None):
+    # (hạng, điểm, số người trên bảng); hạng và điểm là None nếu chưa có mặt
+    conn = conn or get_connection()
+    rank, score = leaderboard.user_rank(conn, board, username)
+    return rank, score, leaderboard.board_size(conn, board)
+
+
+def _migrate_records(conn, username, mode, difficulty, records):
+    for game in records.get('games', []):
+        if isinstance(game, dict):
+            _insert_game(conn, username, mode, difficulty, game.get('opponent'),
+                         game.get('result'), game.get('timestamp'))
+        else:
+            _insert_game(conn, username, mode, difficulty, None, game, None)
+    _add_counts(conn, username, mode, difficulty, records.get('wins', 0),
+                records.get('losses', 0), records.get('draws', 0))
+
+
+def migrate_json(path=HISTORY_FILE, conn=None):
+    # Chuyển một lần dữ liệu từ history.json sang SQLite. Hỗ trợ cả dạng cũ
+    # (độ khó nằm ngay dưới tên người chơi) lẫn dạng {'mode': {'ai', 'pvp'}}.
+    conn = conn or get_connection()
+    if not os.path.exists(path):
+        return False
+    with _Transaction(conn):
+        done = conn.execute(
+            "SELECT value FROM meta WHERE key = 'migrated_json'").fetchone()
+        if done is not None:
+            return False
+        try:
+            with open(path, 'r') as f:
+                history = json.load(f)
+        except (OSError, json.decoder.JSONDecodeError):
+            history = {}
+        for username, user_history in history.items():
+            for key, records in user_history.items():
+                if key != 'mode':
+                    _migrate_records(conn, username, 'ai', key, records)
+            mode_history = user_history.get('mode', {})
+            for difficulty, records in mode_history.get('ai', {}).items():
+                _migrate_records(conn, username, 'ai', difficulty, records)
+            if 'pvp' in mode_history:
+                _migrate_records(conn, username, 'pvp', '', mode_history['pvp'])
+        conn.execute("INSERT INTO meta (key, value) VALUES ('migrated_json', ?)",
+                     (os.path.abspath(path),))
+        leaderboard.rebuild(conn)
+        _bump_version(conn)
+    return True
@@ -0,0 +1,57 @@
+import os
+import tempfile
+
+import pytest
+
+# Mọi tệp dữ liệu của app (history.db, sessions.db, game_state.db, ai_jobs.db)
+# nằm trong thư mục tạm; đặt biến môi trường trước khi các module của app
+# được import
+WORKDIR = tempfile.mkdtemp(prefix='tictactoe-tests-')
+os.environ['HISTORY_DB'] = os.path.join(WORKDIR, 'history.db')
+os.environ['SESSION_DB'] = os.path.join(WORKDIR, 'sessions.db')
+os.environ['GAME_STATE_DB'] = os.path.join(WORKDIR, 'game_state.db')
+os.environ['AI_JOB_DB'] = os.path.join(WORKDIR, 'ai_jobs.db')
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    # history.json và games.bin được đọc/ghi theo thư mục hiện tại
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def history_db(workdir, monkeypatch):
+    # history.db riêng cho mỗi test; bộ nhớ đệm tỉ số tự mở lại theo đường dẫn mới
+    import storage
+
+    path = str(workdir / 'history.db')
+    monkeypatch.setattr(storage, 'HISTORY_DB', path)
+    storage.score_cache.clear()
+    return path
+
+
+@pytest.fixture(scope='session')
+def ai_pool():
+    # Nhóm tiến trình tính nước đi dùng chung cho cả lượt chạy test
+    import tictactoe
+
+    yield tictactoe.ai_pool
+    if tictactoe.ai_pool._executor is not None:
+        tictactoe.ai_pool._executor.shutdown(cancel_futures=True)
+
+
+@pytest.fixture
+def app(history_db, ai_pool, monkeypatch):
+    # App với kho phòng và kho session trong bộ nhớ, mới cho mỗi test
+    import rooms
+    import sessions
+    import state_store
+    import tictactoe
+
+    monkeypatch.setattr(tictactoe, 'room_manager',
+                        rooms.RoomManager(state_store.MemoryStateStore()))
+    monkeypatch.setattr(tictactoe.app, 'session_interface',
+                        sessions.ServerSessionInterface(sessions.MemorySessionStore()))
+    return tictactoe.app
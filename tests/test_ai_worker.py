@@ -0,0 +1,94 @@
+import time
+
+import pytest
+
+import ai_worker
+import evaluate
+
+SMALL = (['X', ' ', ' ', ' ', 'O', ' ', ' ', ' ', 'X'], 'O', 'super_hard', 3)
+LARGE = ([' '] * 112 + ['X'] + [' '] * 112, 'O', 'super_hard', 5)
+
+
+@pytest.fixture(scope='module')
+def pool():
+    pool = ai_worker.AIPool(workers=1, queue_limit=1)
+    for future in pool.warm_up():
+        future.result()
+    yield pool
+    pool._executor.shutdown(cancel_futures=True)
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def store(request, workdir):
+    if request.param == 'memory':
+        return ai_worker.MemoryJobStore()
+    return ai_worker.SQLiteJobStore(str(workdir / 'ai_jobs.db'))
+
+
+def wait_done(pool, job_id):
+    while True:
+        status, move = pool.result(job_id)
+        if status != 'pending':
+            return status, move
+
+
+def test_job_returns_the_engine_move(pool):
+    job_id = pool.submit(evaluate.choose_move, SMALL, 1)
+    move = evaluate.choose_move(*SMALL)[0]
+    assert wait_done(pool, job_id) == ('done', move)
+    # Request đến sau (tải lại trang cùng lúc) nhận cùng nước đi, đánh dấu đã lấy
+    assert pool.result(job_id) == ('taken', move)
+    assert pool.result('missing') == ('unknown', None)
+    assert pool.stats()['completed'] >= 1
+
+
+def test_other_worker_reads_the_result(pool):
+    # Worker khác dùng chung kho kết quả nhưng không có công việc trong tiến trình
+    other = ai_worker.AIPool(workers=1, queue_limit=1, store=ai_worker.create_store())
+    job_id = pool.submit(evaluate.choose_move, SMALL, 1)
+    move = evaluate.choose_move(*SMALL)[0]
+    assert wait_done(other, job_id) == ('done', move)
+    assert other._executor is None
+    assert pool.result(job_id) == ('taken', move)
+
+
+def test_full_queue_rejects_jobs(pool):
+    job_id = pool.submit(evaluate.choose_move, LARGE, 5)
+    with pytest.raises(ai_worker.QueueFull):
+        pool.submit(evaluate.choose_move, SMALL, 1)
+    assert pool.stats()['rejected'] == 1
+    pool.discard(job_id)
+    assert pool.result(job_id) == ('unknown', None)
+
+
+def test_overdue_job_uses_best_move_so_far(pool):
+    job_id = pool.submit(evaluate.choose_move, LARGE, 5)
+    job = pool._jobs[job_id]
+    while pool.best_so_far(job) is None:
+        time.sleep(0.01)
+    # Hết hạn: dùng nước tiến trình con đã tìm xong và dừng tìm kiếm
+    job.deadline = time.time()
+    status, move = pool.result(job_id)
+    assert status == 'done' and LARGE[0][move] == ' '
+    assert pool.stats()['timed_out'] == 1
+    job.future.result(timeout=ai_worker.JOB_GRACE)
+    # Kết quả của tiến trình con đến sau không ghi đè nước đã dùng
+    assert pool.result(job_id) == ('taken', move)
+
+
+def test_store_keeps_the_first_result(store):
+    store.add('a', time.time() + 10)
+    assert store.take('a')[0] == 'pending'
+    store.finish('a', 4)
+    store.finish('a', 5)
+    assert store.take('a')[:2] == ('done', 4)
+    assert store.take('a')[:2] == ('taken', 4)
+    store.delete('a')
+    assert store.take('a') is None
+
+
+def test_lost_job_is_unknown_after_its_deadline(store):
+    pool = ai_worker.AIPool(workers=1, store=store)
+    store.add('lost', time.time() + 0.1 - ai_worker.JOB_GRACE)
+    assert pool.result('lost', wait=0) == ('pending', None)
+    assert pool.result('lost', wait=1) == ('unknown', None)
@@ -0,0 +1,217 @@
+import time
+
+import pytest
+
+import ai_worker
+import game_records
+import rooms
+import storage
+import tictactoe
+
+
+def login(client, username, mode='ai', **extra):
+    response = client.post('/api/v1/login', json=dict(username=username, mode=mode, **extra))
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+
+def settle(client, state):
+    # Như một bot: máy chưa tính xong ('pending') thì hỏi lại trạng thái
+    deadline = time.monotonic() + 30
+    while state['ai'] == 'pending' and time.monotonic() < deadline:
+        time.sleep(0.05)
+        state = client.get('/api/v1/state').get_json()
+    assert state['ai'] is None
+    return state
+
+
+def first_empty(state):
+    return state['board'].index(game_records.EMPTY_CHAR)
+
+
+@pytest.mark.parametrize('body, status', [
+    ({}, 400),
+    ({'username': '  '}, 400),
+    ({'username': 'an', 'mode': 'bot'}, 400),
+    ({'username': 'an', 'difficulty': 'impossible'}, 400),
+])
+def test_login_rejects_bad_input(app, body, status):
+    assert app.test_client().post('/api/v1/login', json=body).status_code == status
+
+
+@pytest.mark.parametrize('method, path', [
+    ('GET', '/api/v1/state'), ('POST', '/api/v1/move'), ('POST', '/api/v1/new_game'),
+    ('POST', '/api/v1/ready'), ('POST', '/api/v1/continue')])
+def test_requires_login(app, method, path):
+    assert app.test_client().open(path, method=method, json={}).status_code == 401
+
+
+def test_ai_game_until_the_end(app):
+    client = app.test_client()
+    state = settle(client, login(client, 'an', difficulty='super_hard'))
+    assert state['mode'] == 'ai' and state['size'] == 3
+    assert state['turn'] == state['player']
+    while not state['game_over']:
+        response = client.post('/api/v1/move', json={'position': first_empty(state)})
+        assert response.status_code == 200
+        state = response.get_json()
+        if not state['game_over'] and state['ai'] is None:
+            assert state['ai_move'] is not None
+        state = settle(client, state)
+    # Máy siêu khó không bao giờ thua
+    assert state['result'] in ('Thua', 'Hòa')
+    assert sum(state['score'].values()) == 1
+    assert sum(storage.get_counts('an', 'ai', 'super_hard')) == 1
+    # Ván đã kết thúc: không đi thêm được
+    empty = state['board'].find(game_records.EMPTY_CHAR)
+    if empty >= 0:
+        assert client.post('/api/v1/move', json={'position': empty}).status_code == 409
+    state = settle(client, client.post('/api/v1/new_game').get_json())
+    assert not state['game_over']
+    assert state['board'].count(game_records.EMPTY_CHAR) >= 8
+
+
+@pytest.mark.parametrize('position', [True, False, -1, 9, '4', 4.0, None])
+def test_ai_move_rejects_bad_positions(app, position):
+    client = app.test_client()
+    login(client, 'an')
+    assert client.post('/api/v1/move', json={'position': position}).status_code == 400
+
+
+def test_state_as_integer_board(app):
+    client = app.test_client()
+    state = settle(client, login(client, 'an'))
+    packed = client.get('/api/v1/state?format=int').get_json()['board']
+    board = [' ' if cell == game_records.EMPTY_CHAR else cell for cell in state['board']]
+    assert packed == game_records.pack_board(board)
+
+
+def test_state_etag_and_304(app):
+    client = app.test_client()
+    state = settle(client, login(client, 'an'))
+    response = client.get('/api/v1/state')
+    etag = response.headers['ETag']
+    assert response.headers['Cache-Control'] == 'private, no-cache'
+    response = client.get('/api/v1/state', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.get_data() == b''
+    client.post('/api/v1/move', json={'position': first_empty(state)})
+    response = client.get('/api/v1/state', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+
+def test_pvp_game(app):
+    clients = {name: app.test_client() for name in ('an', 'binh')}
+    room = login(clients['an'], 'an', mode='player')['room']
+    state = login(clients['binh'], 'binh', mode='player')
+    assert state['room'] == room and state['players'] == ['an', 'binh']
+    assert state['player'] == 'O'
+    clients['an'].post('/api/v1/ready')
+    state = clients['binh'].post('/api/v1/ready').get_json()
+    assert state['ready'] == {'an': True, 'binh': True}
+    mover = state['turn']
+    waiter = 'binh' if mover == 'an' else 'an'
+    assert clients[waiter].post('/api/v1/move', json={'position': 0}).status_code == 409
+    assert clients[mover].post('/api/v1/move', json={'position': True}).status_code == 400
+    assert clients[mover].post('/api/v1/move', json={'position': 9}).status_code == 400
+    state = clients[mover].post('/api/v1/move', json={'position': 4}).get_json()
+    assert state['board'][4] != game_records.EMPTY_CHAR
+    assert state['turn'] == waiter
+    assert clients[waiter].post('/api/v1/move', json={'position': 4}).status_code == 409
+
+
+def test_deleted_room_is_404(app, monkeypatch):
+    client = app.test_client()
+    login(client, 'an', mode='player')
+    manager = tictactoe.room_manager
+    # Phòng bị worker khác xóa giữa lúc tra phòng và đọc trạng thái
+    monkeypatch.setattr(manager, 'room_of', lambda username: rooms.Room('gone', manager.store))
+    assert client.get('/api/v1/state').status_code == 404
+    assert client.post('/api/v1/move', json={'position': 0}).status_code == 404
+    assert client.post('/api/v1/ready').status_code == 404
+
+
+def test_move_outside_a_room_is_409(app):
+    client = app.test_client()
+    login(client, 'an', mode='player')
+    tictactoe.room_manager.leave('an')
+    assert client.post('/api/v1/move', json={'position': 0}).status_code == 409
+
+
+def test_login_rotates_session(app):
+    client = app.test_client()
+    login(client, 'an')
+    name = app.config['SESSION_COOKIE_NAME']
+    first = client.get_cookie(name).value
+    login(client, 'binh')
+    assert client.get_cookie(name).value != first
+    assert app.session_interface.store.load(first) == (None, None)
+
+
+def form_login(client, username):
+    client.post('/login', data={'username': username, 'mode': 'player', 'board': '3x3'})
+    response = client.get('/')
+    assert response.status_code == 302
+    return response.headers['Location']
+
+
+def test_room_page_etag_and_304(app):
+    an, binh = app.test_client(), app.test_client()
+    path = form_login(an, 'an')
+    response = an.get(path)
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+    assert etag.startswith('W/')
+    assert response.headers['Cache-Control'] == 'no-cache'
+    response = an.get(path, headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    # Người thứ hai vào phòng: phiên bản đổi, trang được dựng lại
+    assert form_login(binh, 'binh') == path
+    response = an.get(path, headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    # ETag riêng cho từng người xem
+    assert binh.get(path).headers['ETag'] != response.headers['ETag']
+
+
+def test_ai_result_taken_by_another_request(app):
+    client = app.test_client()
+    state = settle(client, login(client, 'an'))
+    job_id = client.post('/move', json={'position': first_empty(state)}).get_json()['job']
+    # Request khác (tải lại trang, worker khác) lấy kết quả trước
+    status, move = tictactoe.ai_pool.result(job_id, wait=5)
+    assert status == 'done'
+    state = client.get('/api/v1/state').get_json()
+    assert state['ai'] is None and state['ai_move'] is None
+    assert state['board'][move] != game_records.EMPTY_CHAR
+    assert state['turn'] == state['player'] or state['game_over']
+    assert tictactoe.ai_pool.result(job_id) == ('taken', move)
+
+
+def test_busy_queue_is_retried_without_reloading(app, monkeypatch):
+    client = app.test_client()
+    state = settle(client, login(client, 'an'))
+    full = [True]
+    submit = tictactoe.ai_pool.submit
+
+    def limited(*args, **kwargs):
+        if full[0]:
+            raise ai_worker.QueueFull()
+        return submit(*args, **kwargs)
+
+    monkeypatch.setattr(tictactoe.ai_pool, 'submit', limited)
+    assert client.post('/move', json={'position': first_empty(state)}).get_json()['job'] is None
+    page = client.get('/').get_data(as_text=True)
+    assert 'retryAI(null)' in page and 'waitForAI(\'' not in page
+    assert client.get('/ai_job').get_json() == {'status': 'busy', 'job': None}
+    # Hàng đợi có chỗ: /ai_job gửi công việc, rồi hỏi tiếp bằng mã công việc
+    full[0] = False
+    data = client.get('/ai_job').get_json()
+    while data['status'] == 'pending':
+        data = client.get('/ai_job/' + data['job']).get_json()
+    assert data['status'] == 'done'
+    state = client.get('/api/v1/state').get_json()
+    assert state['turn'] == state['player'] or state['game_over']
+    assert client.get('/ai_job/stale').get_json() == {'status': 'done', 'job': None}
+    assert client.get('/ai_job').get_json() == {'status': 'done', 'job': None}
@@ -0,0 +1,114 @@
+import itertools
+import random
+
+import pytest
+
+import book
+import engine
+import storage
+
+RATES = {'hard': 0.1, 'normal': 0.3}
+HUMAN_CELL = 1  # Ô người chơi hay đi đầu tiên trong các ván đã lưu
+
+
+@pytest.fixture(scope='module')
+def opening_book(tmp_path_factory):
+    # Sách nhỏ: ba ván 3x3 người chơi mở bằng HUMAN_CELL, bàn 5x5 chỉ một nước
+    workdir = tmp_path_factory.mktemp('book')
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(storage, 'HISTORY_DB', str(workdir / 'history.db'))
+        for _ in range(3):
+            storage.record_game('an', 'Thua', difficulty='hard',
+                                moves=[HUMAN_CELL, 4, 0, 8, 2, 6, 7, 3, 5],
+                                symbol='X', first=True)
+        path = str(workdir / 'book.bin')
+        book.build(storage.get_connection(), path, rates=RATES, win_lengths={5: 4},
+                   plies=1, time_budget=0.01, processes=1)
+    return book.Book(path)
+
+
+def sweep(monkeypatch, opening_book, board, player, difficulty):
+    # Bốc thăm với mọi giá trị của random.randrange: đếm chính xác phân bố
+    draws = iter(range(book.SCALE))
+    monkeypatch.setattr(book.random, 'randrange', lambda stop: next(draws))
+    counts = {}
+    for _ in range(book.SCALE):
+        move, _ = opening_book.sample(board, player, difficulty)
+        counts[move] = counts.get(move, 0) + 1
+    return counts
+
+
+def transformed(board, perm):
+    return [board[i] for i in perm]
+
+
+def positions():
+    # Các thế 3x3 chưa kết thúc, mọi phép biến đổi cho ra bàn cờ khác nhau
+    for x, o, player in engine.reachable_positions():
+        board = engine.from_bitboard(x, o)
+        if len({tuple(transformed(board, perm)) for perm in engine.SYMMETRIES}) == 8:
+            yield board, player
+
+
+def test_sampled_moves_are_legal_and_follow_symmetries(opening_book):
+    perms = book.large_symmetries(3)
+    rng = random.Random(7)
+    for board, player in itertools.islice(positions(), 0, None, 40):
+        for difficulty in book.SMALL_DIFFICULTIES:
+            seed = rng.random()
+            random.seed(seed)
+            move, score = opening_book.sample(board, player, difficulty)
+            assert board[move] == ' '
+            if score is not None:
+                assert score == engine.lookup(board, player)[1]
+            # Cùng lần bốc thăm trên bàn đã biến đổi: nước đi biến đổi theo
+            for perm in perms:
+                random.seed(seed)
+                other, other_score = opening_book.sample(
+                    transformed(board, perm), player, difficulty)
+                assert perm[other] == move and other_score == score
+
+
+@pytest.mark.parametrize('difficulty', book.SMALL_DIFFICULTIES)
+def test_distribution_of_imperfect_moves(monkeypatch, opening_book, difficulty):
+    board = [' '] * 9
+    best = engine.lookup(board, 'X')[0]
+    assert best != HUMAN_CELL
+    counts = sweep(monkeypatch, opening_book, board, 'X', difficulty)
+    rate = RATES[difficulty]
+    assert set(counts) == set(range(9))
+    assert abs(counts[best] - book.SCALE * (1 - rate)) <= 2
+    # Phần còn lại chia theo 1 + số lần người chơi đã đi ô đó (ba ván ở HUMAN_CELL)
+    others = 8 + 3
+    assert abs(counts[HUMAN_CELL] - book.SCALE * rate * 4 / others) <= 2
+    for cell in set(range(9)) - {best, HUMAN_CELL}:
+        assert abs(counts[cell] - book.SCALE * rate / others) <= 2
+
+
+def test_positions_outside_the_book(opening_book):
+    won = ['X', 'X', 'X', 'O', 'O', ' ', ' ', ' ', ' ']
+    assert opening_book.sample(won, 'O', 'hard') is None
+    assert opening_book.sample([' '] * 9, 'X', 'easy') is None
+    empty = [' '] * 25
+    move, _ = opening_book.opening(empty, 'X', 4)
+    assert empty[move] == ' '
+    one = list(empty)
+    one[7] = 'X'
+    move, _ = opening_book.opening(one, 'O', 4)
+    assert one[move] == ' '
+    two = list(one)
+    two[12] = 'O'
+    assert opening_book.opening(two, 'X', 4) is None
+    assert opening_book.opening(empty, 'X', 5) is None
+    assert opening_book.opening([' '] * 225, 'X', 5) is None
+
+
+def test_missing_book_is_none(monkeypatch, workdir):
+    monkeypatch.setattr(book, 'BOOK_FILE', str(workdir / 'missing.bin'))
+    monkeypatch.setattr(book, '_book', None)
+    monkeypatch.setattr(book, '_book_pid', None)
+    assert book.get_book() is None
+    path = workdir / 'other.bin'
+    path.write_bytes(b'\0' * book.HEADER.size)
+    with pytest.raises(ValueError):
+        book.Book(str(path))
@@ -0,0 +1,101 @@
+import functools
+
+import pytest
+
+import engine
+
+
+def _won(bits):
+    return any(bits & mask == mask for mask in engine.WIN_MASKS)
+
+
+@functools.lru_cache(maxsize=None)
+def plain_minimax(ai, human, is_maximizing, easy):
+    # Minimax gốc của tictactoe.py (không cắt tỉa, không đối xứng, không bảng
+    # chuyển vị), điểm tính tương đối với nút (độ sâu 0)
+    if _won(ai):
+        return -10 if easy else 10
+    if _won(human):
+        return 10 if easy else -10
+    occupied = ai | human
+    if occupied == engine.FULL_MASK:
+        return 0
+    scores = []
+    for bit in engine.CELL_BITS:
+        if not occupied & bit:
+            if is_maximizing:
+                score = plain_minimax(ai | bit, human, False, easy)
+            else:
+                score = plain_minimax(ai, human | bit, True, easy)
+            # Thêm một nước: thắng/thua xa hơn một bậc
+            scores.append(score - 1 if score > 0 else score + 1 if score < 0 else 0)
+    return max(scores) if is_maximizing else min(scores)
+
+
+def plain_move(ai, human, worst):
+    # Như best_move_minimax() / worst_move() gốc: ô đầu tiên đạt điểm tốt nhất
+    best, move = None, -1
+    for i, bit in enumerate(engine.CELL_BITS):
+        if (ai | human) & bit:
+            continue
+        score = plain_minimax(ai | bit, human, False, worst)
+        if best is None or (score < best if worst else score > best):
+            best, move = score, i
+    return move, best
+
+
+def _sides(x, o, player):
+    return (x, o) if player == 'X' else (o, x)
+
+
+def test_table_matches_plain_minimax():
+    positions = engine.reachable_positions()
+    assert len(positions) > 4000
+    for x, o, player in positions:
+        ai, human = _sides(x, o, player)
+        for worst in (False, True):
+            assert engine.lookup_bits(x, o, player, worst) == plain_move(ai, human, worst), \
+                (engine.from_bitboard(x, o), player, worst)
+
+
+@pytest.mark.parametrize('difficulty', ['super_hard', 'easy'])
+def test_alpha_beta_matches_plain_minimax(difficulty):
+    engine.transposition_table.clear()
+    easy = difficulty == 'easy'
+    for x, o, player in engine.reachable_positions()[::7]:
+        board = engine.from_bitboard(x, o)
+        human_player = 'O' if player == 'X' else 'X'
+        ai, human = _sides(x, o, player)
+        for is_maximizing in (True, False):
+            assert engine.minimax(board, 0, is_maximizing, player, human_player,
+                                  difficulty) == plain_minimax(ai, human, is_maximizing, easy)
+
+
+def test_table_scores_are_symmetric():
+    for x, o, player in engine.reachable_positions()[::11]:
+        score = engine.lookup_bits(x, o, player)[1]
+        for m in engine.SYMMETRY_MAPS:
+            assert engine.lookup_bits(m[x], m[o], player)[1] == score
+
+
+def test_finished_positions_are_not_in_table():
+    board = ['X', 'X', 'X', 'O', 'O', ' ', ' ', ' ', ' ']
+    assert engine.lookup(board, 'O') is None
+    assert engine.lookup([' '] * 9, '?') is None
+
+
+def test_build_save_and_load_table(tmp_path):
+    table = engine.build_table()
+    path = str(tmp_path / 'table.bin')
+    engine.save_table(table, path)
+    loaded = engine.load_table(path)
+    for ai_player, field in engine._table_fields():
+        assert bytes(loaded[ai_player][field]) == bytes(table[ai_player][field])
+        assert bytes(loaded[ai_player][field]) == bytes(engine.get_table()[ai_player][field])
+
+
+def test_load_table_rejects_bad_file(tmp_path):
+    path = tmp_path / 'table.bin'
+    path.write_bytes(engine.TABLE_MAGIC + b'\0' * 10)
+    with pytest.raises(ValueError):
+        engine.load_table(str(path))
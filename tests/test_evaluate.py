@@ -0,0 +1,102 @@
+import pytest
+
+import engine
+import evaluate
+import tictactoe
+
+
+def test_parse_position_defaults():
+    board, player, difficulty, win_length = evaluate.parse_position({'board': 'X...O....'})
+    assert board == ['X', ' ', ' ', ' ', 'O', ' ', ' ', ' ', ' ']
+    assert (player, difficulty, win_length) == ('X', 'super_hard', 3)
+    board, player, _, win_length = evaluate.parse_position({'board': ['X'] + [''] * 24})
+    assert (len(board), player, win_length) == (25, 'O', 4)
+
+
+@pytest.mark.parametrize('item', [
+    'X...O....',
+    {},
+    {'board': 'X' * 8},
+    {'board': '.' * 9, 'player': 'Z'},
+    {'board': '.' * 9, 'difficulty': 'impossible'},
+    {'board': '.' * 9, 'win_length': 4},
+    {'board': '.' * 49},
+])
+def test_parse_position_rejects_bad_items(item):
+    with pytest.raises(ValueError):
+        evaluate.parse_position(item, {(3, 3), (5, 4), (15, 5)})
+
+
+def test_minimax_wrappers():
+    board = ['X', ' ', ' ', ' ', 'O', ' ', ' ', ' ', 'X']
+    assert tictactoe.best_move_minimax(board, 'O', 'X') == engine.lookup(board, 'O')[0]
+    assert tictactoe.worst_move(board, 'O', 'X') == engine.lookup(board, 'O', worst=True)[0]
+    # Bàn lớn: chặn bốn quân liên tiếp của đối thủ
+    board = [' '] * 225
+    for cell in (112, 113, 114, 115):
+        board[cell] = 'X'
+    board[111] = 'O'
+    assert tictactoe.best_move_minimax(board, 'O', 'X', 5, 0.5) == 116
+    move = tictactoe.worst_move(board, 'O', 'X', 5)
+    assert board[move] == ' ' and move != 116
+
+
+def test_batch_shares_symmetric_positions():
+    # Bốn góc là cùng một thế cờ qua phép đối xứng
+    boards = []
+    for corner in (0, 2, 6, 8):
+        board = [' '] * 9
+        board[corner] = 'X'
+        boards.append(board)
+    positions = [(board, 'O', 'super_hard', 3) for board in boards]
+    results, unique = evaluate.evaluate_batch(positions)
+    assert unique == 1
+    for board, (move, score) in zip(boards, results):
+        assert board[move] == ' '
+        assert (move, score) == evaluate.choose_move(board, 'O')
+
+
+def test_batch_splits_total_budget(monkeypatch):
+    budgets = []
+
+    def fake(args):
+        budgets.append(args[-1])
+        return 0, 0
+
+    monkeypatch.setattr(evaluate, '_evaluate_large', fake)
+    monkeypatch.setattr(evaluate, 'EVAL_WORKERS', 1)
+    positions = []
+    for cell in range(8):
+        board = [' '] * 225
+        board[cell] = 'X'
+        positions.append((board, 'O', 'hard', 5))
+    results, unique = evaluate.evaluate_batch(positions + positions[:2], time_budget=1.0,
+                                              total_budget=0.4)
+    assert (len(results), unique) == (10, 8)
+    assert budgets == [0.05] * 8
+
+
+def test_api_requires_login_or_key(app, monkeypatch):
+    client = app.test_client()
+    body = {'positions': [{'board': 'X........'}]}
+    assert client.post('/api/evaluate', json=body).status_code == 401
+    monkeypatch.setattr(evaluate, 'API_KEYS', frozenset(['secret']))
+    assert client.post('/api/evaluate', json=body,
+                       headers={'X-API-Key': 'wrong'}).status_code == 401
+    response = client.post('/api/evaluate', json=body, headers={'X-API-Key': 'secret'})
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['unique'] == 1 and data['results'][0]['move'] != 0
+
+
+@pytest.mark.parametrize('body, status', [
+    ({}, 400),
+    ({'positions': [{'board': '.' * 49}]}, 400),
+    ({'positions': [{'board': '.' * 9}], 'time_budget': 'fast'}, 400),
+    ({'positions': [{'board': '.' * 9}] * (evaluate.MAX_BATCH + 1)}, 413),
+])
+def test_api_rejects_bad_batches(app, monkeypatch, body, status):
+    monkeypatch.setattr(evaluate, 'API_KEYS', frozenset(['secret']))
+    response = app.test_client().post('/api/evaluate', json=body,
+                                      headers={'X-API-Key': 'secret'})
+    assert response.status_code == status
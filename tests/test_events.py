@@ -0,0 +1,73 @@
+import json
+
+import events
+
+
+def parse(chunk):
+    lines = dict(line.split(': ', 1) for line in chunk.strip().split('\n'))
+    return int(lines['id']), json.loads(lines['data'])
+
+
+def test_publish_records_only_changes():
+    hub = events.EventHub()
+    hub.publish({'board': [' '] * 9, 'turn': 'X'}, 1)
+    hub.publish({'board': [' '] * 9, 'turn': 'O'}, 2)
+    # Phiên bản cũ hơn (worker khác công bố muộn) bị bỏ qua
+    hub.publish({'turn': 'X'}, 2)
+    assert hub.snapshot() == (2, {'board': [' '] * 9, 'turn': 'O'})
+    assert list(hub._events)[-1] == (1, 2, {'turn': 'O'})
+
+
+def test_stream_sends_full_state_then_changes():
+    hub = events.EventHub()
+    hub.publish({'board': [' '] * 9, 'turn': 'X'}, 1)
+    stream = hub.stream()
+    assert next(stream).startswith('retry:')
+    assert parse(next(stream)) == (1, {'board': [' '] * 9, 'turn': 'X'})
+    assert hub.subscribers == 1
+    hub.publish({'board': ['X'] + [' '] * 8, 'turn': 'O'}, 2)
+    assert parse(next(stream)) == (2, {'board': ['X'] + [' '] * 8, 'turn': 'O'})
+    hub.close()
+    assert list(stream) == []
+    assert hub.subscribers == 0
+
+
+def test_stream_resumes_from_last_event_id():
+    hub = events.EventHub()
+    for version, turn in enumerate('XOXO', 1):
+        hub.publish({'turn': turn, 'message': 'v%d' % version}, version)
+    stream = hub.stream(since=2)
+    next(stream)
+    assert parse(next(stream)) == (4, {'turn': 'O', 'message': 'v4'})
+    stream.close()
+    # Đã có phiên bản mới nhất: không gửi gì cho tới lần thay đổi sau
+    stream = hub.stream(since=4)
+    next(stream)
+    hub.close()
+    assert list(stream) == []
+
+
+def test_stream_falls_back_to_full_state_when_history_is_gone():
+    hub = events.EventHub(history=2)
+    hub.publish({'board': [' '] * 9, 'turn': 'X', 'message': 'v1'}, 1)
+    for version in range(2, 6):
+        hub.publish({'board': [' '] * 9, 'turn': 'XO'[version % 2],
+                     'message': 'v%d' % version}, version)
+    stream = hub.stream(since=1)
+    next(stream)
+    # Sự kiện sau phiên bản 1 đã bị đẩy ra: gửi cả trạng thái, kể cả board
+    assert parse(next(stream)) == (5, {'board': [' '] * 9, 'turn': 'O', 'message': 'v5'})
+    stream.close()
+    stream = hub.stream(since=3)
+    next(stream)
+    assert parse(next(stream)) == (5, {'turn': 'O', 'message': 'v5'})
+    stream.close()
+
+
+def test_stream_slots():
+    slots = events.StreamSlots(limit=2)
+    assert slots.acquire() and slots.acquire()
+    assert not slots.acquire()
+    assert (slots.active, slots.rejected) == (2, 1)
+    slots.release()
+    assert slots.acquire()
@@ -0,0 +1,101 @@
+import pytest
+
+import game_records
+import storage
+
+
+@pytest.mark.parametrize('moves, cells', [
+    ([], 9),
+    ([4], 9),
+    ([4, 0, 8, 2, 6], 9),
+    ([0, 8, 1, 7, 2, 6, 3, 5, 4], 9),
+    ([0, 14, 7], 15),
+    ([0, 24, 12, 13], 25),
+    ([224, 0, 112], 225),
+])
+def test_pack_moves_round_trip(moves, cells):
+    packed = game_records.pack_moves(moves, cells)
+    assert game_records.unpack_moves(packed, cells) == moves
+    if cells <= game_records.NIBBLE_CELLS:
+        assert len(packed) == (len(moves) + 1) // 2
+
+
+@pytest.mark.parametrize('size, symbol, first', [
+    (3, 'X', True), (3, 'O', False), (15, 'O', True), (5, 'X', False)])
+def test_flags_round_trip(size, symbol, first):
+    assert game_records.unpack_flags(game_records.pack_flags(size, symbol, first)) == \
+        (size, symbol, first)
+
+
+def test_board_round_trip():
+    board = ['X', ' ', 'O', ' ', 'X', ' ', 'O', ' ', ' ']
+    code = game_records.pack_board(board)
+    assert code == 1 + 2 * 3 ** 2 + 3 ** 4 + 2 * 3 ** 6
+    assert game_records.unpack_board(code, 9) == board
+    assert game_records.board_string(board) == 'X.O.X.O..'
+    large = [' '] * 225
+    large[224] = 'O'
+    assert game_records.unpack_board(game_records.pack_board(large), 225) == large
+
+
+def test_replay():
+    boards = list(game_records.replay([4, 0, 8], 3, 'O', False))
+    assert boards[0][4] == 'X' and boards[1][0] == 'O' and boards[2][8] == 'X'
+    assert boards[-1].count(' ') == 6
+
+
+def play_some_games():
+    storage.record_game('an', 'Thắng', difficulty='hard', moves=[4, 0, 8, 2, 6, 1, 7],
+                        symbol='X', first=True)
+    storage.record_game('an', 'Thua', difficulty='easy', moves=[112, 113, 97, 98],
+                        symbol='O', first=False, size=15)
+    storage.record_game('an', 'Hòa', difficulty='hard')
+    storage.record_match('an', 'binh', 'Hòa',
+                         {'moves': [0, 1, 2, 3, 5, 4, 6, 8, 7], 'symbol': 'X', 'first': True},
+                         {'moves': [0, 1, 2, 3, 5, 4, 6, 8, 7], 'symbol': 'O', 'first': False})
+
+
+def test_archive_matches_database(history_db, workdir):
+    play_some_games()
+    conn = storage.get_connection()
+    path = str(workdir / 'games.bin')
+    assert game_records.export(conn, path) == 5
+    fields = ('mode', 'difficulty', 'opponent', 'result', 'timestamp', 'moves',
+              'symbol', 'first')
+    with game_records.GameArchive(path) as archive:
+        assert len(archive) == 5
+        for username in ('an', 'binh'):
+            assert archive.counters(username) == storage.get_user_counters(username)
+            assert archive.history(username) == storage.get_user_history(username)
+            expected = [{field: game[field] for field in fields}
+                        for game in reversed(list(storage.iter_games(username)))]
+            assert [{field: game[field] for field in fields}
+                    for game in archive.games(username)] == expected
+        assert list(archive.games('nobody')) == []
+        assert archive.all_counters()[('an', 'ai', 'hard')] == [1, 0, 1]
+
+
+def test_archive_rejects_other_files(workdir):
+    path = workdir / 'games.bin'
+    path.write_bytes(b'\0' * 64)
+    with pytest.raises(ValueError):
+        game_records.GameArchive(str(path))
+
+
+@pytest.mark.parametrize('column, value', [
+    ('result', 'Bỏ cuộc'), ('mode', 'player'), ('difficulty', 'medium')])
+def test_export_rejects_unknown_values(history_db, workdir, column, value):
+    play_some_games()
+    conn = storage.get_connection()
+    path = str(workdir / 'games.bin')
+    assert game_records.export(conn, path) == 5
+    before = (workdir / 'games.bin').read_bytes()
+    # Giá trị lạ không được âm thầm ghi thành mã 0 (kết quả lạ thành 'Thắng')
+    row = {'username': 'an', 'mode': 'ai', 'difficulty': 'hard', 'result': 'Thua'}
+    row[column] = value
+    conn.execute('INSERT INTO games (username, mode, difficulty, result) VALUES (?, ?, ?, ?)',
+                 (row['username'], row['mode'], row['difficulty'], row['result']))
+    with pytest.raises(ValueError, match=column):
+        game_records.export(conn, path)
+    assert (workdir / 'games.bin').read_bytes() == before
+    assert not (workdir / 'games.bin.tmp').exists()
@@ -0,0 +1,80 @@
+import time
+
+import pytest
+
+import gomoku
+
+
+def board_with(size, cells):
+    board = [' '] * (size * size)
+    for cell, symbol in cells.items():
+        board[cell] = symbol
+    return board
+
+
+@pytest.mark.parametrize('cells', [
+    (0, 1, 2, 3),  # hàng
+    (1, 6, 11, 16),  # cột
+    (0, 6, 12, 18),  # đường chéo
+    (4, 8, 12, 16),  # đường chéo ngược
+])
+def test_check_winner(cells):
+    board = board_with(5, {cell: 'X' for cell in cells})
+    assert gomoku.check_winner(board, 'X', 4)
+    assert not gomoku.check_winner(board, 'O', 4)
+    assert not gomoku.check_winner(board, 'X', 5)
+
+
+def test_board_size_rejects_non_square():
+    with pytest.raises(ValueError):
+        gomoku.board_size([' '] * 10)
+
+
+def test_takes_immediate_win():
+    # Máy (O) có bốn quân liên tiếp trên bàn 15x15, một đầu bị chặn
+    board = board_with(15, {111: 'X', 112: 'O', 113: 'O', 114: 'O', 115: 'O',
+                            97: 'X', 98: 'X', 99: 'X', 127: 'X'})
+    assert gomoku.best_move(board, 'O', 5, time_budget=1.0) == 116
+
+
+def test_blocks_four():
+    # Bốn quân X, đầu trái đã bị chặn: chỉ còn ô 114
+    board = board_with(15, {110: 'X', 111: 'X', 112: 'X', 113: 'X', 109: 'O', 96: 'O'})
+    assert gomoku.best_move(board, 'O', 5, time_budget=1.0) == 114
+
+
+def test_worst_move_avoids_winning():
+    board = board_with(5, {0: 'O', 1: 'O', 2: 'O', 10: 'X', 11: 'X'})
+    move = gomoku.worst_move(board, 'O', 4)
+    board[move] = 'O'
+    assert not gomoku.check_winner(board, 'O', 4)
+
+
+def test_search_respects_deadline():
+    board = board_with(15, {112: 'X', 113: 'O', 97: 'X'})
+    geometry = gomoku.get_geometry(15, 5)
+    searcher = gomoku.Searcher(board, 'O', geometry, time_budget=0.05, max_depth=20)
+    started = time.perf_counter()
+    move, _, depth, _ = searcher.search()
+    assert time.perf_counter() - started < 0.5
+    assert board[move] == ' '
+    assert depth < 20
+
+
+def test_should_stop_keeps_last_completed_depth():
+    board = board_with(15, {112: 'X', 113: 'O'})
+    geometry = gomoku.get_geometry(15, 5)
+    depths = []
+    searcher = gomoku.Searcher(board, 'O', geometry, time_budget=10,
+                               on_depth=lambda move, score, depth: depths.append((depth, move)),
+                               should_stop=lambda: len(depths) >= 2)
+    move, _, depth, _ = searcher.search()
+    assert depth == 2
+    assert depths[-1] == (2, move)
+
+
+def test_geometry_cache_is_bounded():
+    for size in range(4, 4 + gomoku.MAX_GEOMETRIES + 4):
+        gomoku.get_geometry(size, 3)
+    assert len(gomoku._geometries) <= gomoku.MAX_GEOMETRIES
+    assert gomoku.get_geometry(15, 5) is gomoku.get_geometry(15, 5)
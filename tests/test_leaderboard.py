@@ -0,0 +1,101 @@
+import random
+
+import leaderboard
+import storage
+
+RESULTS = ('Thắng', 'Thua', 'Hòa')
+USERS = ['u%02d' % i for i in range(30)]
+
+
+def brute_rank(scores, username):
+    # 1 + số người có điểm cao hơn
+    return 1 + sum(1 for score in scores.values() if score > scores[username])
+
+
+def counter_scores(conn, board):
+    mode, _, difficulty = board.partition(':')
+    return {username: leaderboard.points(wins, losses, draws)
+            for username, wins, losses, draws in conn.execute(
+                'SELECT username, wins, losses, draws FROM counters '
+                'WHERE mode = ? AND difficulty = ?', (mode, difficulty))}
+
+
+def rating_scores(conn):
+    return {username: round(rating)
+            for username, rating in conn.execute('SELECT username, rating FROM ratings')}
+
+
+def tree_rows(conn):
+    return sorted(conn.execute('SELECT board, node, users FROM rank_tree WHERE users != 0'))
+
+
+def play_random(rng, games):
+    for _ in range(games):
+        if rng.random() < 0.5:
+            storage.record_game(rng.choice(USERS), rng.choice(RESULTS),
+                                difficulty=rng.choice(('hard', 'easy')))
+        else:
+            username, opponent = rng.sample(USERS, 2)
+            storage.record_match(username, opponent, rng.choice(RESULTS))
+
+
+def test_ranks_match_brute_force(history_db):
+    play_random(random.Random(1), 300)
+    conn = storage.get_connection()
+    boards = {'ai:hard': counter_scores(conn, 'ai:hard'),
+              'ai:easy': counter_scores(conn, 'ai:easy'),
+              leaderboard.PVP_BOARD: counter_scores(conn, leaderboard.PVP_BOARD),
+              leaderboard.ELO_BOARD: rating_scores(conn)}
+    for board, scores in boards.items():
+        assert scores
+        for username in USERS:
+            rank, score, size = storage.get_user_rank(username, board)
+            assert size == len(scores)
+            if username in scores:
+                assert (rank, score) == (brute_rank(scores, username), scores[username])
+            else:
+                assert (rank, score) == (None, None)
+
+
+def test_incremental_tree_matches_rebuild(history_db):
+    play_random(random.Random(2), 200)
+    conn = storage.get_connection()
+    incremental = tree_rows(conn)
+    with storage._Transaction(conn):
+        leaderboard.rebuild(conn)
+    assert tree_rows(conn) == incremental
+
+
+def test_top_shares_ranks_on_ties(history_db):
+    for username, wins in (('an', 3), ('binh', 1), ('chi', 3), ('dung', 2)):
+        for _ in range(wins):
+            storage.record_game(username, 'Thắng', difficulty='hard')
+    top = storage.get_leaderboard('ai:hard')
+    assert [(entry['username'], entry['rank'], entry['score']) for entry in top] == [
+        ('an', 1, 6), ('chi', 1, 6), ('dung', 3, 4), ('binh', 4, 2)]
+    assert len(storage.get_leaderboard('ai:hard', limit=2)) == 2
+    assert storage.get_leaderboard('ai:easy') == []
+
+
+def test_elo_updates_are_zero_sum(history_db):
+    storage.record_match('an', 'binh', 'Thắng')
+    storage.record_match('an', 'binh', 'Hòa')
+    top = storage.get_leaderboard(leaderboard.ELO_BOARD)
+    assert [entry['username'] for entry in top] == ['an', 'binh']
+    assert [entry['games'] for entry in top] == [2, 2]
+    assert top[0]['score'] + top[1]['score'] == 2 * leaderboard.INITIAL_RATING
+
+
+def test_page_cache_rebuilds_after_ttl():
+    builds = []
+
+    def build():
+        builds.append(1)
+        return len(builds)
+
+    cache = leaderboard.PageCache(ttl=60)
+    assert cache.get('page', build) == 1
+    assert cache.get('page', build) == 1
+    cache = leaderboard.PageCache(ttl=0)
+    assert cache.get('page', build) == 2
+    assert cache.get('page', build) == 3
@@ -0,0 +1,49 @@
+import threading
+import time
+
+import ai_worker
+import loadtest
+import tictactoe
+
+SCENARIO = dict(loadtest.DEFAULTS, name='smoke', ai_players=2, pvp_pairs=2, spectators=1,
+                games=1, duration=60, threads=4, poll_interval=0.01)
+
+
+def run(scenario, prefix='t_'):
+    # Người dùng giả lập gọi app trong tiến trình qua test client của Flask
+    slots = threading.BoundedSemaphore(scenario['threads'])
+    users = loadtest.make_users(
+        scenario, prefix, range(scenario['ai_players']), range(scenario['pvp_pairs']),
+        lambda: loadtest.TestClientTransport(tictactoe.app, slots),
+        time.monotonic() + scenario['duration'])
+    return loadtest.merge([loadtest.run_users(users)])
+
+
+def test_smoke_run_has_no_stuck_pairs(app):
+    report = run(SCENARIO)
+    assert report['stuck_pairs'] == 0
+    assert report['errors'] == 0, report['error_counts']
+    assert report['ai_games'] == SCENARIO['ai_players']
+    assert report['pvp_games'] == SCENARIO['pvp_pairs']
+    for route in ('/login', '/', '/move', '/room/<room_id>', '/logout'):
+        assert report['routes'][route]['count'] > 0
+
+
+def test_ai_player_retries_a_full_queue(app, monkeypatch):
+    # Hai lần gửi đầu bị từ chối: người chơi hỏi /ai_job tới khi máy đánh
+    monkeypatch.setattr(loadtest, 'AI_RETRY_DELAY', 0.01)
+    rejected = []
+    submit = tictactoe.ai_pool.submit
+
+    def limited(*args, **kwargs):
+        if len(rejected) < 2:
+            rejected.append(True)
+            raise ai_worker.QueueFull()
+        return submit(*args, **kwargs)
+
+    monkeypatch.setattr(tictactoe.ai_pool, 'submit', limited)
+    scenario = dict(SCENARIO, ai_players=1, pvp_pairs=0, difficulties=['super_hard'])
+    report = run(scenario)
+    assert len(rejected) == 2
+    assert report['ai_games'] == 1 and report['errors'] == 0
+    assert report['routes']['/ai_job']['count'] >= 2
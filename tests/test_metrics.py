@@ -0,0 +1,103 @@
+import re
+import time
+
+import pytest
+
+import metrics
+
+SAMPLE = re.compile(r'^[a-z_]+(\{[a-z_]+="(?:[^"\\]|\\.)*"(,[a-z_]+="(?:[^"\\]|\\.)*")*\})? \S+$')
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    # Bộ số liệu riêng cho test, bật đo đạc
+    monkeypatch.setattr(metrics, '_registry', [])
+    monkeypatch.setattr(metrics, 'ENABLED', True)
+    return metrics._registry
+
+
+def samples(text):
+    lines = text.splitlines()
+    for line in lines:
+        assert line.startswith('# HELP ') or line.startswith('# TYPE ') or SAMPLE.match(line), line
+    return dict(line.rsplit(' ', 1) for line in lines if not line.startswith('#'))
+
+
+def test_counter_and_gauge_render(registry):
+    counter = metrics.Counter('test_total', 'Đếm thử.')
+    counter.inc(result='hit')
+    counter.inc(2, result='hit')
+    counter.inc(result='mi"ss')
+    metrics.Gauge('test_rooms', 'Số phòng.', lambda: 3)
+    metrics.Gauge('test_cache', 'Theo nhãn.', lambda: {(('result', 'hit'),): 5})
+    text = metrics.render()
+    assert text.endswith('\n')
+    assert '# TYPE test_total counter' in text and '# TYPE test_rooms gauge' in text
+    assert samples(text) == {
+        'test_total{result="hit"}': '3',
+        'test_total{result="mi\\"ss"}': '1',
+        'test_rooms': '3',
+        'test_cache{result="hit"}': '5',
+    }
+
+
+def test_histogram_buckets_are_cumulative(registry):
+    histogram = metrics.Histogram('test_seconds', 'Thời gian thử.', (0.1, 1))
+    values = (0.05, 0.1, 0.5, 2, 3)
+    for value in values:
+        histogram.observe(value, route='/')
+    with histogram.time(route='/x'):
+        pass
+    found = samples(metrics.render())
+    assert found['test_seconds_bucket{route="/",le="0.1"}'] == '2'
+    assert found['test_seconds_bucket{route="/",le="1"}'] == '3'
+    assert found['test_seconds_bucket{route="/",le="+Inf"}'] == '5'
+    assert found['test_seconds_count{route="/"}'] == '5'
+    assert float(found['test_seconds_sum{route="/"}']) == pytest.approx(sum(values))
+    assert found['test_seconds_count{route="/x"}'] == '1'
+
+
+def test_disabled_metrics_record_nothing(registry, monkeypatch):
+    monkeypatch.setattr(metrics, 'ENABLED', False)
+    counter = metrics.Counter('test_total', 'Đếm thử.')
+    histogram = metrics.Histogram('test_seconds', 'Thời gian thử.')
+    counter.inc()
+    histogram.observe(1)
+    assert samples(metrics.render()) == {}
+
+
+def test_metrics_endpoint_needs_metrics_enabled(app, monkeypatch):
+    client = app.test_client()
+    monkeypatch.setattr(metrics, 'ENABLED', False)
+    assert client.get('/metrics').status_code == 404
+    monkeypatch.setattr(metrics, 'ENABLED', True)
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+    found = samples(response.get_data(as_text=True))
+    assert found['tictactoe_rooms'] == '0'
+
+
+def busy(seconds):
+    until = time.perf_counter() + seconds
+    while time.perf_counter() < until:
+        pass
+
+
+def test_profiler_writes_only_slow_requests(workdir):
+    profiler = metrics.SlowRequestProfiler(threshold_ms=20, directory=str(workdir / 'profiles'),
+                                           interval=0.001)
+    profiler.start()
+    assert profiler.stop('/fast', 0.001) is None
+    profiler.start()
+    started = time.perf_counter()
+    busy(0.1)
+    path = profiler.stop('/room/<room_id>', time.perf_counter() - started)
+    assert path is not None and '-room__room_id-' in path
+    with open(path) as f:
+        lines = f.read().splitlines()
+    assert lines
+    stacks = dict(line.rsplit(' ', 1) for line in lines)
+    assert any(stack.endswith('test_metrics.py:busy') for stack in stacks)
+    assert all(int(count) > 0 for count in stacks.values())
+    assert len(list((workdir / 'profiles').iterdir())) == 1
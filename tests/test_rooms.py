@@ -0,0 +1,264 @@
+import threading
+import time
+
+import pytest
+
+import rooms
+import state_store
+
+
+def waiting_state(username, size=3, win_length=3):
+    game = rooms.new_game_state(size, win_length)
+    rooms.enter_room(game, username)
+    return game
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def store(request, workdir):
+    if request.param == 'memory':
+        return state_store.MemoryStateStore()
+    store = state_store.SQLiteStateStore(str(workdir / 'game_state.db'))
+    # Tạo tệp trước khi nhiều luồng cùng mở (chuyển sang WAL cần khóa ghi)
+    store.count_rooms()
+    return store
+
+
+def test_compare_and_set(store):
+    state = waiting_state('an')
+    assert store.create_room('r1', state) == 1
+    assert store.create_room('r1', state) is None
+    state['message'] = 'một'
+    assert store.compare_and_set('r1', 1, state) == 2
+    state['message'] = 'hai'
+    # Phiên bản cũ: worker khác đã ghi trước
+    assert store.compare_and_set('r1', 1, state) is None
+    assert store.load('r1') == (2, dict(state, message='một'))
+    assert store.version('r1') == 2
+    assert store.compare_and_set('missing', 1, state) is None
+    assert store.load('missing') == (None, None)
+
+
+def test_load_returns_a_copy(store):
+    store.create_room('r1', waiting_state('an'))
+    _, game = store.load('r1')
+    game['players'].append('binh')
+    assert store.load('r1')[1]['players'] == ['an']
+
+
+def test_waiting_queue(store):
+    store.create_room('r1', waiting_state('an'))
+    store.create_room('r2', waiting_state('binh'))
+    store.create_room('r3', waiting_state('chi', 5, 4))
+    assert store.find_waiting_room(3, 3) == 'r1'
+    assert store.find_waiting_room(5, 4) == 'r3'
+    assert store.find_waiting_room(15, 5) is None
+    assert store.find_waiting_room(3, 3, older_than='r1') is None
+    assert store.find_waiting_room(3, 3, older_than='r2') == 'r1'
+    version, game = store.load('r1')
+    rooms.enter_room(game, 'dung')
+    store.compare_and_set('r1', version, game)
+    assert store.find_waiting_room(3, 3) == 'r2'
+    store.delete_room('r2')
+    assert store.find_waiting_room(3, 3) is None
+
+
+def test_user_rooms_and_spectators(store):
+    store.create_room('r1', waiting_state('an'))
+    store.set_user_room('an', 'r1')
+    store.set_user_room('an', 'r2')
+    store.clear_user_room('an', 'r1')
+    assert store.get_user_room('an') == 'r2'
+    store.clear_user_room('an')
+    assert store.get_user_room('an') is None
+    store.add_spectator('r1', 'binh')
+    store.add_spectator('r1', 'binh')
+    store.add_spectator('missing', 'chi')
+    assert store.spectators('r1') == ['binh']
+    assert store.count_spectators('missing') == 0
+    store.delete_room('r1')
+    assert store.count_spectators('r1') == 0
+    assert store.count_rooms() == 0
+
+
+def test_idle_rooms_and_touch(store, monkeypatch):
+    store.create_room('r1', waiting_state('an'))
+    assert store.idle_rooms(60) == []
+    later = time.time() + 100
+    monkeypatch.setattr(state_store.time, 'time', lambda: later)
+    assert store.idle_rooms(60) == ['r1']
+    store.touch('r1')
+    assert store.idle_rooms(60) == []
+
+
+def test_sqlite_transaction_rolls_back(workdir):
+    store = state_store.SQLiteStateStore(str(workdir / 'game_state.db'))
+    with pytest.raises(RuntimeError):
+        with store.transaction():
+            store.create_room('r1', waiting_state('an'))
+            with store.transaction():
+                store.set_user_room('an', 'r1')
+            raise RuntimeError()
+    assert store.load('r1') == (None, None)
+    assert store.get_user_room('an') is None
+    with store.transaction():
+        with store.transaction():
+            store.create_room('r1', waiting_state('an'))
+    assert store.version('r1') == 1
+
+
+def test_matchmake_pairs_players_by_board(store):
+    manager = rooms.RoomManager(store)
+    room_a, _ = manager.matchmake('an')
+    room_c, _ = manager.matchmake('chi', 5, 4)
+    room_b, message = manager.matchmake('binh')
+    assert room_b.id == room_a.id != room_c.id
+    assert message is not None
+    assert list(room_a.view()[1]['players']) == ['an', 'binh']
+    assert manager.room_of('binh') is room_b
+    # Gọi lại khi đã ở trong phòng đủ người: giữ nguyên phòng
+    assert manager.matchmake('an')[0].id == room_a.id
+    assert len(manager) == 2
+
+
+def test_concurrent_matchmaking_never_splits_pairs(store):
+    manager = rooms.RoomManager(store)
+    names = ['p%d' % i for i in range(40)]
+    barrier = threading.Barrier(len(names))
+    results = {}
+
+    def player(name):
+        barrier.wait()
+        results[name] = manager.matchmake(name)[0].id
+
+    threads = [threading.Thread(target=player, args=(name,)) for name in names]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(manager) == 20
+    for room_id in set(results.values()):
+        players = store.load(room_id)[1]['players']
+        assert len(players) == 2
+        assert all(results[name] == room_id for name in players)
+
+
+def test_rematch_moves_to_older_waiting_room(store):
+    manager = rooms.RoomManager(store)
+    older, _ = manager.matchmake('an')
+    # Phòng chờ thứ hai, như khi hai worker cùng tạo phòng
+    store.create_room('newer', waiting_state('binh'))
+    store.set_user_room('binh', 'newer')
+    newer = manager.get('newer')
+    assert manager.rematch('an', older) is None
+    moved = manager.rematch('binh', newer)
+    assert moved.id == older.id
+    assert list(moved.view()[1]['players']) == ['an', 'binh']
+    assert store.load('newer') == (None, None)
+    assert newer.closed
+    assert manager.get('newer') is None
+
+
+def test_join_and_leave(store):
+    manager = rooms.RoomManager(store)
+    room, _ = manager.matchmake('an')
+    assert manager.join('binh', room.id)[1] is not None
+    assert manager.join('binh', room.id) == (room, None)
+    assert manager.join('chi', room.id)[1] == rooms.SPECTATOR_MESSAGE
+    assert store.spectators(room.id) == ['chi']
+    assert manager.join('dung', 'missing') == (None, None)
+    manager.leave('chi')
+    assert store.spectators(room.id) == []
+    manager.leave('an')
+    _, game = room.view()
+    assert game['players'] == ('binh',)
+    assert game['game_over']
+    manager.leave('binh')
+    assert room.view() == (None, None)
+    assert room.closed
+    assert store.get_user_room('binh') is None
+    assert len(manager) == 0
+
+
+def test_join_other_room_leaves_previous(store):
+    manager = rooms.RoomManager(store)
+    first, _ = manager.matchmake('an')
+    second, _ = manager.matchmake('binh', 5, 4)
+    manager.join('an', second.id)
+    assert store.load(first.id) == (None, None)
+    assert list(second.view()[1]['players']) == ['binh', 'an']
+    assert manager.room_of('an') is second
+
+
+def test_update_retries_after_cas_conflict(store):
+    # Hai worker (hai RoomManager) cùng ghi một phòng
+    worker_a = rooms.RoomManager(store)
+    worker_b = rooms.RoomManager(store)
+    room_a, _ = worker_a.matchmake('an')
+    room_b = worker_b.get(room_a.id)
+    calls = []
+
+    def mark(game):
+        calls.append(1)
+        if len(calls) == 1:
+            room_b.update(lambda other: other.update(message='từ worker b'))
+        game['ready']['an'] = True
+
+    game, _ = room_a.update(mark)
+    assert len(calls) == 2
+    assert game['message'] == 'từ worker b' and game['ready'] == {'an': True}
+    version, snapshot = room_a.view()
+    assert version == store.version(room_a.id)
+    assert snapshot['message'] == 'từ worker b'
+
+
+def test_view_follows_other_workers(store):
+    worker_a = rooms.RoomManager(store)
+    worker_b = rooms.RoomManager(store)
+    room_a, _ = worker_a.matchmake('an')
+    version, _ = room_a.view()
+    worker_b.join('binh', room_a.id)
+    new_version, game = room_a.view()
+    assert new_version > version
+    assert game['players'] == ('an', 'binh')
+    # Ảnh chụp chỉ đọc
+    with pytest.raises(TypeError):
+        game['board'] = []
+
+
+def test_deleted_room_closes_streams(store):
+    worker_a = rooms.RoomManager(store)
+    worker_b = rooms.RoomManager(store)
+    room, _ = worker_a.matchmake('an')
+    stream = room.events.stream(since=room.events.version)
+    next(stream)
+    assert room.events.subscribers == 1
+    worker_b.leave('an')
+    room.poll()
+    assert room.closed
+    assert list(stream) == []
+    assert room.events.subscribers == 0
+
+
+def test_cleanup_keeps_rooms_with_streams(store):
+    manager = rooms.RoomManager(store, idle_seconds=-1)
+    idle, _ = manager.matchmake('an')
+    watched, _ = manager.matchmake('binh', 5, 4)
+    stream = watched.events.stream()
+    next(stream)
+    manager.cleanup()
+    assert store.load(idle.id) == (None, None)
+    assert idle.closed
+    assert store.get_user_room('an') is None
+    assert store.version(watched.id) is not None
+    stream.close()
+    manager.cleanup()
+    assert len(manager) == 0
+
+
+def test_shared_store_is_the_default(monkeypatch, workdir):
+    # Nhiều worker gunicorn phải thấy cùng một phòng
+    monkeypatch.setattr(state_store, 'GAME_STATE_DB', str(workdir / 'game_state.db'))
+    assert isinstance(state_store.create_store(), state_store.SQLiteStateStore)
+    assert isinstance(state_store.create_store('memory'), state_store.MemoryStateStore)
+    with pytest.raises(ValueError):
+        state_store.create_store('redis')
@@ -0,0 +1,38 @@
+import json
+
+import selfplay
+
+GAMES = 4
+
+
+def test_smoke_run_counts_every_game():
+    report = selfplay.run(selfplay.PLAYERS, GAMES, processes=2, seed=3)
+    players = selfplay.PLAYERS
+    pairings = len(players) * (len(players) + 1) // 2
+    assert report['games'] == pairings * GAMES
+    matrix = report['matrix']
+    for a in players:
+        for b in players:
+            assert sum(matrix[a][b].values()) == GAMES
+            if a != b:
+                assert matrix[a][b]['win'] == matrix[b][a]['loss']
+                assert matrix[a][b]['draw'] == matrix[b][a]['draw']
+    # Bàn 3x3 được giải trọn vẹn: super_hard không bao giờ thua
+    assert report['super_hard_losses'] == 0
+    assert all(matrix['super_hard'][b]['loss'] == 0 for b in players)
+    assert matrix['super_hard']['super_hard'] == {'win': 0, 'draw': GAMES, 'loss': 0}
+    assert report['moves'] == sum(report['latency'][p]['count'] for p in players)
+
+
+def test_chunks_are_reproducible():
+    task = next(selfplay._tasks([('easy', 'random')], GAMES, 7, 3, 3, 0.05))
+    assert selfplay.run_chunk(task)[:5] == selfplay.run_chunk(task)[:5]
+
+
+def test_main_writes_the_report(workdir):
+    path = workdir / 'selfplay.json'
+    code = selfplay.main(['--games', '2', '--players', 'super_hard,random',
+                          '--processes', '1', '--output', str(path)])
+    assert code == 0
+    report = json.loads(path.read_text(encoding='utf-8'))
+    assert report['games'] == 6 and report['super_hard_losses'] == 0
@@ -0,0 +1,153 @@
+import json
+import time
+
+import pytest
+from flask import Flask, session
+
+import sessions
+
+
+def ai_session(board, moves, **extra):
+    data = {'username': 'an', 'mode': 'ai', 'difficulty': 'hard', 'board': board,
+            'player_symbol': 'X', 'ai_symbol': 'O', 'turn': 'O', 'game_over': False,
+            'moves': moves, 'message': 'Bạn đi trước.'}
+    data.update(extra)
+    return data
+
+
+@pytest.mark.parametrize('data', [
+    ai_session(['X', ' ', 'O', ' ', 'X', ' ', ' ', ' ', ' '], [0, 2, 4]),
+    ai_session(['O', 'X'] + [' '] * 223, [1, 0], player_symbol='O', ai_symbol='X',
+               turn='X', game_over=True, message='Bạn đã thua!'),
+    ai_session([' '] * 9, [], message='Thông báo khác'),
+    # Không gói được (thiếu ai_symbol): giữ nguyên dạng dict
+    {'username': 'an', 'board': [' '] * 9, 'player_symbol': 'X', 'turn': 'X'},
+    {'username': 'an', 'mode': 'player', 'board_size': 5},
+    {},
+])
+def test_encode_round_trip(data):
+    assert sessions.decode(sessions.encode(data)) == data
+
+
+def test_encoding_is_compact():
+    data = ai_session(['X', 'O', 'X', ' ', 'O', ' ', ' ', ' ', ' '], [0, 1, 2, 4])
+    packed = sessions.encode(data)
+    assert len(packed) < len(json.dumps(data).encode('utf-8')) / 2
+    assert b'board' not in packed and 'Bạn'.encode('utf-8') not in packed
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def store(request, workdir):
+    if request.param == 'memory':
+        return sessions.MemorySessionStore()
+    return sessions.SQLiteSessionStore(str(workdir / 'sessions.db'))
+
+
+def test_store_save_load_delete(store):
+    assert store.load('a') == (None, None)
+    store.save('a', b'one', 60)
+    raw, expires = store.load('a')
+    assert raw == b'one' and expires > time.time()
+    store.save('a', b'two', 60)
+    assert store.load('a')[0] == b'two'
+    store.delete('a')
+    assert store.load('a') == (None, None)
+    assert len(store) == 0
+
+
+def test_store_expiry_and_touch(store, monkeypatch):
+    now = time.time()
+    store.save('a', b'one', 10)
+    monkeypatch.setattr(sessions.time, 'time', lambda: now + 8)
+    store.touch('a', 10)
+    monkeypatch.setattr(sessions.time, 'time', lambda: now + 15)
+    assert store.load('a')[0] == b'one'
+    monkeypatch.setattr(sessions.time, 'time', lambda: now + 30)
+    assert store.load('a') == (None, None)
+
+
+def test_memory_store_evicts_least_recently_used():
+    store = sessions.MemorySessionStore(max_sessions=2)
+    store.save('a', b'1', 60)
+    store.save('b', b'2', 60)
+    store.touch('a', 60)
+    store.save('c', b'3', 60)
+    assert store.load('b') == (None, None)
+    assert store.load('a')[0] == b'1' and store.load('c')[0] == b'3'
+
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    app.session_interface = sessions.ServerSessionInterface(sessions.MemorySessionStore())
+
+    @app.route('/login/<name>')
+    def login(name):
+        session.rotate()
+        session['username'] = name
+        return ''
+
+    @app.route('/whoami')
+    def whoami():
+        return session.get('username', '')
+
+    @app.route('/logout')
+    def logout():
+        session.clear()
+        return ''
+
+    return app
+
+
+def sid_of(client, app):
+    cookie = client.get_cookie(app.config['SESSION_COOKIE_NAME'])
+    return cookie.value if cookie is not None else None
+
+
+def test_cookie_holds_only_the_session_id(app):
+    client = app.test_client()
+    client.get('/login/an')
+    sid = sid_of(client, app)
+    assert 'an' not in sid
+    store = app.session_interface.store
+    assert sessions.decode(store.load(sid)[0]) == {'username': 'an'}
+    assert client.get('/whoami').get_data(as_text=True) == 'an'
+
+
+def test_login_rotates_session_id(app):
+    client = app.test_client()
+    client.get('/whoami')
+    client.get('/login/an')
+    first = sid_of(client, app)
+    client.get('/login/binh')
+    second = sid_of(client, app)
+    store = app.session_interface.store
+    assert first != second
+    # Mã cũ không còn dùng được, dữ liệu đi theo mã mới
+    assert store.load(first) == (None, None)
+    assert client.get('/whoami').get_data(as_text=True) == 'binh'
+    assert len(store) == 1
+
+
+def test_unknown_or_corrupt_session_starts_empty(app):
+    client = app.test_client()
+    store = app.session_interface.store
+    store.save('broken', b'{not json', 60)
+    client.set_cookie(app.config['SESSION_COOKIE_NAME'], 'broken')
+    assert client.get('/whoami').get_data(as_text=True) == ''
+    client.set_cookie(app.config['SESSION_COOKIE_NAME'], 'missing')
+    assert client.get('/whoami').get_data(as_text=True) == ''
+
+
+def test_logout_deletes_session(app):
+    client = app.test_client()
+    client.get('/login/an')
+    sid = sid_of(client, app)
+    client.get('/logout')
+    assert app.session_interface.store.load(sid) == (None, None)
+    assert sid_of(client, app) is None
+
+
+def test_create_store_rejects_unknown_kind():
+    with pytest.raises(ValueError):
+        sessions.create_store('redis')
@@ -0,0 +1,70 @@
+import time
+from concurrent.futures import Future
+
+import startup
+import tictactoe
+
+
+class FakePool:
+
+    def __init__(self, error=None):
+        self.error = error
+        self.calls = 0
+        self.futures = []
+
+    def warm_up(self):
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        self.futures = [Future(), Future()]
+        return self.futures
+
+
+def test_readyz_waits_for_warm_up(app, monkeypatch):
+    monkeypatch.setattr(tictactoe, 'startup_state', startup.Startup())
+    client = app.test_client()
+    response = client.get('/readyz')
+    assert response.status_code == 503
+    assert response.get_json()['app_ready'] is False
+    assert tictactoe.create_app() is app
+    deadline = time.time() + 30
+    while True:
+        response = client.get('/readyz')
+        if response.status_code == 200 or time.time() > deadline:
+            break
+        time.sleep(0.05)
+    data = response.get_json()
+    assert response.status_code == 200, data
+    assert data['ready'] and data['worker_ready'] and data['errors'] == {}
+    for step in ('history_db', 'engine_table', 'opening_book', 'geometries', 'templates',
+                 'app_total', 'ai_workers'):
+        assert step in data['steps']
+
+
+def test_warm_worker_warms_the_pool_once_per_process():
+    state = startup.Startup()
+    pool = FakePool()
+    state.warm_worker(pool)
+    state.warm_worker(pool)
+    assert pool.calls == 1
+    assert state.status()['worker_ready'] is False
+    for future in pool.futures:
+        future.set_result(0.1)
+    status = state.status()
+    assert status['worker_ready'] and 'ai_workers' in status['steps']
+    # Chưa làm nóng phần dùng chung: chưa sẵn sàng
+    assert status['ready'] is False
+
+
+def test_warm_worker_reports_errors():
+    state = startup.Startup()
+    state.warm_worker(FakePool(error=OSError('không tạo được tiến trình')))
+    status = state.status()
+    assert status['worker_ready'] and not status['ready']
+    assert status['errors'] == {'ai_workers': 'không tạo được tiến trình'}
+    state = startup.Startup()
+    pool = FakePool()
+    state.warm_worker(pool)
+    pool.futures[0].set_result(0.1)
+    pool.futures[1].set_exception(RuntimeError('hỏng'))
+    assert state.status()['errors'] == {'ai_workers': 'hỏng'}
@@ -0,0 +1,207 @@
+import json
+import sqlite3
+
+import pytest
+
+import leaderboard
+import storage
+
+OLD_HISTORY = {
+    # Dạng cũ: độ khó nằm ngay dưới tên người chơi
+    'an': {'hard': {'games': ['Thắng', 'Thua', 'Thắng'], 'wins': 2, 'losses': 1, 'draws': 0}},
+    # Dạng có 'mode'
+    'binh': {'mode': {
+        'ai': {'easy': {'games': ['Hòa'], 'wins': 0, 'losses': 0, 'draws': 1}},
+        'pvp': {'games': [{'opponent': 'an', 'result': 'Thắng',
+                           'timestamp': '2024-01-02 03:04:05'}],
+                'wins': 1, 'losses': 0, 'draws': 0}}}
+}
+
+
+def write_history(workdir, history=OLD_HISTORY):
+    (workdir / storage.HISTORY_FILE).write_text(json.dumps(history), encoding='utf-8')
+
+
+def test_record_game_updates_counters_and_games(history_db):
+    storage.record_game('an', 'Thắng', difficulty='hard')
+    storage.record_game('an', 'Hòa', difficulty='hard')
+    storage.record_game('an', 'Thua', difficulty='easy')
+    assert storage.get_counts('an', 'ai', 'hard') == (1, 0, 1)
+    assert storage.get_counts('an', 'ai', 'easy') == (0, 1, 0)
+    assert storage.get_counts('an', 'pvp') == (0, 0, 0)
+    history = storage.get_user_history('an')
+    assert history['ai']['hard']['games'] == ['Thắng', 'Hòa']
+    assert storage.get_user_counters('an') == {'ai': {
+        'easy': {'wins': 0, 'losses': 1, 'draws': 0},
+        'hard': {'wins': 1, 'losses': 0, 'draws': 1}}}
+
+
+def test_record_game_keeps_moves(history_db):
+    storage.record_game('an', 'Thắng', difficulty='hard', moves=[4, 0, 8, 2, 6],
+                        symbol='X', first=True)
+    storage.record_game('an', 'Thua', difficulty='hard', moves=[112, 113, 97],
+                        symbol='O', first=False, size=15)
+    storage.record_game('an', 'Hòa', difficulty='hard')
+    draw, large, small = storage.get_games_page('an')[0]
+    assert (small['moves'], small['symbol'], small['first']) == ([4, 0, 8, 2, 6], 'X', True)
+    assert (large['moves'], large['symbol'], large['first']) == ([112, 113, 97], 'O', False)
+    assert (draw['moves'], draw['symbol'], draw['first']) == (None, None, None)
+
+
+def test_record_match_updates_both_players(history_db):
+    storage.record_match('an', 'binh', 'Thắng')
+    assert storage.get_counts('an', 'pvp') == (1, 0, 0)
+    assert storage.get_counts('binh', 'pvp') == (0, 1, 0)
+    conn = storage.get_connection()
+    rating_an = leaderboard.get_rating(conn, 'an')[0]
+    rating_binh = leaderboard.get_rating(conn, 'binh')[0]
+    assert rating_an > leaderboard.INITIAL_RATING > rating_binh
+    assert rating_an + rating_binh == pytest.approx(2 * leaderboard.INITIAL_RATING)
+    game = storage.get_games_page('binh')[0][0]
+    assert (game['mode'], game['opponent'], game['result']) == ('pvp', 'an', 'Thua')
+
+
+def test_migrate_json_both_formats(history_db, workdir):
+    write_history(workdir)
+    # Kết nối đầu tiên tự chuyển history.json trong thư mục hiện tại
+    conn = storage.get_connection()
+    assert storage.get_counts('an', 'ai', 'hard') == (2, 1, 0)
+    assert storage.get_counts('binh', 'ai', 'easy') == (0, 0, 1)
+    assert storage.get_counts('binh', 'pvp') == (1, 0, 0)
+    history = storage.get_user_history('binh')
+    assert history['pvp']['games'] == [{'opponent': 'an', 'result': 'Thắng',
+                                        'timestamp': '2024-01-02 03:04:05'}]
+    assert [game['result'] for game in storage.iter_games('an')] == ['Thắng', 'Thua', 'Thắng']
+    # Thứ hạng được dựng lại sau khi chuyển
+    assert storage.get_user_rank('an', 'ai:hard', conn) == (1, 4, 1)
+    assert storage.migrate_json(storage.HISTORY_FILE, conn) is False
+    assert storage.get_counts('an', 'ai', 'hard') == (2, 1, 0)
+
+
+def test_migrate_json_invalidates_score_cache(history_db, workdir):
+    conn = storage.get_connection()
+    assert storage.score_cache.get('an', 'ai', 'hard') == (0, 0, 0)
+    write_history(workdir)
+    assert storage.migrate_json(storage.HISTORY_FILE, conn) is True
+    assert storage.score_cache.get('an', 'ai', 'hard') == (2, 1, 0)
+
+
+def test_migrate_json_ignores_broken_file(history_db, workdir):
+    (workdir / storage.HISTORY_FILE).write_text('{not json', encoding='utf-8')
+    conn = storage.get_connection()
+    assert conn.execute('SELECT COUNT(*) FROM games').fetchone()[0] == 0
+    assert conn.execute("SELECT value FROM meta WHERE key = 'migrated_json'").fetchone()
+
+
+def test_prepare_adds_moves_columns_to_old_database(history_db):
+    conn = sqlite3.connect(history_db)
+    conn.executescript("""
+        CREATE TABLE games (id INTEGER PRIMARY KEY, username TEXT NOT NULL,
+            mode TEXT NOT NULL, difficulty TEXT NOT NULL DEFAULT '', opponent TEXT,
+            result TEXT NOT NULL, timestamp TEXT);
+        CREATE TABLE counters (username TEXT NOT NULL, mode TEXT NOT NULL,
+            difficulty TEXT NOT NULL DEFAULT '', wins INTEGER NOT NULL DEFAULT 0,
+            losses INTEGER NOT NULL DEFAULT 0, draws INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (username, mode, difficulty));
+        INSERT INTO games (username, mode, difficulty, result) VALUES ('an', 'ai', 'hard', 'Thắng');
+        INSERT INTO counters VALUES ('an', 'ai', 'hard', 1, 0, 0);
+    """)
+    conn.close()
+    storage.prepare(history_db)
+    game = storage.get_games_page('an')[0][0]
+    assert game['result'] == 'Thắng' and game['moves'] is None
+    assert storage.get_user_rank('an', 'ai:hard') == (1, 2, 1)
+
+
+def record_many(count):
+    for i in range(count):
+        storage.record_game('an', ('Thắng', 'Thua', 'Hòa')[i % 3],
+                            difficulty=('hard', 'easy')[i % 2])
+
+
+def test_pagination_by_cursor(history_db):
+    record_many(25)
+    seen = []
+    before = None
+    while True:
+        games, before = storage.get_games_page('an', before=before, limit=7)
+        seen += [game['id'] for game in games]
+        if before is None:
+            break
+        assert before == games[-1]['id']
+    assert seen == sorted(seen, reverse=True)
+    assert len(seen) == len(set(seen)) == 25
+
+
+def test_pagination_by_offset_and_filters(history_db):
+    record_many(25)
+    storage.record_game('binh', 'Thắng', difficulty='hard')
+    everything = [game['id'] for game in storage.iter_games('an')]
+    page, cursor = storage.get_games_page('an', limit=10, offset=20)
+    assert [game['id'] for game in page] == everything[20:]
+    assert cursor is None
+    hard, _ = storage.get_games_page('an', mode='ai', difficulty='hard',
+                                     limit=storage.MAX_PAGE_SIZE)
+    assert len(hard) == 13
+    assert {game['difficulty'] for game in hard} == {'hard'}
+    assert storage.get_games_page('an', mode='pvp') == ([], None)
+
+
+def test_page_size_is_clamped(history_db):
+    record_many(3)
+    assert len(storage.get_games_page('an', limit=0)[0]) == 1
+    assert len(storage.get_games_page('an', limit=10 ** 6, offset=-5)[0]) == 3
+
+
+def test_iter_games_reads_in_batches(history_db, monkeypatch):
+    monkeypatch.setattr(storage, 'EXPORT_BATCH', 4)
+    record_many(10)
+    games = list(storage.iter_games('an', difficulty='hard'))
+    assert len(games) == 5
+    assert [game['id'] for game in games] == sorted((game['id'] for game in games),
+                                                    reverse=True)
+
+
+def other_worker_record(path, username, result, difficulty):
+    # Ghi như một worker khác: kết nối riêng, không đi qua score_cache của tiến trình này
+    conn = storage._open(path)
+    try:
+        with storage._Transaction(conn):
+            storage._record(conn, username, result, None, difficulty, 'ai', None)
+            storage._bump_version(conn)
+    finally:
+        conn.close()
+
+
+def test_score_cache_hits_until_a_write(history_db):
+    storage.record_game('an', 'Thắng', difficulty='hard')
+    cache = storage.score_cache
+    assert cache.get('an', 'ai', 'hard') == (1, 0, 0)
+    misses = cache.misses
+    assert cache.get('an', 'ai', 'hard') == (1, 0, 0)
+    assert cache.get('an', 'ai', 'easy') == (0, 0, 0)
+    assert cache.misses == misses
+    storage.record_game('an', 'Thua', difficulty='hard')
+    assert cache.get('an', 'ai', 'hard') == (1, 1, 0)
+    assert cache.misses == misses + 1
+
+
+def test_score_cache_sees_writes_from_other_workers(history_db):
+    cache = storage.score_cache
+    storage.record_game('binh', 'Thắng', difficulty='hard')
+    assert cache.get('an', 'ai', 'hard') == (0, 0, 0)
+    assert cache.get('binh', 'ai', 'hard') == (1, 0, 0)
+    other_worker_record(history_db, 'an', 'Thắng', 'hard')
+    assert cache.get('an', 'ai', 'hard') == (1, 0, 0)
+    # Ghi của tiến trình này ngay sau ghi của worker khác không che mất ghi đó
+    other_worker_record(history_db, 'binh', 'Hòa', 'hard')
+    storage.record_game('an', 'Thua', difficulty='hard')
+    assert cache.get('binh', 'ai', 'hard') == (1, 0, 1)
+    assert cache.get('an', 'ai', 'hard') == (1, 1, 0)
+
+
+def test_score_cache_is_bounded(history_db):
+    cache = storage.ScoreCache(max_users=2)
+    for name in ('an', 'binh', 'chi'):
+        cache.get(name)
+    assert list(cache._entries) == ['binh', 'chi']
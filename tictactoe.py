@@ -1,13 +1,31 @@
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for
-import random
+from flask import Flask, render_template, request, jsonify, session, redirect, url_for, Response, stream_with_context, g
+import csv
+import hashlib
+import hmac
+import io
 import json
-import os
-import threading
-import datetime
+import logging
+import random
+import time
+import ai_worker
+import engine
+import evaluate
+import events
+import game_records
+import gomoku
+import leaderboard
+import logs
+import metrics
+import rooms
+import sessions
+import startup
+import storage
 
 app = Flask(__name__)
 app.secret_key = 'your_secret_key'  # Bạn có thể thay đổi khóa bí mật này
 app.permanent_session_lifetime = 3600  # Thời gian sống của session
+# Session lưu phía máy chủ, cookie chỉ chứa mã session, xem sessions.py
+app.session_interface = sessions.ServerSessionInterface()
 
 # Mapping giữa giá trị difficulty và tên hiển thị
 difficulty_display = {
@@ -17,214 +35,154 @@ difficulty_display = {
     'easy': 'Dễ'
 }
 
-# Biến toàn cục để quản lý phòng chờ và trò chơi
-waiting_room = []
-game = {
-    'players': [],
-    'ready': {},
-    'continue': {},
-    'board': [' '] * 9,
-    'turn': '',
-    'game_over': False,
-    'spectators': [],
-    'message': ''
+# Các bảng xếp hạng: (khóa, tên hiển thị), xem leaderboard.py
+leaderboard_boards = [('ai:' + difficulty, 'Máy - ' + name)
+                      for difficulty, name in difficulty_display.items()]
+leaderboard_boards += [(leaderboard.PVP_BOARD, 'Chơi với người'),
+                       (leaderboard.ELO_BOARD, 'Elo chơi với người')]
+leaderboard_names = dict(leaderboard_boards)
+# Top-K và phần HTML dùng chung của trang xếp hạng, giữ trong vài giây
+leaderboard_cache = leaderboard.PageCache()
+
+# Các kiểu bàn cờ: (kích thước, số quân liên tiếp để thắng, tên hiển thị)
+board_options = {
+    '3x3': (3, 3, 'Cổ điển 3x3'),
+    '5x5': (5, 4, '5x5 - 4 quân liên tiếp'),
+    '15x15': (15, 5, 'Caro 15x15 - 5 quân liên tiếp')
 }
+DEFAULT_BOARD = '3x3'
+AI_TIME_BUDGET = gomoku.DEFAULT_TIME_BUDGET  # Thời gian suy nghĩ cho bàn lớn
+BUSY_MESSAGE = 'Máy chủ đang bận, hãy thử lại sau.'
+ROOM_MISSING_MESSAGE = 'Phòng không tồn tại.'
+
+# Quản lý các phòng chơi với người và hàng đợi ghép cặp, xem rooms.py
+room_manager = rooms.RoomManager()
+# Nhóm tiến trình tính nước đi của máy, xem ai_worker.py
+ai_pool = ai_worker.AIPool()
+# Log không chặn theo mức (LOG_LEVEL), xem logs.py
+log = logs.get_logger()
+# Trạng thái khởi động và làm nóng, xem startup.py
+startup_state = startup.Startup()
+
+
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    if metrics.profiler is not None:
+        metrics.profiler.start()
+
+
+def record_request_time(exc):
+    started = g.pop('request_started', None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    metrics.request_seconds.observe(elapsed, route=route, method=request.method)
+    if metrics.profiler is not None:
+        path = metrics.profiler.stop(route, elapsed)
+        if path is not None:
+            log.warning('Request chậm %s %.0f ms, profile: %s', route, elapsed * 1000, path)
+
+
+# Chỉ gắn hook đo thời gian khi bật METRICS hoặc PROFILE_SLOW_MS
+if metrics.ENABLED or metrics.profiler is not None:
+    app.before_request(start_request_timer)
+    app.teardown_request(record_request_time)
+
+metrics.Gauge('tictactoe_ai_queue_pending', 'Số công việc của máy đang chờ hoặc đang chạy.',
+              lambda: ai_pool.pending())
+metrics.Gauge('tictactoe_rooms', 'Số phòng chơi với người.', lambda: len(room_manager))
+metrics.Gauge('tictactoe_sse_subscribers', 'Số kết nối SSE đang mở.',
+              lambda: room_manager.subscribers())
+metrics.Gauge('tictactoe_score_cache_requests', 'Số lần đọc tỉ số theo kết quả đệm.',
+              lambda: {(('result', 'hit'),): storage.score_cache.hits,
+                       (('result', 'miss'),): storage.score_cache.misses})
+
+
+def check_winner(board, player, win_length=3):
+    if len(board) != 9 or win_length != 3:
+        return gomoku.check_winner(board, player, win_length)
+    # So tập ô của người chơi với 8 mặt nạ đường thắng, xem engine.WIN_MASKS
+    return engine.has_won(engine.player_bits(board, player))
 
-lock = threading.Lock()  # Để đảm bảo an toàn khi truy cập vào biến toàn cục
 
+def board_full(board):
+    if len(board) != 9:
+        return ' ' not in board
+    x, o = engine.to_bitboard(board)
+    return engine.is_full(x, o)
 
-def check_winner(board, player):
-    win_conditions = [
-        [0, 1, 2], [3, 4, 5], [6, 7, 8],  # Hàng ngang
-        [0, 3, 6], [1, 4, 7], [2, 5, 8],  # Hàng dọc
-        [0, 4, 8], [2, 4, 6]              # Đường chéo
-    ]
-    for condition in win_conditions:
-        if board[condition[0]] == board[condition[1]] == board[condition[2]] == player:
-            return True
-    return False
 
+def minimax(board, depth, is_maximizing, ai_player, human_player, difficulty):
+    # Tìm kiếm alpha-beta với bảng chuyển vị, xem engine.minimax()
+    return engine.minimax(board, depth, is_maximizing, ai_player, human_player, difficulty)
 
-def board_full(board):
-    return ' ' not in board
 
+def best_move(board, ai_player, human_player, difficulty, win_length=3,
+              time_budget=AI_TIME_BUDGET):
+    # Chọn nước đi theo độ khó: bàn 3x3 tra bảng nước đi hoàn hảo, bàn lớn tìm
+    # kiếm có giới hạn thời gian, xem evaluate.choose_move()
+    return evaluate.choose_move(board, ai_player, difficulty, win_length, time_budget)[0]
 
-def minimax(board, depth, is_maximizing, ai_player, human_player, difficulty):
-    if check_winner(board, ai_player):
-        if difficulty == 'easy':
-            return -10 + depth  # AI cố gắng thua
-        else:
-            return 10 - depth
-    elif check_winner(board, human_player):
-        if difficulty == 'easy':
-            return 10 - depth  # AI cố gắng thua
-        else:
-            return depth - 10
-    elif board_full(board):
-        return 0
-
-    if is_maximizing:
-        best_score = -float('inf')
-        for i in range(9):
-            if board[i] == ' ':
-                board[i] = ai_player
-                score = minimax(board, depth + 1, False,
-                                ai_player, human_player, difficulty)
-                board[i] = ' '
-                best_score = max(score, best_score)
-        return best_score
-    else:
-        best_score = float('inf')
-        for i in range(9):
-            if board[i] == ' ':
-                board[i] = human_player
-                score = minimax(board, depth + 1, True,
-                                ai_player, human_player, difficulty)
-                board[i] = ' '
-                best_score = min(score, best_score)
-        return best_score
-
-
-def best_move(board, ai_player, human_player, difficulty):
-    if difficulty == 'super_hard':
-        # AI không thể đánh bại
-        return best_move_minimax(board, ai_player, human_player)
-    elif difficulty == 'hard':
-        # AI đánh ngẫu nhiên 10% thời gian
-        if random.random() < 0.1:
-            return random.choice([i for i in range(9) if board[i] == ' '])
-        else:
-            return best_move_minimax(board, ai_player, human_player)
-    elif difficulty == 'normal':
-        # AI đánh ngẫu nhiên 30% thời gian
-        if random.random() < 0.3:
-            return random.choice([i for i in range(9) if board[i] == ' '])
-        else:
-            return best_move_minimax(board, ai_player, human_player)
-    elif difficulty == 'easy':
-        # AI cố gắng thua
-        return worst_move(board, ai_player, human_player)
-    else:
-        # Mặc định là siêu khó
-        return best_move_minimax(board, ai_player, human_player)
-
-
-def best_move_minimax(board, ai_player, human_player):
-    best_score = -float('inf')
-    move = -1
-    for i in range(9):
-        if board[i] == ' ':
-            board[i] = ai_player
-            score = minimax(board, 0, False, ai_player,
-                            human_player, 'super_hard')
-            board[i] = ' '
-            if score > best_score:
-                best_score = score
-                move = i
-    return move
-
-
-def worst_move(board, ai_player, human_player):
-    # AI cố gắng thua
-    worst_score = float('inf')
-    move = -1
-    for i in range(9):
-        if board[i] == ' ':
-            board[i] = ai_player
-            score = minimax(board, 0, False, ai_player, human_player, 'easy')
-            board[i] = ' '
-            if score < worst_score:
-                worst_score = score
-                move = i
-    return move
-
-
-def save_history(username, result, opponent=None, difficulty=None, mode='ai'):
-    history = {}
-    if os.path.exists('history.json'):
-        with open('history.json', 'r') as f:
-            try:
-                history = json.load(f)
-            except json.decoder.JSONDecodeError:
-                history = {}
-
-    user_history = history.get(username, {})
-    mode_history = user_history.get('mode', {})
-    if mode == 'ai':
-        ai_history = mode_history.get('ai', {})
-        if difficulty not in ai_history:
-            ai_history[difficulty] = {'games': [],
-                                      'wins': 0, 'losses': 0, 'draws': 0}
-        ai_history[difficulty]['games'].append(result)
-        if result == 'Thắng':
-            ai_history[difficulty]['wins'] += 1
-        elif result == 'Thua':
-            ai_history[difficulty]['losses'] += 1
-        elif result == 'Hòa':
-            ai_history[difficulty]['draws'] += 1
-        mode_history['ai'] = ai_history
-    elif mode == 'pvp':
-        pvp_history = mode_history.get(
-            'pvp', {'games': [], 'wins': 0, 'losses': 0, 'draws': 0})
-        game_record = {
-            'opponent': opponent,
-            'result': result,
-            'timestamp': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        }
-        pvp_history['games'].append(game_record)
-        if result == 'Thắng':
-            pvp_history['wins'] += 1
-        elif result == 'Thua':
-            pvp_history['losses'] += 1
-        elif result == 'Hòa':
-            pvp_history['draws'] += 1
-        mode_history['pvp'] = pvp_history
-
-    user_history['mode'] = mode_history
-    history[username] = user_history
-
-    with open('history.json', 'w') as f:
-        json.dump(history, f)
 
+def best_move_minimax(board, ai_player, human_player, win_length=3,
+                      time_budget=AI_TIME_BUDGET):
+    # Bàn 3x3 tra bảng nước đi hoàn hảo, bàn lớn tìm kiếm có giới hạn thời
+    # gian, xem evaluate.best_move_minimax()
+    return evaluate.best_move_minimax(board, ai_player, human_player, win_length,
+                                      time_budget)[0]
 
-def get_score(username, difficulty):
-    if os.path.exists('history.json'):
-        with open('history.json', 'r') as f:
-            try:
-                history = json.load(f)
-            except json.decoder.JSONDecodeError:
-                history = {}
-        user_history = history.get(username, {})
-
-        difficulty_history = user_history.get(
-            difficulty, {'wins': 0, 'losses': 0, 'draws': 0})
-        wins = difficulty_history.get('wins', 0)
-        losses = difficulty_history.get('losses', 0)
-        draws = difficulty_history.get('draws', 0)
-        return wins, losses, draws
-    else:
-        return 0, 0, 0
 
+def worst_move(board, ai_player, human_player, win_length=3):
+    # AI cố gắng thua, xem evaluate.worst_move()
+    return evaluate.worst_move(board, ai_player, human_player, win_length)[0]
 
-def get_full_history(username):
-    if os.path.exists('history.json'):
-        with open('history.json', 'r') as f:
-            try:
-                history = json.load(f)
-            except json.decoder.JSONDecodeError:
-                history = {}
 
-        user_history = history.get(username, {}).get('mode', {})
+def save_history(username, result, opponent=None, difficulty=None, mode='ai',
+                 record=None):
+    # Thêm một dòng vào bảng games và cập nhật bộ đếm, xem storage.py.
+    # record: thứ tự nước đi của ván, xem game_record()
+    with metrics.history_seconds.time(op='record'):
+        storage.record_game(username, result, opponent=opponent,
+                            difficulty=difficulty, mode=mode, **(record or {}))
+
+
+def save_match(username, opponent, result, record=None, opponent_record=None):
+    # Ván giữa hai người: lịch sử của cả hai và Elo ghi trong một giao dịch
+    with metrics.history_seconds.time(op='record'):
+        storage.record_match(username, opponent, result, record, opponent_record)
 
-        return user_history
-    else:
-        return {}
+
+def game_record(board, moves, symbol):
+    # Thứ tự nước đi, ký hiệu của người chơi và người chơi có đi trước không
+    if moves is None:
+        # Ván bắt đầu trước khi có ghi nước đi
+        return None
+    return {'moves': moves, 'symbol': symbol, 'size': gomoku.board_size(board),
+            'first': bool(moves) and board[moves[0]] == symbol}
+
+
+def ai_game_record():
+    return game_record(session['board'], session.get('moves'), session['player_symbol'])
+
+
+def get_score(username, difficulty):
+    # Đọc từ bộ nhớ đệm, chỉ truy vấn khi cơ sở dữ liệu thay đổi
+    with metrics.history_seconds.time(op='score'):
+        return storage.score_cache.get(username, 'ai', difficulty)
+
+
+def log_score(username, difficulty):
+    # Tỉ số hiện tại, chỉ đọc khi mức DEBUG được bật
+    if log.isEnabledFor(logging.DEBUG):
+        wins, losses, draws = get_score(username, difficulty)
+        log.debug('Tỉ số hiện tại (%s): %s %d - Máy %d - Hòa %d',
+                  difficulty_display.get(difficulty, difficulty), username, wins, losses, draws)
 
 
 def initialize_history_file():
-    if not os.path.exists('history.json') or os.stat('history.json').st_size == 0:
-        with open('history.json', 'w') as f:
-            json.dump({}, f)
+    # Tạo cơ sở dữ liệu và chuyển dữ liệu cũ từ history.json (chỉ một lần)
+    storage.migrate_json(storage.HISTORY_FILE, storage.get_connection())
 
 
 @app.route('/')
@@ -240,10 +198,12 @@ def index():
         return player_game()
 
 
-def ai_game():
+def start_ai_game():
     # Khởi tạo bàn cờ và các biến trong session nếu chưa có
     if 'board' not in session or 'player_symbol' not in session or 'turn' not in session:
-        session['board'] = [' '] * 9
+        size = session.get('board_size', 3)
+        session['board'] = [' '] * (size * size)
+        session['moves'] = []
         # Ngẫu nhiên chọn ký hiệu
         symbols = ['X', 'O']
         session['player_symbol'] = random.choice(symbols)
@@ -259,6 +219,21 @@ def ai_game():
         session['message'] = message
         session['game_over'] = False  # Khởi tạo game_over là False
 
+
+def end_ai_game():
+    # Xóa ván đang chơi với máy khỏi session
+    session.pop('board', None)
+    session.pop('moves', None)
+    session.pop('player_symbol', None)
+    session.pop('ai_symbol', None)
+    session.pop('turn', None)
+    session.pop('message', None)
+    session.pop('game_over', None)
+    ai_pool.discard(session.pop('ai_job', None))
+
+
+def ai_game():
+    start_ai_game()
     board = session['board']
     message = session.get('message', '')
     # Giữ lại thông báo trong session
@@ -266,34 +241,12 @@ def ai_game():
     game_over = session.get('game_over', False)
     difficulty = session.get('difficulty', 'super_hard')
 
-    # Nếu là lượt của máy và trò chơi chưa kết thúc, máy sẽ đánh
+    # Nếu là lượt của máy và trò chơi chưa kết thúc, lấy kết quả nếu máy đã
+    # tính xong, nếu chưa thì trang sẽ hỏi lại qua /ai_job
+    ai_status = None
     if session['turn'] == session['ai_symbol'] and not game_over:
-        ai_player = session['ai_symbol']
-        human_player = session['player_symbol']
-        move = best_move(board, ai_player, human_player, difficulty)
-        if move != -1:
-            board[move] = ai_player
-            print(f"AI moved to position {move}.")
-        # Kiểm tra máy thắng
-        if check_winner(board, ai_player):
-            session['message'] = 'Bạn đã thua!'
-            session['game_over'] = True
-            print(f"Người chơi {session['username']}: Thua")
-            save_history(session['username'], difficulty, 'Thua')
-        # Kiểm tra hòa
-        elif board_full(board):
-            session['message'] = 'Hòa!'
-            session['game_over'] = True
-            print(f"Người chơi {session['username']}: Hòa")
-            save_history(session['username'], difficulty, 'Hòa')
-        else:
-            session['turn'] = session['player_symbol']
-        session['board'] = board
-
-        # In tỉ số hiện tại sau khi AI đánh
-        wins, losses, draws = get_score(session['username'], difficulty)
-        print(f"Tỉ số hiện tại ({difficulty_display.get(difficulty, difficulty)}): {
-              session['username']} {wins} - Máy {losses} - Hòa {draws}")
+        ai_status = collect_ai_move(wait=0)
+        board = session['board']
 
     # Cập nhật biến game_over
     game_over = session.get('game_over', False)
@@ -306,80 +259,219 @@ def ai_game():
     score_message = f"Tỉ số hiện tại ({difficulty_display.get(difficulty, difficulty)}): {
         session['username']} {wins} - Máy {losses} - Hòa {draws}"
 
-    return render_template('game.html', board=board, message=message, message_from_session=message_from_session, game_over=game_over, score_message=score_message, is_player_turn=is_player_turn)
+    return render_template('game.html', board=board, size=gomoku.board_size(board), message=message, message_from_session=message_from_session, game_over=game_over, score_message=score_message, is_player_turn=is_player_turn, ai_job=session.get('ai_job') if ai_status == 'pending' else None)
+
+
+def submit_ai_move():
+    # Đưa nước đi của máy vào hàng đợi; trả về 'busy' nếu hàng đợi đã đầy
+    args = (session['board'], session['ai_symbol'],
+            session.get('difficulty', 'super_hard'), session.get('win_length', 3))
+    try:
+        session['ai_job'] = ai_pool.submit(evaluate.choose_move, args, AI_TIME_BUDGET)
+    except ai_worker.QueueFull:
+        return 'busy'
+    return 'pending'
+
+
+def collect_ai_move(wait=ai_worker.POLL_WAIT):
+    # Áp dụng nước đi của máy nếu đã tính xong. Trả về 'done', 'pending'
+    # hoặc 'busy' (hàng đợi đầy, chưa gửi được công việc).
+    job_id = session.get('ai_job')
+    if job_id is None:
+        return submit_ai_move()
+    status, move = ai_pool.result(job_id, wait)
+    if status == 'pending':
+        return status
+    session.pop('ai_job', None)
+    if status == 'unknown':
+        # Công việc đã mất (worker giữ nó dừng lại, hoặc đã hết hạn): chỉ gửi
+        # lại khi bàn cờ trong session vẫn chờ nước của máy
+        if session['turn'] == session['ai_symbol'] and not session.get('game_over'):
+            return submit_ai_move()
+        return 'done'
+    # 'taken': request khác đã áp dụng kết quả và ghi lịch sử; áp dụng cùng
+    # nước đi vào session này để hai lần ghi session cho cùng một bàn cờ
+    apply_ai_move(move, record=status == 'done')
+    return 'done'
+
+
+def apply_ai_move(move, record=True):
+    board = session['board']
+    ai_player = session['ai_symbol']
+    difficulty = session.get('difficulty', 'super_hard')
+    win_length = session.get('win_length', 3)
+    if move != -1 and board[move] == ' ':
+        board[move] = ai_player
+        if 'moves' in session:
+            session['moves'].append(move)
+        log.debug('AI moved to position %d.', move)
+    # Kiểm tra máy thắng
+    if check_winner(board, ai_player, win_length):
+        session['message'] = 'Bạn đã thua!'
+        session['game_over'] = True
+        if record:
+            log.info('Người chơi %s: Thua', session['username'])
+            save_history(session['username'], 'Thua', difficulty=difficulty,
+                         record=ai_game_record())
+    # Kiểm tra hòa
+    elif board_full(board):
+        session['message'] = 'Hòa!'
+        session['game_over'] = True
+        if record:
+            log.info('Người chơi %s: Hòa', session['username'])
+            save_history(session['username'], 'Hòa', difficulty=difficulty,
+                         record=ai_game_record())
+    else:
+        session['turn'] = session['player_symbol']
+    session['board'] = board
+
+    # In tỉ số hiện tại sau khi AI đánh
+    log_score(session['username'], difficulty)
 
 
 def player_game():
-    global waiting_room, game, lock
-    with lock:
-        username = session['username']
-        message = ''
-        if username not in game['players'] and username not in game['spectators']:
-            if len(game['players']) < 2:
-                game['players'].append(username)
-                game['ready'][username] = False
-                game['continue'][username] = False
-                message = 'Bạn đã tham gia trò chơi. Hãy nhấn "Sẵn sàng" khi bạn đã sẵn sàng.'
-            else:
-                game['spectators'].append(username)
-                message = 'Bạn đang xem trò chơi.'
-        else:
-            if username in game['players']:
-                if game['game_over']:
-                    message = game['message'] + \
-                        ' Trò chơi đã kết thúc. Hãy nhấn "Tiếp tục" để chơi ván mới.'
-                elif not game['ready'].get(username):
-                    message = 'Hãy nhấn "Sẵn sàng" khi bạn đã sẵn sàng.'
-                elif not all(game['ready'].get(p, False) for p in game['players']):
-                    message = 'Chờ người chơi khác sẵn sàng.'
-                else:
-                    message = game['message']
-            else:
-                message = 'Bạn đang xem trò chơi.'
-
-        # Tính toán trạng thái sẵn sàng của tất cả người chơi
-        all_players_ready = len(game['players']) == 2 and all(
-            game['ready'].get(p, False) for p in game['players'])
-        all_players_continue = len(game['players']) == 2 and all(
-            game['continue'].get(p, False) for p in game['players'])
-
-        # Bắt đầu trò chơi khi cả hai người chơi đã sẵn sàng
-        if all_players_ready and not game['game_over'] and not game['turn']:
-            # Khởi tạo trò chơi
-            game['board'] = [' '] * 9
-            game['turn'] = random.choice(game['players'])
-            game['message'] = f"Người chơi {game['turn']} đi trước."
-            message += ' ' + game['message']
-
-        # Đặt lại trò chơi khi cả hai người chơi đã nhấn 'Tiếp tục'
-        if game['game_over'] and all_players_continue:
-            # Đặt lại trò chơi
-            game['board'] = [' '] * 9
-            game['game_over'] = False
-            game['message'] = ''
-            game['turn'] = ''
-            # Đặt lại trạng thái 'ready' và 'continue'
-            for p in game['players']:
-                game['ready'][p] = False
-                game['continue'][p] = False
-            message = 'Trò chơi đã được đặt lại. Hãy nhấn "Sẵn sàng" khi bạn đã sẵn sàng.'
+    # Ghép phòng cho người chơi rồi chuyển tới địa chỉ của phòng
+    room, _ = room_manager.matchmake(session['username'], session.get('board_size', 3),
+                                     session.get('win_length', 3))
+    return redirect(url_for('room_view', room_id=room.id))
+
+
+def room_all_players(game, flag):
+    # Cả hai người chơi đều đã bật cờ 'ready' hoặc 'continue'
+    return len(game['players']) == 2 and all(
+        game[flag].get(p, False) for p in game['players'])
+
+
+def room_pending(game):
+    # Việc cần làm với ván: 'start', 'reset' hoặc None
+    # Bắt đầu trò chơi khi cả hai người chơi đã sẵn sàng
+    if room_all_players(game, 'ready') and not game['game_over'] and not game['turn']:
+        return 'start'
+    # Đặt lại trò chơi khi cả hai người chơi đã nhấn 'Tiếp tục'
+    if game['game_over'] and room_all_players(game, 'continue'):
+        return 'reset'
+    return None
+
+
+def room_start_or_reset(game):
+    # Bắt đầu hoặc đặt lại ván khi đủ điều kiện; trả về thông báo thêm
+    action = room_pending(game)
+    if action == 'start':
+        # Khởi tạo trò chơi
+        game['board'] = [' '] * (game['size'] * game['size'])
+        game['moves'] = []
+        game['turn'] = random.choice(game['players'])
+        game['message'] = f"Người chơi {game['turn']} đi trước."
+        return 'start', game['message']
+    if action == 'reset':
+        # Đặt lại trò chơi
+        game['board'] = [' '] * (game['size'] * game['size'])
+        game['moves'] = []
+        game['game_over'] = False
+        game['message'] = ''
+        game['turn'] = ''
+        # Đặt lại trạng thái 'ready' và 'continue'
+        for p in game['players']:
+            game['ready'][p] = False
+            game['continue'][p] = False
+        return 'reset', 'Trò chơi đã được đặt lại. Hãy nhấn "Sẵn sàng" khi bạn đã sẵn sàng.'
+    return None, None
+
+
+@app.route('/room/<room_id>')
+def room_view(room_id):
+    if 'username' not in session:
+        return redirect(url_for('login'))
+    username = session['username']
+    room, join_message = room_manager.join(username, room_id)
+    if room is None:
+        # Phòng không còn tồn tại, ghép phòng mới
+        return player_game()
 
-        board = game['board']
-        game_over = game['game_over']
-        message_from_session = session.get('message', None)
-        is_player_turn = (username == game['turn'] and not game_over)
+    # Đọc ảnh chụp bất biến của phòng, không lấy khóa. Thông báo tính trên
+    # trạng thái trước khi bắt đầu/đặt lại ván.
+    version, game = room.view()
+    if game is None:
+        return player_game()
+    if len(game['players']) == 1 and username in game['players']:
+        # Đang chờ một mình: chuyển sang phòng đã chờ lâu hơn nếu có
+        moved = room_manager.rematch(username, room)
+        if moved is not None:
+            return redirect(url_for('room_view', room_id=moved.id))
+    if join_message is not None:
+        message = join_message
+    elif username in game['players']:
+        if game['game_over']:
+            message = game['message'] + \
+                ' Trò chơi đã kết thúc. Hãy nhấn "Tiếp tục" để chơi ván mới.'
+        elif not game['ready'].get(username):
+            message = 'Hãy nhấn "Sẵn sàng" khi bạn đã sẵn sàng.'
+        elif not all(game['ready'].get(p, False) for p in game['players']):
+            message = 'Chờ người chơi khác sẵn sàng.'
+        else:
+            message = game['message']
+    else:
+        message = rooms.SPECTATOR_MESSAGE
+
+    # Chỉ ghi (lấy khóa phòng) khi ván thực sự cần bắt đầu hoặc đặt lại
+    if room_pending(game) is not None:
+        updated, outcome = room.update(room_start_or_reset)
+        if updated is None:
+            return player_game()
+        action, extra = outcome
+        if action == 'start':
+            message += ' ' + extra
+        elif action == 'reset':
+            message = extra
+        version, game = room.view()
+        if game is None:
+            return player_game()
 
-    return render_template(
+    message_from_session = session.get('message', None)
+    # Trang chỉ phụ thuộc phiên bản phòng, người xem và các thông báo: không
+    # đổi thì trả 304 mà không dựng lại
+    etag = room_etag(room.id, version, username, message, message_from_session)
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+        response.set_etag(etag, weak=True)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+
+    all_players_ready = room_all_players(game, 'ready')
+    all_players_continue = room_all_players(game, 'continue')
+    board = game['board']
+    size = gomoku.board_size(board)
+    game_over = game['game_over']
+    is_player_turn = (username == game['turn'] and not game_over)
+    # Chỉ cập nhật thông báo tại chỗ khi người chơi đang trong ván
+    live_message = username in game['players'] and all_players_ready and not game_over
+
+    response = Response(render_template(
         'game_pvp.html',
+        room_id=room.id,
         board=board,
+        size=size,
         message=message,
         message_from_session=message_from_session,
         game_over=game_over,
         is_player_turn=is_player_turn,
         game=game,
         all_players_ready=all_players_ready,
-        all_players_continue=all_players_continue
-    )
+        all_players_continue=all_players_continue,
+        live_message=live_message,
+        events_version=version,
+        etag='W/"%s"' % etag
+    ))
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def room_etag(room_id, version, username, message, message_from_session):
+    digest = hashlib.blake2b(
+        json.dumps([username, message, message_from_session], ensure_ascii=False).encode('utf-8'),
+        digest_size=8).hexdigest()
+    return '%s-%d-%s' % (room_id, version, digest)
 
 
 @app.route('/move', methods=['POST'])
@@ -392,159 +484,323 @@ def move():
 
 def ai_move():
     data = request.get_json()
-    position = data['position']
+    error = play_ai_game(data['position'])
+    if error == BUSY_MESSAGE:
+        response = jsonify({'status': 'error', 'message': error})
+        response.headers['Retry-After'] = '1'
+        return response, 503
+    if error is not None:
+        return jsonify({'status': 'error', 'message': error})
+    return jsonify({'status': 'ok', 'job': session.get('ai_job')})
+
+
+def play_ai_game(position):
+    # Nước đi của người chơi trong ván với máy, gửi nước đi của máy vào hàng
+    # đợi nếu tới lượt máy. Trả về thông báo lỗi hoặc None.
     board = session.get('board', [' '] * 9)
+    win_length = session.get('win_length', 3)
     player_symbol = session['player_symbol']
     ai_symbol = session['ai_symbol']
     difficulty = session.get('difficulty', 'super_hard')
 
+    if session.get('game_over'):
+        return 'Trò chơi đã kết thúc.'
     # Kiểm tra nếu là lượt của người chơi
     if session['turn'] != player_symbol:
-        return jsonify({'status': 'error', 'message': 'Không phải lượt của bạn.'})
+        return 'Không phải lượt của bạn.'
 
     # Kiểm tra nước đi hợp lệ
     if board[position] != ' ':
-        return jsonify({'status': 'error', 'message': 'Vị trí đã được đánh.'})
+        return 'Vị trí đã được đánh.'
+
+    # Hàng đợi của máy đã đầy: từ chối trước khi nhận nước đi
+    if ai_pool.pending() >= ai_pool.queue_limit:
+        return BUSY_MESSAGE
     board[position] = player_symbol
-    print(f"Người chơi {session['username']} đã đánh vào vị trí {position}.")
+    if 'moves' in session:
+        session['moves'].append(position)
+    log.debug('Người chơi %s đã đánh vào vị trí %d.', session['username'], position)
 
     # Kiểm tra người chơi thắng
-    if check_winner(board, player_symbol):
+    if check_winner(board, player_symbol, win_length):
         session['message'] = 'Bạn đã thắng!'
         session['game_over'] = True
-        print(f"Người chơi {session['username']}: Thắng")
-        save_history(session['username'], difficulty, 'Thắng')
+        log.info('Người chơi %s: Thắng', session['username'])
+        save_history(session['username'], 'Thắng', difficulty=difficulty,
+                     record=ai_game_record())
     # Kiểm tra hòa
     elif board_full(board):
         session['message'] = 'Hòa!'
         session['game_over'] = True
-        print(f"Người chơi {session['username']}: Hòa")
-        save_history(session['username'], difficulty, 'Hòa')
+        log.info('Người chơi %s: Hòa', session['username'])
+        save_history(session['username'], 'Hòa', difficulty=difficulty,
+                     record=ai_game_record())
     else:
-        # Lượt của máy sẽ được xử lý trong index()
         session['turn'] = ai_symbol
 
     session['board'] = board
+    if session['turn'] == ai_symbol:
+        # Máy tính nước đi trong nhóm tiến trình, trình duyệt hỏi lại qua /ai_job
+        submit_ai_move()
 
     # In tỉ số hiện tại sau khi người chơi đánh
-    wins, losses, draws = get_score(session['username'], difficulty)
-    print(f"Tỉ số hiện tại ({difficulty_display.get(difficulty, difficulty)}): {
-          session['username']} {wins} - Máy {losses} - Hòa {draws}")
+    log_score(session['username'], difficulty)
+    return None
 
-    return jsonify({'status': 'ok'})
+
+@app.route('/ai_job', defaults={'job_id': None})
+@app.route('/ai_job/<job_id>')
+def ai_job_status(job_id):
+    # Trình duyệt hỏi kết quả nước đi của máy; chờ tối đa POLL_WAIT giây.
+    # Không kèm mã (hàng đợi đầy lúc trước nên chưa có công việc): gửi công
+    # việc nếu vẫn tới lượt máy. Trả về cả mã công việc hiện tại để hỏi tiếp.
+    if 'username' not in session:
+        return jsonify({'status': 'error', 'message': 'Chưa đăng nhập.'}), 401
+    current = session.get('ai_job')
+    ai_turn = (session.get('mode') == 'ai' and 'board' in session
+               and session['turn'] == session['ai_symbol'] and not session.get('game_over'))
+    if (job_id is not None and current != job_id) or (current is None and not ai_turn):
+        # Kết quả đã được áp dụng hoặc ván đã được đặt lại
+        return jsonify({'status': 'done', 'job': None})
+    status = collect_ai_move()
+    return jsonify({'status': status, 'job': session.get('ai_job')})
+
+
+def evaluate_allowed():
+    # Người đã đăng nhập, hoặc gửi khóa trong EVAL_API_KEYS qua X-API-Key
+    if 'username' in session:
+        return True
+    key = request.headers.get('X-API-Key', '')
+    return any(hmac.compare_digest(key, allowed) for allowed in evaluate.API_KEYS)
+
+
+@app.route('/api/evaluate', methods=['POST'])
+def api_evaluate():
+    # Đánh giá một lô thế cờ: {"positions": [{"board": ..., "player": "X",
+    # "difficulty": "super_hard", "win_length": 3}, ...], "time_budget": 0.05}.
+    # Chỉ nhận các kiểu bàn cờ của trò chơi (board_options).
+    if not evaluate_allowed():
+        return jsonify({'status': 'error', 'message': 'Chưa đăng nhập hoặc thiếu khóa API.'}), 401
+    data = request.get_json(silent=True) or {}
+    items = data.get('positions')
+    if not isinstance(items, list):
+        return jsonify({'status': 'error', 'message': 'Thiếu danh sách positions.'}), 400
+    if len(items) > evaluate.MAX_BATCH:
+        return jsonify({'status': 'error', 'message': 'Tối đa %d thế cờ mỗi lô.' % evaluate.MAX_BATCH}), 413
+    try:
+        boards = {(size, win_length) for size, win_length, _ in board_options.values()}
+        positions = [evaluate.parse_position(item, boards) for item in items]
+        time_budget = float(data.get('time_budget', evaluate.BATCH_TIME_BUDGET))
+    except (TypeError, ValueError) as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    time_budget = min(max(time_budget, 0), AI_TIME_BUDGET)
+    results, unique = evaluate.evaluate_batch(positions, time_budget)
+    return jsonify({
+        'status': 'ok',
+        'unique': unique,
+        'results': [{'move': move, 'score': score} for move, score in results]
+    })
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    if not metrics.ENABLED:
+        return 'Số liệu chưa được bật (METRICS=1).\n', 404, {'Content-Type': 'text/plain; charset=utf-8'}
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/readyz')
+def readiness():
+    # Sẵn sàng nhận tải khi đã làm nóng xong; kèm thời gian từng bước
+    startup_state.warm_worker(ai_pool)
+    status = startup_state.status()
+    return jsonify(status), 200 if status['ready'] else 503
+
+
+@app.route('/ai/stats')
+def ai_stats():
+    return jsonify(ai_pool.stats())
 
 
 def player_move():
-    global game, lock
     data = request.get_json()
-    position = data['position']
-    username = session['username']
+    _, error = play_room_move(session['username'], data['position'])
+    if error is not None:
+        return jsonify({'status': 'error', 'message': error})
+    return jsonify({'status': 'ok'})
+
 
-    with lock:
+def play_room_move(username, position):
+    # Nước đi trong phòng chơi với người; trả về (phòng, thông báo lỗi hoặc None)
+    room = room_manager.room_of(username)
+    if room is None:
+        return None, 'Bạn chưa ở trong phòng nào.'
+
+    def play(game):
+        # Trả về (lỗi, kết quả ván cần ghi lịch sử hoặc None)
+        if game['game_over']:
+            return 'Trò chơi đã kết thúc.', None
         # Kiểm tra nếu là lượt của người chơi
         if game['turn'] != username:
-            return jsonify({'status': 'error', 'message': 'Không phải lượt của bạn.'})
+            return 'Không phải lượt của bạn.', None
 
         board = game['board']
 
         # Kiểm tra nước đi hợp lệ
         if board[position] != ' ':
-            return jsonify({'status': 'error', 'message': 'Vị trí đã được đánh.'})
+            return 'Vị trí đã được đánh.', None
         symbol = 'X' if game['players'].index(username) == 0 else 'O'
+        other = 'O' if symbol == 'X' else 'X'
         board[position] = symbol
-        print(f"Người chơi {username} đã đánh vào vị trí {position}.")
+        moves = game.get('moves')
+        if moves is not None:
+            moves.append(position)
 
         # Kiểm tra người chơi thắng
-        if check_winner(board, symbol):
+        if check_winner(board, symbol, game['win_length']):
             game['message'] = f'Người chơi {username} đã thắng!'
             game['game_over'] = True
             opponent = game['players'][1 - game['players'].index(username)]
-            print(f"Người chơi {username}: Thắng")
             # Lưu lịch sử cho cả hai người chơi
-            save_history(username, 'Thắng', opponent=opponent, mode='pvp')
-            save_history(opponent, 'Thua', opponent=username, mode='pvp')
+            return None, (username, opponent, 'Thắng', game_record(board, moves, symbol),
+                          game_record(board, moves, other))
         # Kiểm tra hòa
-        elif board_full(board):
+        if board_full(board):
             game['message'] = 'Hòa!'
             game['game_over'] = True
             opponent = game['players'][1 - game['players'].index(username)]
-            print("Trò chơi hòa!")
             # Lưu lịch sử hòa cho cả hai người chơi
-            save_history(username, 'Hòa', opponent=opponent, mode='pvp')
-            save_history(opponent, 'Hòa', opponent=username, mode='pvp')
-        else:
-            # Chuyển lượt cho người chơi khác
-            index = game['players'].index(username)
-            game['turn'] = game['players'][1 - index]
-            game['message'] = f"Lượt của {game['turn']}."
-        game['board'] = board
-
-    return jsonify({'status': 'ok'})
+            return None, (username, opponent, 'Hòa', game_record(board, moves, symbol),
+                          game_record(board, moves, other))
+        # Chuyển lượt cho người chơi khác
+        index = game['players'].index(username)
+        game['turn'] = game['players'][1 - index]
+        game['message'] = f"Lượt của {game['turn']}."
+        return None, None
+
+    # Nước đi chỉ được ghi nếu trạng thái chưa bị worker khác đổi (compare-and-set)
+    game, outcome = room.update(play)
+    if game is None:
+        return room, ROOM_MISSING_MESSAGE
+    error, match = outcome
+    if error is not None:
+        return room, error
+    log.debug('Người chơi %s đã đánh vào vị trí %d.', username, position)
+    if match and match[2] == 'Thắng':
+        log.info('Người chơi %s: Thắng', username)
+    elif match:
+        log.info('Trò chơi hòa!')
+
+    # Ghi lịch sử ngoài compare-and-set để không ghi trùng khi phải thử lại
+    if match:
+        save_match(*match)
+    return room, None
 
 
 @app.route('/reset')
 def reset():
-    session.pop('board', None)
-    session.pop('player_symbol', None)
-    session.pop('ai_symbol', None)
-    session.pop('turn', None)
-    session.pop('message', None)
-    session.pop('game_over', None)
+    end_ai_game()
     return redirect(url_for('index'))
 
 
 @app.route('/ready', methods=['POST'])
 def player_ready():
-    global game, lock
     username = session['username']
-    with lock:
+    room = room_manager.room_of(username)
+    if room is None:
+        return redirect(url_for('index'))
+
+    def mark(game):
         if username in game['players']:
             game['ready'][username] = True
             game['message'] = f"Người chơi {username} đã sẵn sàng."
-    return redirect(url_for('index'))
+
+    room.update(mark)
+    return redirect(url_for('room_view', room_id=room.id))
 
 
 @app.route('/continue', methods=['POST'])
 def player_continue():
-    global game, lock
     username = session['username']
-    with lock:
+    room = room_manager.room_of(username)
+    if room is None:
+        return redirect(url_for('index'))
+
+    def mark(game):
         if username in game['players']:
             game['continue'][username] = True
             game['message'] = f"Người chơi {username} đã sẵn sàng tiếp tục."
-    return redirect(url_for('index'))
+
+    room.update(mark)
+    return redirect(url_for('room_view', room_id=room.id))
 
 
 @app.route('/logout')
 def logout():
-    global game, lock
     username = session.get('username')
     if username:
-        with lock:
-            if username in game['players']:
-                game['players'].remove(username)
-                game['ready'].pop(username, None)
-                game['continue'].pop(username, None)
-                # Kết thúc trò chơi nếu có người rời đi
-                game['game_over'] = True
-                game['message'] = f"Người chơi {username} đã rời trò chơi."
-                game['turn'] = ''
-            if username in game['spectators']:
-                game['spectators'].remove(username)
+        room_manager.leave(username)
     session.clear()
     return redirect(url_for('login'))
 
 
+@app.route('/room/<room_id>/events')
+def game_stream(room_id):
+    # Luồng SSE của một phòng, thay cho việc tải lại trang
+    if 'username' not in session:
+        return jsonify({'status': 'error', 'message': 'Chưa đăng nhập.'}), 401
+    room = room_manager.get(room_id)
+    if room is None:
+        return jsonify({'status': 'error', 'message': ROOM_MISSING_MESSAGE}), 404
+    # Khi trình duyệt kết nối lại, Last-Event-ID là phiên bản mới nhất nó đã
+    # nhận, còn since trong địa chỉ là phiên bản lúc dựng trang
+    since = request.headers.get('Last-Event-ID', type=int)
+    if since is None:
+        since = request.args.get('since', type=int)
+    if not events.slots.acquire():
+        # Hết chỗ cho SSE: trình duyệt chuyển sang hỏi lại trang bằng ETag
+        response = jsonify({'status': 'error', 'message': 'Quá nhiều kết nối theo dõi.'})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(events.RETRY_MS // 1000)
+        return response
+    # Khi trạng thái dùng chung giữa các worker, hỏi kho định kỳ để nhận nước
+    # đi được ghi ở worker khác
+    poll = room.poll if room_manager.shared else None
+    response = Response(room.events.stream(since, poll, room.touch),
+                        mimetype='text/event-stream')
+    response.call_on_close(events.slots.release)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@app.route('/events/stats')
+def game_stream_stats():
+    return jsonify({'rooms': len(room_manager), 'subscribers': room_manager.subscribers(),
+                    'stream_limit': events.slots.limit, 'streams_rejected': events.slots.rejected})
+
+
+def set_board_option(option):
+    if option not in board_options:
+        option = DEFAULT_BOARD
+    size, win_length, _ = board_options[option]
+    session['board_option'] = option
+    session['board_size'] = size
+    session['win_length'] = win_length
+
+
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
+        session.rotate()
         session['username'] = request.form['username']
         session['mode'] = request.form['mode']
         if session['mode'] == 'ai':
             session['difficulty'] = request.form['difficulty']
+        set_board_option(request.form.get('board', DEFAULT_BOARD))
         session.permanent = True
         return redirect(url_for('index'))
-    return render_template('login.html')
+    return render_template('login.html', board_options=board_options)
 
 
 @app.route('/change_difficulty', methods=['GET', 'POST'])
@@ -567,15 +823,21 @@ def change_mode():
         session['mode'] = request.form['mode']
         if session['mode'] == 'ai':
             session['difficulty'] = request.form['difficulty']
+        set_board_option(request.form.get('board', DEFAULT_BOARD))
         # Đặt lại các biến trò chơi
-        session.pop('board', None)
-        session.pop('player_symbol', None)
-        session.pop('ai_symbol', None)
-        session.pop('turn', None)
-        session.pop('message', None)
-        session.pop('game_over', None)
+        end_ai_game()
         return redirect(url_for('index'))
-    return render_template('change_mode.html')
+    return render_template('change_mode.html', board_options=board_options)
+
+
+def history_page_args():
+    # Tham số phân trang chung cho /history và /api/history
+    mode = request.args.get('mode') or None
+    difficulty = request.args.get('difficulty') or None
+    before = request.args.get('before', type=int)
+    limit = request.args.get('limit', storage.PAGE_SIZE, type=int)
+    offset = request.args.get('offset', 0, type=int)
+    return mode, difficulty, before, limit, offset
 
 
 @app.route('/history')
@@ -583,10 +845,365 @@ def history():
     if 'username' not in session:
         return redirect(url_for('login'))
     username = session['username']
-    user_history = get_full_history(username)
-    return render_template('history.html', username=username, history=user_history, difficulty_display=difficulty_display)
+    mode, difficulty, before, limit, offset = history_page_args()
+    with metrics.history_seconds.time(op='page'):
+        counters = storage.get_user_counters(username)
+        games, next_cursor = storage.get_games_page(
+            username, mode, difficulty, before, limit, offset)
+    return render_template('history.html', username=username, counters=counters, games=games,
+                           next_cursor=next_cursor, mode=mode, filter_difficulty=difficulty,
+                           limit=limit, difficulty_display=difficulty_display)
+
+
+@app.route('/api/history')
+def api_history():
+    if 'username' not in session:
+        return jsonify({'status': 'error', 'message': 'Chưa đăng nhập.'}), 401
+    username = session['username']
+    mode, difficulty, before, limit, offset = history_page_args()
+    with metrics.history_seconds.time(op='page'):
+        counters = storage.get_user_counters(username)
+        games, next_cursor = storage.get_games_page(
+            username, mode, difficulty, before, limit, offset)
+    return jsonify({
+        'status': 'ok',
+        'username': username,
+        'counters': counters,
+        'games': games,
+        'next_cursor': next_cursor
+    })
+
+
+def leaderboard_args():
+    # Bảng xếp hạng được chọn (mặc định theo chế độ đang chơi) và số dòng
+    board = request.args.get('board')
+    if board not in leaderboard_names:
+        if session.get('mode') == 'ai':
+            board = 'ai:' + session.get('difficulty', 'super_hard')
+        if board not in leaderboard_names:
+            board = leaderboard.ELO_BOARD
+    limit = request.args.get('limit', leaderboard.TOP_K, type=int)
+    limit = max(1, min(limit, leaderboard.MAX_TOP_K))
+    return board, limit
+
+
+def leaderboard_top(board, limit):
+    def build():
+        with metrics.history_seconds.time(op='leaderboard'):
+            return storage.get_leaderboard(board, limit)
+    return leaderboard_cache.get(('top', board, limit), build)
+
+
+@app.route('/leaderboard')
+def leaderboard_page():
+    board, limit = leaderboard_args()
+    # Bảng top-K dựng một lần cho mọi người xem; chỉ dòng "hạng của bạn" là riêng
+    table = leaderboard_cache.get(('page', board, limit), lambda: render_template(
+        'leaderboard_table.html', entries=leaderboard_top(board, limit),
+        elo=board == leaderboard.ELO_BOARD))
+    username = session.get('username')
+    rank = score = total = None
+    if username:
+        rank, score, total = storage.get_user_rank(username, board)
+    return render_template('leaderboard.html', boards=leaderboard_boards, board=board,
+                           board_name=leaderboard_names[board], table=table,
+                           username=username, rank=rank, score=score, total=total)
+
+
+@app.route('/api/leaderboard')
+def api_leaderboard():
+    board, limit = leaderboard_args()
+    response = {'status': 'ok', 'board': board, 'top': leaderboard_top(board, limit)}
+    username = session.get('username')
+    if username:
+        rank, score, total = storage.get_user_rank(username, board)
+        response['me'] = {'username': username, 'rank': rank, 'score': score, 'total': total}
+    return jsonify(response)
+
+
+@app.route('/history/export.<fmt>')
+def export_history(fmt):
+    # Xuất toàn bộ lịch sử dạng NDJSON hoặc CSV, gửi dần từng dòng
+    if 'username' not in session:
+        return redirect(url_for('login'))
+    if fmt not in ('ndjson', 'csv'):
+        return jsonify({'status': 'error', 'message': 'Định dạng không hỗ trợ.'}), 404
+    username = session['username']
+    mode = request.args.get('mode') or None
+    games = storage.iter_games(username, mode)
+
+    if fmt == 'ndjson':
+        def generate():
+            for game in games:
+                yield json.dumps(game, ensure_ascii=False) + '\n'
+        mimetype = 'application/x-ndjson'
+    else:
+        def generate():
+            buffer = io.StringIO()
+            writer = csv.DictWriter(buffer, fieldnames=storage.GAME_FIELDS)
+            writer.writeheader()
+            for game in games:
+                writer.writerow(game)
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+            yield buffer.getvalue()
+        mimetype = 'text/csv'
+
+    response = Response(stream_with_context(generate()), mimetype=mimetype)
+    response.headers['Content-Disposition'] = 'attachment; filename=history.%s' % fmt
+    return response
+
+
+# API JSON /api/v1 cho bot và ứng dụng di động: mỗi thao tác trả về ngay
+# trạng thái mới (một request cho mỗi nước đi, kể cả nước đáp của máy) thay
+# vì chuyển hướng rồi dựng lại trang. Bàn cờ là chuỗi mỗi ô một ký tự ('.'
+# là ô trống) hoặc, với ?format=int, số nguyên cơ số 3 (ô i có trọng số 3^i,
+# X = 1, O = 2). GET /api/v1/state có ETag: trạng thái không đổi thì trả 304.
+API_RESULTS = {'Bạn đã thắng!': 'Thắng', 'Bạn đã thua!': 'Thua', 'Hòa!': 'Hòa'}
+
+
+def api_error(message, status):
+    return jsonify({'status': 'error', 'message': message}), status
+
+
+def api_position(position, cells):
+    # Ô hợp lệ: số nguyên trong bàn cờ (JSON true/false không được tính là số)
+    return (isinstance(position, int) and not isinstance(position, bool)
+            and 0 <= position < cells)
+
+
+def api_board(board):
+    if request.args.get('format') == 'int':
+        return game_records.pack_board(board)
+    return game_records.board_string(board)
+
+
+def api_ai_state(ai_status=None, ai_move=None):
+    board = session['board']
+    game_over = session.get('game_over', False)
+    difficulty = session.get('difficulty', 'super_hard')
+    wins, losses, draws = get_score(session['username'], difficulty)
+    return {
+        'status': 'ok',
+        'mode': 'ai',
+        'board': api_board(board),
+        'size': gomoku.board_size(board),
+        'win_length': session.get('win_length', 3),
+        'player': session['player_symbol'],
+        'turn': session['turn'],
+        'game_over': game_over,
+        'result': API_RESULTS.get(session.get('message')) if game_over else None,
+        'message': session.get('message', ''),
+        'difficulty': difficulty,
+        'score': {'wins': wins, 'losses': losses, 'draws': draws},
+        # 'pending': máy chưa tính xong, hỏi lại GET /api/v1/state;
+        # 'busy': hàng đợi đầy, chưa gửi được nước đi cho máy
+        'ai': ai_status if ai_status in ('pending', 'busy') else None,
+        'ai_move': ai_move
+    }
+
+
+def api_room_state(room):
+    version, game = room.view()
+    if game is None:
+        return None
+    username = session['username']
+    players = list(game['players'])
+    return {
+        'status': 'ok',
+        'mode': 'player',
+        'room': room.id,
+        'version': version,
+        'board': api_board(game['board']),
+        'size': game['size'],
+        'win_length': game['win_length'],
+        'player': ('X', 'O')[players.index(username)] if username in players else None,
+        'players': players,
+        'ready': dict(game['ready']),
+        'continue': dict(game['continue']),
+        'turn': game['turn'],
+        'game_over': game['game_over'],
+        'message': game['message']
+    }
+
+
+def api_state_response(state):
+    # Phản hồi có ETag theo nội dung: người hỏi lại với If-None-Match nhận 304
+    response = jsonify(state)
+    response.set_etag(hashlib.blake2b(response.get_data(), digest_size=8).hexdigest())
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
+
+
+def api_game_state(ai_status=None, ai_move=None):
+    # Trạng thái ván hiện tại theo chế độ; với người chơi máy, bắt đầu ván mới nếu chưa có
+    if session.get('mode') == 'ai':
+        start_ai_game()
+        if (ai_status is None and session['turn'] == session['ai_symbol']
+                and not session.get('game_over')):
+            ai_status = collect_ai_move(wait=0)
+        return api_ai_state(ai_status, ai_move)
+    room = room_manager.room_of(session['username'])
+    if room is None:
+        room, _ = room_manager.matchmake(session['username'], session.get('board_size', 3),
+                                         session.get('win_length', 3))
+    return api_room_state(room)
+
+
+def wait_ai_move():
+    # Chờ nước đáp của máy trong cùng request; trả về (trạng thái, ô máy vừa đánh)
+    before = list(session['board'])
+    ai_status = None
+    if session['turn'] == session['ai_symbol'] and not session.get('game_over'):
+        ai_status = collect_ai_move(wait=AI_TIME_BUDGET + ai_worker.JOB_GRACE)
+    changed = [i for i, cell in enumerate(session['board']) if cell != before[i]]
+    return ai_status, changed[0] if changed else None
+
+
+@app.route('/api/v1/login', methods=['POST'])
+def api_login():
+    # {"username": ..., "mode": "ai" | "player", "difficulty": ..., "board": "3x3"}
+    data = request.get_json(silent=True) or {}
+    username = data.get('username')
+    mode = data.get('mode', 'ai')
+    difficulty = data.get('difficulty', 'super_hard')
+    if not isinstance(username, str) or not username.strip():
+        return api_error('Thiếu username.', 400)
+    if mode not in ('ai', 'player'):
+        return api_error('Chế độ không hợp lệ.', 400)
+    if mode == 'ai' and difficulty not in difficulty_display:
+        return api_error('Độ khó không hợp lệ.', 400)
+    if session.get('username') not in (None, username):
+        room_manager.leave(session['username'])
+        end_ai_game()
+    elif session.get('mode') != mode or data.get('board', DEFAULT_BOARD) != session.get('board_option'):
+        end_ai_game()
+    session.rotate()
+    session['username'] = username
+    session['mode'] = mode
+    if mode == 'ai':
+        session['difficulty'] = difficulty
+    set_board_option(data.get('board', DEFAULT_BOARD))
+    session.permanent = True
+    if mode == 'ai':
+        # Máy đi trước thì chờ luôn nước đầu tiên của máy
+        start_ai_game()
+        return jsonify(api_ai_state(*wait_ai_move()))
+    state = api_game_state()
+    if state is None:
+        return api_error(ROOM_MISSING_MESSAGE, 404)
+    return jsonify(state)
+
+
+@app.route('/api/v1/state')
+def api_state():
+    if 'username' not in session:
+        return api_error('Chưa đăng nhập.', 401)
+    state = api_game_state()
+    if state is None:
+        return api_error(ROOM_MISSING_MESSAGE, 404)
+    return api_state_response(state)
+
+
+@app.route('/api/v1/move', methods=['POST'])
+def api_move():
+    # {"position": ô}; với máy, trả về luôn nước đáp (ai_move), kết quả và tỉ số
+    if 'username' not in session:
+        return api_error('Chưa đăng nhập.', 401)
+    data = request.get_json(silent=True) or {}
+    position = data.get('position')
+    if session.get('mode') != 'ai':
+        room = room_manager.room_of(session['username'])
+        if room is None:
+            return api_error('Bạn chưa ở trong phòng nào.', 409)
+        _, game = room.view()
+        if game is None:
+            return api_error(ROOM_MISSING_MESSAGE, 404)
+        if not api_position(position, game['size'] ** 2):
+            return api_error('Vị trí không hợp lệ.', 400)
+        room, error = play_room_move(session['username'], position)
+        if error is not None:
+            return api_error(error, 404 if error == ROOM_MISSING_MESSAGE else 409)
+        state = api_room_state(room)
+        if state is None:
+            return api_error(ROOM_MISSING_MESSAGE, 404)
+        return jsonify(state)
+    start_ai_game()
+    if not api_position(position, len(session['board'])):
+        return api_error('Vị trí không hợp lệ.', 400)
+    error = play_ai_game(position)
+    if error == BUSY_MESSAGE:
+        response, status = api_error(error, 503)
+        response.headers['Retry-After'] = '1'
+        return response, status
+    if error is not None:
+        return api_error(error, 409)
+    ai_status, ai_move = wait_ai_move()
+    return jsonify(api_ai_state(ai_status, ai_move))
+
+
+@app.route('/api/v1/new_game', methods=['POST'])
+def api_new_game():
+    # Ván mới với máy (như /reset); máy đi trước thì trả về cả nước của máy
+    if 'username' not in session:
+        return api_error('Chưa đăng nhập.', 401)
+    if session.get('mode') != 'ai':
+        return api_error('Chỉ dùng khi chơi với máy.', 409)
+    end_ai_game()
+    start_ai_game()
+    ai_status, ai_move = wait_ai_move()
+    return jsonify(api_ai_state(ai_status, ai_move))
+
+
+def api_room_flag(flag, message):
+    # Đánh dấu sẵn sàng / tiếp tục rồi bắt đầu hoặc đặt lại ván nếu đủ điều kiện
+    if 'username' not in session:
+        return api_error('Chưa đăng nhập.', 401)
+    username = session['username']
+    room = room_manager.room_of(username)
+    if room is None:
+        return api_error('Bạn chưa ở trong phòng nào.', 409)
+
+    def mark(game):
+        if username in game['players']:
+            game[flag][username] = True
+            game['message'] = message % username
+
+    room.update(mark)
+    # Dùng chung logic bắt đầu / đặt lại ván với trang phòng
+    _, game = room.view()
+    if game is not None and room_pending(game) is not None:
+        room.update(room_start_or_reset)
+    state = api_room_state(room)
+    if state is None:
+        return api_error(ROOM_MISSING_MESSAGE, 404)
+    return jsonify(state)
+
+
+@app.route('/api/v1/ready', methods=['POST'])
+def api_ready():
+    return api_room_flag('ready', 'Người chơi %s đã sẵn sàng.')
+
+
+@app.route('/api/v1/continue', methods=['POST'])
+def api_continue():
+    return api_room_flag('continue', 'Người chơi %s đã sẵn sàng tiếp tục.')
+
+
+def create_app():
+    # Điểm vào cho gunicorn ('tictactoe:create_app()'): làm nóng phần dùng
+    # chung trước khi fork worker khi chạy với --preload
+    startup_state.warm_app(app, board_options)
+    return app
+
+
+def warm_worker():
+    # Gọi trong mỗi worker sau khi fork (post_fork trong gunicorn.conf.py)
+    startup_state.warm_worker(ai_pool)
 
 
 if __name__ == '__main__':
-    initialize_history_file()
+    create_app()
+    warm_worker()
     app.run(debug=False)